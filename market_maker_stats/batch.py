@@ -0,0 +1,147 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import importlib
+import json
+import logging
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+TOOLS = {
+    'oasis-market-maker-chart': ('market_maker_stats.oasis_market_maker_chart', 'OasisMarketMakerChart'),
+    'oasis-market-maker-pnl': ('market_maker_stats.oasis_market_maker_pnl', 'OasisMarketMakerPnl'),
+    'oasis-market-maker-trades': ('market_maker_stats.oasis_market_maker_trades', 'OasisMarketMakerTrades'),
+    'etherdelta-market-maker-chart': ('market_maker_stats.etherdelta_market_maker_chart', 'EtherDeltaMarketMakerChart'),
+    'etherdelta-market-maker-pnl': ('market_maker_stats.etherdelta_market_maker_pnl', 'EtherDeltaMarketMakerPnl'),
+    'etherdelta-market-maker-trades': ('market_maker_stats.etherdelta_market_maker_trades', 'EtherDeltaMarketMakerTrades'),
+    '0x-market-maker-chart': ('market_maker_stats.zrx_market_maker_chart', 'ZrxMarketMakerChart'),
+    '0x-market-maker-pnl': ('market_maker_stats.zrx_market_maker_pnl', 'ZrxMarketMakerPnl'),
+    '0x-market-maker-trades': ('market_maker_stats.zrx_market_maker_trades', 'ZrxMarketMakerTrades'),
+}
+
+
+# Whether `initialize_worker` has already run in this process.
+_initialized = False
+
+
+# Prepares a worker process for running jobs. Gets called at the beginning of every job,
+# but only does anything the first time it is called in each worker process.
+def initialize_worker(workers: int):
+    assert(isinstance(workers, int))
+
+    global _initialized
+    if _initialized:
+        return
+
+    # charts can only be saved to files in worker processes, there is no way to show them
+    import matplotlib
+    matplotlib.use('Agg')
+
+    # the GDAX rate limit applies to all workers together, so each of them only gets its share of it
+    from market_maker_stats import util
+    util.gdax_rate_limiter = util.TokenBucket(rate=3 / workers, capacity=max(6 // workers, 1))
+
+    _initialized = True
+
+
+# Runs a single job in a worker process. All the caches (the event store, the block timestamp index and
+# the candle store) live in the cache folder and are safe to be used by many processes at once, so workers
+# share them with each other and with the other jobs run by the same worker.
+def run_job(tool: str, args: list, workers: int = 1) -> float:
+    assert(isinstance(tool, str))
+    assert(isinstance(args, list))
+    assert(isinstance(workers, int))
+
+    initialize_worker(workers)
+
+    module_name, class_name = TOOLS[tool]
+    tool_class = getattr(importlib.import_module(module_name), class_name)
+
+    started = time.time()
+    try:
+        tool_class(args).main()
+
+    except SystemExit as e:
+        # the tools report invalid arguments by calling `sys.exit()`, which must not kill the worker
+        raise Exception(f"{tool} exited with code {e.code}")
+
+    finally:
+        # figures are never reused between jobs, so we release their memory as soon as possible,
+        # `pyplot` only gets imported by jobs which actually draw charts
+        if 'matplotlib.pyplot' in sys.modules:
+            sys.modules['matplotlib.pyplot'].close('all')
+
+    return time.time() - started
+
+
+def load_jobs(filename: str) -> list:
+    assert(isinstance(filename, str))
+
+    with open(filename, 'r') as file:
+        spec = json.load(file)
+
+    jobs = spec['jobs'] if isinstance(spec, dict) else spec
+    defaults = spec.get('defaults', {}) if isinstance(spec, dict) else {}
+
+    for job in jobs:
+        if job['tool'] not in TOOLS:
+            raise Exception(f"Unknown tool '{job['tool']}', should be one of: {', '.join(sorted(TOOLS))}")
+
+    return [(job['tool'], defaults.get(job['tool'], []) + list(job['args'])) for job in jobs]
+
+
+class BatchRunner:
+    """Tool to run many chart, PnL and trade history jobs in parallel, each in a separate process."""
+
+    def __init__(self, args: list):
+        parser = argparse.ArgumentParser(prog='market-maker-stats-batch')
+        parser.add_argument("jobs", help="JSON file with the list of jobs to run", type=str)
+        parser.add_argument("--max-workers", help="Number of worker processes (default: number of CPUs)", type=int, default=os.cpu_count())
+
+        self.arguments = parser.parse_args(args)
+
+        logging.basicConfig(format='%(asctime)-15s %(levelname)-8s %(message)s', level=logging.INFO)
+        logging.getLogger("filelock").setLevel(logging.WARNING)
+
+    def main(self):
+        jobs = load_jobs(self.arguments.jobs)
+        failed = 0
+
+        logging.info(f"Running {len(jobs)} jobs in {self.arguments.max_workers} worker processes")
+        with ProcessPoolExecutor(max_workers=self.arguments.max_workers) as executor:
+            futures = {executor.submit(run_job, tool, args, self.arguments.max_workers): (tool, args) for tool, args in jobs}
+
+            for future in as_completed(futures):
+                tool, args = futures[future]
+                try:
+                    logging.info(f"Finished {tool} {' '.join(args)} in {future.result():.1f}s")
+                except Exception:
+                    failed += 1
+                    logging.error(f"Failed {tool} {' '.join(args)}:\n{traceback.format_exc()}")
+
+        logging.info(f"Finished {len(jobs) - failed} out of {len(jobs)} jobs")
+
+        if failed > 0:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    BatchRunner(sys.argv[1:]).main()
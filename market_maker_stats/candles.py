@@ -0,0 +1,311 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import os
+
+import filelock
+import numpy as np
+
+
+# Aggregates one-minute `candles` (sorted by timestamp) into candles spanning `resolution` seconds each,
+# aligned to multiples of `resolution`. Besides OHLC and volume, rolled up candles also have a `vwap` column,
+# the average of (low+high)/2 of all the one-minute candles weighted by their volume. If there was no volume
+# at all, it is just the plain average.
+def rollup_candles(candles: dict, resolution: int) -> dict:
+    assert(isinstance(candles, dict))
+    assert(isinstance(resolution, int))
+
+    buckets = candles['timestamp'] - candles['timestamp'] % resolution
+    if len(buckets) == 0:
+        return {name: np.array([], dtype=np.int64 if name == 'timestamp' else np.float64) for name in CandleStore.ROLLUP_COLUMNS}
+
+    starts = np.flatnonzero(np.concatenate([[True], buckets[1:] != buckets[:-1]]))
+    ends = np.append(starts[1:], len(buckets)) - 1
+    counts = ends - starts + 1
+
+    middles = (candles['low'] + candles['high']) / 2
+    volumes = np.add.reduceat(candles['volume'], starts)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vwaps = np.where(volumes > 0, np.add.reduceat(middles * candles['volume'], starts) / volumes, np.add.reduceat(middles, starts) / counts)
+
+    return {'timestamp': buckets[starts],
+            'low': np.minimum.reduceat(candles['low'], starts),
+            'high': np.maximum.reduceat(candles['high'], starts),
+            'open': candles['open'][starts],
+            'close': candles['close'][ends],
+            'volume': volumes,
+            'vwap': vwaps}
+
+
+class CandleStore:
+    """Columnar on-disk store of one-minute GDAX candles of a single product.
+
+    Each column (`timestamp`, `low`, `high`, `open`, `close` and `volume`) lives in its own `.npy` file,
+    sorted by timestamp, so reading any time range is a memory map plus a binary search. The store also
+    keeps track of which GDAX batches (identified by their start timestamps) it already contains, as some
+    batches legitimately have no candles at all.
+
+    Candles are also kept rolled up to each of `RESOLUTIONS` (see `rollup_candles`), in the same form, so long
+    time ranges can be read without going through all the one-minute candles. Only closed buckets, the ones
+    ending at or before the end of the newest one-minute candle, get stored. The last, still open bucket gets
+    rolled up on the fly when read.
+
+    Candles newer than everything in the store, which is what regular use of the tools produces, get appended
+    to the existing files in place. Only adding candles which fall before or in between the existing ones
+    rewrites whole columns.
+    """
+
+    COLUMNS = ['timestamp', 'low', 'high', 'open', 'close', 'volume']
+    ROLLUP_COLUMNS = COLUMNS + ['vwap']
+    RESOLUTIONS = [300, 3600, 86400]
+
+    def __init__(self, folder: str, product: str):
+        assert(isinstance(folder, str))
+        assert(isinstance(product, str))
+
+        self.path = os.path.join(folder, f'gdax_{product.upper()}_60')
+        os.makedirs(self.path, exist_ok=True)
+
+        self.lock = filelock.FileLock(self.path + '.lock')
+        self._columns = None
+        self._rollups = None
+        self._batches = None
+
+    def _file(self, name: str, resolution: int = 60) -> str:
+        return os.path.join(self.path, f'{name}.npy' if resolution == 60 else f'{name}_{resolution}.npy')
+
+    def _read(self, name: str, dtype, resolution: int = 60) -> np.ndarray:
+        if os.path.isfile(self._file(name, resolution)):
+            return np.load(self._file(name, resolution), mmap_mode='r')
+        else:
+            return np.array([], dtype=dtype)
+
+    def _write(self, name: str, array: np.ndarray, resolution: int = 60):
+        # we write to a temporary file first and then atomically replace the old one,
+        # so memory maps of the old version which are still in use remain valid
+        temporary_file = self._file(name, resolution) + '.tmp.npy'
+        np.save(temporary_file, array)
+        os.replace(temporary_file, self._file(name, resolution))
+
+    # Appends `array` to the end of a column in place, which takes time proportional to the size of `array`
+    # and not of the column. Data goes in before the header gets updated with the new shape, so memory maps
+    # of the old version remain valid. Falls back to rewriting the column if the new header does not fit.
+    def _append(self, name: str, array: np.ndarray, resolution: int = 60):
+        filename = self._file(name, resolution)
+        if not os.path.isfile(filename):
+            self._write(name, array, resolution)
+            return
+
+        with open(filename, 'r+b') as file:
+            if np.lib.format.read_magic(file) == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+                data_offset = file.tell()
+
+                header = io.BytesIO()
+                np.lib.format.write_array_header_1_0(header, {'descr': np.lib.format.dtype_to_descr(dtype),
+                                                              'fortran_order': fortran_order,
+                                                              'shape': (shape[0] + len(array),)})
+
+                if len(shape) == 1 and len(header.getvalue()) == data_offset:
+                    file.seek(data_offset + shape[0] * dtype.itemsize)
+                    file.write(np.ascontiguousarray(array, dtype=dtype).tobytes())
+                    file.truncate()
+                    file.flush()
+                    file.seek(0)
+                    file.write(header.getvalue())
+                    return
+
+        self._write(name, np.concatenate([self._read(name, array.dtype, resolution), array]), resolution)
+
+    def _load(self):
+        if self._columns is None:
+            with self.lock:
+                self._columns = {name: self._read(name, np.int64 if name == 'timestamp' else np.float64) for name in self.COLUMNS}
+                self._rollups = {resolution: {name: self._read(name, np.int64 if name == 'timestamp' else np.float64, resolution) for name in self.ROLLUP_COLUMNS}
+                                 for resolution in self.RESOLUTIONS}
+                self._batches = self._read('batches', np.int64)
+
+                # if the process got interrupted while appending, some columns can be longer than the others
+                self._columns = self._consistent(self._columns)
+                self._rollups = {resolution: self._consistent(rollup) for resolution, rollup in self._rollups.items()}
+
+    @staticmethod
+    def _consistent(columns: dict) -> dict:
+        length = min(len(column) for column in columns.values())
+        return {name: column[:length] for name, column in columns.items()}
+
+    def has_batch(self, batch_begin: int) -> bool:
+        assert(isinstance(batch_begin, int))
+
+        self._load()
+        index = np.searchsorted(self._batches, batch_begin)
+        return index < len(self._batches) and self._batches[index] == batch_begin
+
+    # Returns candles with timestamps between `start_timestamp` and `end_timestamp` (both inclusive), either
+    # the one-minute ones or the ones rolled up to `resolution`, which has to be one of `RESOLUTIONS`.
+    def candles(self, start_timestamp: int, end_timestamp: int, resolution: int = 60) -> dict:
+        assert(isinstance(start_timestamp, int))
+        assert(isinstance(end_timestamp, int))
+        assert(resolution == 60 or resolution in self.RESOLUTIONS)
+
+        self._load()
+        if resolution != 60:
+            self._ensure_rollup(resolution)
+
+        columns = self._columns if resolution == 60 else self._rollups[resolution]
+        timestamps = columns['timestamp']
+        begin = np.searchsorted(timestamps, start_timestamp, side='left')
+        end = np.searchsorted(timestamps, end_timestamp, side='right')
+        result = {name: column[begin:end] for name, column in columns.items()}
+
+        if resolution != 60:
+            open_bucket = self._open_bucket(resolution)
+            if open_bucket is not None and start_timestamp <= open_bucket <= end_timestamp:
+                tail = rollup_candles(self._tail(open_bucket), resolution)
+                result = {name: np.concatenate([result[name], tail[name]]) for name in self.ROLLUP_COLUMNS}
+
+        return result
+
+    # `batches` is a list of (batch_begin, data) tuples, where `data` is exactly what
+    # the GDAX API returned: [[time, low, high, open, close, volume], ...]
+    def add_batches(self, batches: list):
+        assert(isinstance(batches, list))
+
+        if len(batches) == 0:
+            return
+
+        rows = [row for _, data in batches for row in data]
+        new_data = np.array(rows, dtype=np.float64).reshape(len(rows), len(self.COLUMNS))
+
+        with self.lock:
+            self._columns = None
+            self._load()
+
+            new_timestamps, first_indices = np.unique(new_data[:, 0].astype(np.int64), return_index=True)
+            new_data = new_data[first_indices]
+
+            old_timestamps = self._columns['timestamp']
+            open_buckets = {resolution: self._open_bucket(resolution) for resolution in self.RESOLUTIONS}
+            rollups_exist = {resolution: os.path.isfile(self._file('timestamp', resolution)) for resolution in self.RESOLUTIONS}
+
+            if len(new_timestamps) > 0 and (len(old_timestamps) == 0 or new_timestamps[0] > old_timestamps[-1]):
+                self._append_candles(new_timestamps, new_data, open_buckets, rollups_exist)
+            elif len(new_timestamps) > 0:
+                self._merge_candles(new_timestamps, new_data, open_buckets, rollups_exist)
+
+            self._write('batches', np.union1d(self._batches, np.array([batch_begin for batch_begin, _ in batches], dtype=np.int64)))
+
+            self._columns = None
+            self._load()
+
+    # All the new candles are newer than the existing ones, so neither the one-minute columns nor the rollups
+    # need anything more than appending. Closed rollup buckets can not receive any of the new candles, and
+    # the bucket which was open before will be stored for the first time if it got closed now.
+    def _append_candles(self, new_timestamps: np.ndarray, new_data: np.ndarray, open_buckets: dict, rollups_exist: dict):
+        for index, name in enumerate(self.COLUMNS):
+            self._append(name, new_timestamps if name == 'timestamp' else new_data[:, index])
+
+        self._columns = None
+        self._load()
+
+        for resolution in self.RESOLUTIONS:
+            if rollups_exist[resolution]:
+                first_bucket = open_buckets[resolution] if open_buckets[resolution] is not None else new_timestamps[0] - new_timestamps[0] % resolution
+                rollup = self._closed(rollup_candles(self._tail(first_bucket), resolution), resolution)
+                for name in self.ROLLUP_COLUMNS:
+                    self._append(name, rollup[name], resolution)
+            else:
+                self._build_rollup(resolution)
+
+    def _merge_candles(self, new_timestamps: np.ndarray, new_data: np.ndarray, open_buckets: dict, rollups_exist: dict):
+        timestamps = np.concatenate([self._columns['timestamp'], new_timestamps])
+        order = np.argsort(timestamps, kind='stable')
+        timestamps, first_indices = np.unique(timestamps[order], return_index=True)
+        indices = order[first_indices]
+
+        for index, name in enumerate(self.COLUMNS):
+            if name == 'timestamp':
+                self._write(name, timestamps)
+            else:
+                self._write(name, np.concatenate([self._columns[name], new_data[:, index]])[indices])
+
+        self._columns = None
+        self._load()
+
+        for resolution in self.RESOLUTIONS:
+            if rollups_exist[resolution]:
+                touched = new_timestamps - new_timestamps % resolution
+                if open_buckets[resolution] is not None:
+                    touched = np.append(touched, open_buckets[resolution])
+
+                self._update_rollup(resolution, touched)
+            else:
+                self._build_rollup(resolution)
+
+    # Returns the start of the last bucket of the `resolution` rollup if it is still open, `None` otherwise.
+    def _open_bucket(self, resolution: int):
+        timestamps = self._columns['timestamp']
+        if len(timestamps) == 0:
+            return None
+
+        bucket = int(timestamps[-1] - timestamps[-1] % resolution)
+        return bucket if bucket + resolution > timestamps[-1] + 60 else None
+
+    # One-minute candles starting at `start_timestamp`.
+    def _tail(self, start_timestamp: int) -> dict:
+        begin = np.searchsorted(self._columns['timestamp'], start_timestamp, side='left')
+        return {name: column[begin:] for name, column in self._columns.items()}
+
+    def _closed(self, rollup: dict, resolution: int) -> dict:
+        open_bucket = self._open_bucket(resolution)
+        if open_bucket is None:
+            return rollup
+
+        closed = rollup['timestamp'] != open_bucket
+        return {name: column[closed] for name, column in rollup.items()}
+
+    # Stores created before rollups were introduced only have the one-minute candles,
+    # so their rollups get built from scratch the first time they are needed.
+    def _ensure_rollup(self, resolution: int):
+        if len(self._columns['timestamp']) > 0 and not os.path.isfile(self._file('timestamp', resolution)):
+            with self.lock:
+                self._columns = None
+                self._load()
+                self._build_rollup(resolution)
+
+                self._columns = None
+                self._load()
+
+    def _build_rollup(self, resolution: int):
+        rollup = self._closed(rollup_candles(self._columns, resolution), resolution)
+        for name in self.ROLLUP_COLUMNS:
+            self._write(name, rollup[name], resolution)
+
+    # Recalculates buckets of the `resolution` rollup starting at any of `touched`.
+    def _update_rollup(self, resolution: int, touched: np.ndarray):
+        timestamps = self._columns['timestamp']
+        touched = np.unique(touched)
+        selected = np.isin(timestamps - timestamps % resolution, touched)
+        new_rollup = self._closed(rollup_candles({name: column[selected] for name, column in self._columns.items()}, resolution), resolution)
+
+        old_rollup = self._rollups[resolution]
+        kept = ~np.isin(old_rollup['timestamp'], touched)
+        order = np.argsort(np.concatenate([old_rollup['timestamp'][kept], new_rollup['timestamp']]), kind='stable')
+
+        for name in self.ROLLUP_COLUMNS:
+            self._write(name, np.concatenate([old_rollup[name][kept], new_rollup[name]])[order], resolution)
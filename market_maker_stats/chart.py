@@ -17,9 +17,11 @@
 
 from typing import List, Optional
 
+import numpy as np
 import pytz
 
-from market_maker_stats.util import Price, amount_to_size, timestamp_to_x, amount_in_usd_to_size, OrderHistoryItem
+from market_maker_stats.util import PriceSeries, amount_to_size, timestamp_to_x, timestamps_to_x, amount_in_usd_to_size, OrderHistoryItem, \
+    OrderBookSeries, price_resolution
 
 
 def initialize_charting(output: Optional[str]):
@@ -31,18 +33,16 @@ def initialize_charting(output: Optional[str]):
 # If there is a gap in the price feed history, pyplot by default links it with a straight like.
 # In order to avoid it, we add an empty price # between all values which are at least `price_gap_size` minutes apart.
 # This way a nice visual gap will be seen in the chart as well.
-def prepare_prices_for_charting(prices: List[Price], price_gap_size: int) -> List[Price]:
+def prepare_prices_for_charting(prices: PriceSeries, price_gap_size: int) -> PriceSeries:
     if len(prices) == 0:
         return prices
 
-    result = [prices[0]]
-    for i in range(1, len(prices)):
-        if prices[i].timestamp - prices[i-1].timestamp > price_gap_size:
-            result.append(Price(prices[i-1].timestamp + 1, None, None, None, None))
-
-        result.append(prices[i])
-
-    return result
+    gaps = prices.gaps(price_gap_size)
+    return PriceSeries(timestamps=np.insert(prices.timestamps, gaps, prices.timestamps[gaps-1] + 1),
+                       prices=np.insert(prices.prices, gaps, np.nan),
+                       buy_prices=np.insert(prices.buy_prices, gaps, np.nan),
+                       sell_prices=np.insert(prices.sell_prices, gaps, np.nan),
+                       volumes=np.insert(prices.volumes, gaps, np.nan))
 
 
 # Same for order history actually.
@@ -60,12 +60,58 @@ def prepare_order_history_for_charting(items: List[OrderHistoryItem]) -> List[Or
     return result
 
 
+# Width of the chart in pixels, i.e. the number of distinct x positions it is worth drawing samples at.
+def chart_width(output: Optional[str]) -> int:
+    import matplotlib.pyplot as plt
+
+    figure = plt.gcf()
+    return int(figure.get_size_inches()[0] * (300 if output else figure.dpi))
+
+
+# Coarsest price resolution (in seconds) which still gives at least one price sample per pixel of the chart.
+def chart_price_resolution(start_timestamp: int, end_timestamp: int) -> int:
+    import matplotlib
+
+    width = int(matplotlib.rcParams['figure.figsize'][0] * 300)
+    return price_resolution(max((end_timestamp - start_timestamp) // width, 60))
+
+
+# Reduces a line to at most four samples per each of `buckets` equal time intervals between `start_timestamp` and
+# `end_timestamp`: the first, the last, the lowest and the highest one. As each bucket is no wider than a pixel,
+# the line looks the same, but the number of samples no longer grows with the time range. NaN samples, which mark
+# gaps in the line, are always kept and samples on each side of them never end up in the same bucket.
+def downsample(timestamps: np.ndarray, values: np.ndarray, start_timestamp: int, end_timestamp: int, buckets: int) -> tuple:
+    assert(isinstance(timestamps, np.ndarray))
+    assert(isinstance(values, np.ndarray))
+    assert(isinstance(buckets, int))
+
+    if len(timestamps) <= 4 * buckets or end_timestamp <= start_timestamp:
+        return timestamps, values
+
+    bucket_indices = ((timestamps - start_timestamp) * buckets) // (end_timestamp - start_timestamp)
+    gaps = np.isnan(values)
+    group_starts = np.ones(len(timestamps), dtype=bool)
+    group_starts[1:] = (bucket_indices[1:] != bucket_indices[:-1]) | gaps[1:] | gaps[:-1]
+    groups = np.cumsum(group_starts) - 1
+
+    first = np.flatnonzero(group_starts)
+    last = np.append(first[1:] - 1, len(timestamps) - 1)
+
+    # sorting by group and then by value gives the lowest value of each group first and the highest one last
+    by_value = np.lexsort((values, groups))
+    lowest = by_value[first]
+    highest = by_value[last]
+
+    keep = np.unique(np.concatenate([first, last, lowest, highest]))
+    return timestamps[keep], values[keep]
+
+
 def draw_chart(start_timestamp: int,
                end_timestamp: int,
-               prices: List[Price],
-               alternative_prices: List[Price],
+               prices: PriceSeries,
+               alternative_prices: PriceSeries,
                price_gap_size: int,
-               order_history: list,
+               order_book: OrderBookSeries,
                our_trades: list,
                all_trades: list,
                output: Optional[str]):
@@ -78,14 +124,13 @@ def draw_chart(start_timestamp: int,
     ax.set_xlim(left=timestamp_to_x(start_timestamp), right=timestamp_to_x(end_timestamp))
     ax.xaxis.set_major_formatter(md.DateFormatter('%d-%b %H:%M', tz=pytz.UTC))
 
-    timestamps = list(map(timestamp_to_x, map(lambda item: item.timestamp, order_history)))
-    closest_sell_prices = list(map(lambda item: item.closest_sell_price(), order_history))
-    closest_buy_prices = list(map(lambda item: item.closest_buy_price(), order_history))
+    timestamps = timestamps_to_x(order_book.timestamps)
 
-    plt.plot_date(timestamps, closest_sell_prices, 'b-', zorder=2, linewidth=1)
-    plt.plot_date(timestamps, closest_buy_prices, 'g-', zorder=2, linewidth=1)
+    # closest prices stay the same until the next sample, so they are drawn as step functions
+    plt.plot_date(timestamps, order_book.closest_sell_prices, 'b-', zorder=2, linewidth=1, drawstyle='steps-post')
+    plt.plot_date(timestamps, order_book.closest_buy_prices, 'g-', zorder=2, linewidth=1, drawstyle='steps-post')
 
-    draw_prices(prices, alternative_prices, price_gap_size)
+    draw_prices(start_timestamp, end_timestamp, prices, alternative_prices, price_gap_size, chart_width(output))
     draw_trades(our_trades, all_trades)
 
     if output:
@@ -94,33 +139,31 @@ def draw_chart(start_timestamp: int,
         plt.show()
 
 
-def draw_prices(prices, alternative_prices, price_gap_size):
+def draw_prices(start_timestamp: int, end_timestamp: int, prices: PriceSeries, alternative_prices: PriceSeries, price_gap_size: int, width: int):
     import matplotlib.pyplot as plt
 
+    def draw_line(timestamps: np.ndarray, values: np.ndarray, style: str, zorder: int):
+        timestamps, values = downsample(timestamps, values, start_timestamp, end_timestamp, width)
+        plt.plot_date(timestamps_to_x(timestamps), values, style, zorder=zorder)
+
     if len(prices) > 0:
         prices = prepare_prices_for_charting(prices, price_gap_size)
-        timestamps = list(map(lambda price: timestamp_to_x(price.timestamp), prices))
-        buy_prices = list(map(lambda price: price.buy_price if price.buy_price is not None else price.price, prices))
-        sell_prices = list(map(lambda price: price.sell_price if price.sell_price is not None else price.price, prices))
 
-        plt.plot_date(timestamps, buy_prices, 'c-', zorder=2)
-        plt.plot_date(timestamps, sell_prices, 'r-', zorder=2)
+        draw_line(prices.timestamps, prices.buy_or_mid_prices(), 'c-', 2)
+        draw_line(prices.timestamps, prices.sell_or_mid_prices(), 'r-', 2)
 
     if len(alternative_prices) > 0:
         alternative_prices = prepare_prices_for_charting(alternative_prices, price_gap_size)
-        timestamps = list(map(lambda price: timestamp_to_x(price.timestamp), alternative_prices))
-        buy_prices = list(map(lambda price: price.buy_price if price.buy_price is not None else price.price, alternative_prices))
-        sell_prices = list(map(lambda price: price.sell_price if price.sell_price is not None else price.price, alternative_prices))
 
-        plt.plot_date(timestamps, buy_prices, 'y-', zorder=1)
-        plt.plot_date(timestamps, sell_prices, 'y-', zorder=1)
+        draw_line(alternative_prices.timestamps, alternative_prices.buy_or_mid_prices(), 'y-', 1)
+        draw_line(alternative_prices.timestamps, alternative_prices.sell_or_mid_prices(), 'y-', 1)
 
 
 def draw_trades(our_trades, all_trades):
     import matplotlib.pyplot as plt
 
-    def to_timestamp(price_or_trade):
-        return timestamp_to_x(price_or_trade.timestamp)
+    def to_x(trades: list) -> np.ndarray:
+        return timestamps_to_x(np.array([trade.timestamp for trade in trades], dtype=np.int64))
 
     def to_price(trade):
         return trade.price
@@ -129,18 +172,18 @@ def draw_trades(our_trades, all_trades):
         return amount_to_size(trade)
 
     sell_trades = list(filter(lambda trade: trade.is_sell is True, our_trades))
-    sell_x = list(map(to_timestamp, sell_trades))
+    sell_x = to_x(sell_trades)
     sell_y = list(map(to_price, sell_trades))
     sell_s = list(map(to_size, sell_trades))
     plt.scatter(x=sell_x, y=sell_y, s=sell_s, c='blue', zorder=4)
 
     buy_trades = list(filter(lambda trade: trade.is_sell is False, our_trades))
-    buy_x = list(map(to_timestamp, buy_trades))
+    buy_x = to_x(buy_trades)
     buy_y = list(map(to_price, buy_trades))
     buy_s = list(map(to_size, buy_trades))
     plt.scatter(x=buy_x, y=buy_y, s=buy_s, c='green', zorder=4)
 
-    all_x = list(map(to_timestamp, all_trades))
+    all_x = to_x(all_trades)
     all_y = list(map(to_price, all_trades))
     all_s = list(map(to_size, all_trades))
     plt.scatter(x=all_x, y=all_y, s=all_s, c='#ff00e5', zorder=3)
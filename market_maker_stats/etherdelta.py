@@ -19,9 +19,10 @@ from typing import List
 
 from web3 import Web3
 
-from market_maker_stats.util import get_event_timestamp
+from market_maker_stats.events import past_events, events_between
+from market_maker_stats.util import get_event_timestamp, prefetch_event_timestamps
 from pymaker import Address
-from pymaker.etherdelta import LogTrade
+from pymaker.etherdelta import EtherDelta, LogTrade
 from pymaker.numeric import Wad
 
 
@@ -35,6 +36,16 @@ class Trade:
         self.taker = taker
 
 
+def past_trade(etherdelta: EtherDelta, number_of_past_blocks: int, event_filter: dict = None) -> List[LogTrade]:
+    assert(isinstance(etherdelta, EtherDelta))
+    return past_events(etherdelta.web3, etherdelta.address, EtherDelta.abi, 'Trade', LogTrade, number_of_past_blocks, event_filter)
+
+
+def trade_between(etherdelta: EtherDelta, from_block: int, to_block: int, event_filter: dict = None) -> List[LogTrade]:
+    assert(isinstance(etherdelta, EtherDelta))
+    return events_between(etherdelta.web3, etherdelta.address, EtherDelta.abi, 'Trade', LogTrade, from_block, to_block, event_filter)
+
+
 def etherdelta_trades(infura: Web3, market_maker_address: Address, sai_address: Address, eth_address: Address, past_trades: List[LogTrade]) -> list:
     assert(isinstance(infura, Web3))
     assert(isinstance(market_maker_address, Address))
@@ -42,13 +53,17 @@ def etherdelta_trades(infura: Web3, market_maker_address: Address, sai_address:
     assert(isinstance(eth_address, Address))
     assert(isinstance(past_trades, list))
 
+    sell_events = list(filter(lambda log_trade: log_trade.maker == market_maker_address and log_trade.buy_token == sai_address and log_trade.pay_token == eth_address, past_trades))
+    buy_events = list(filter(lambda log_trade: log_trade.maker == market_maker_address and log_trade.buy_token == eth_address and log_trade.pay_token == sai_address, past_trades))
+    prefetch_event_timestamps(infura, sell_events + buy_events)
+
     def sell_trades() -> List[Trade]:
         return list(map(lambda log_trade: Trade(get_event_timestamp(infura, log_trade), log_trade.give_amount / log_trade.take_amount, log_trade.take_amount, log_trade.give_amount, True, log_trade.taker),
-                    filter(lambda log_trade: log_trade.maker == market_maker_address and log_trade.buy_token == sai_address and log_trade.pay_token == eth_address, past_trades)))
+                    sell_events))
 
     def buy_trades() -> List[Trade]:
         return list(map(lambda log_trade: Trade(get_event_timestamp(infura, log_trade), log_trade.take_amount / log_trade.give_amount, log_trade.give_amount, log_trade.take_amount, False, log_trade.taker),
-                    filter(lambda log_trade: log_trade.maker == market_maker_address and log_trade.buy_token == eth_address and log_trade.pay_token == sai_address, past_trades)))
+                    buy_events))
 
     trades = sell_trades() + buy_trades()
     return sorted(trades, key=lambda trade: trade.timestamp)
@@ -21,9 +21,9 @@ import time
 
 from web3 import Web3, HTTPProvider
 
-from market_maker_stats.chart import initialize_charting, draw_chart
-from market_maker_stats.etherdelta import etherdelta_trades
-from market_maker_stats.util import get_gdax_prices, get_block_timestamp, initialize_logging
+from market_maker_stats.chart import initialize_charting, draw_chart, chart_price_resolution
+from market_maker_stats.etherdelta import etherdelta_trades, past_trade
+from market_maker_stats.util import get_gdax_prices, get_block_timestamp, initialize_logging, PriceSeries, OrderBookSeries
 from pymaker import Address
 from pymaker.etherdelta import EtherDelta
 
@@ -61,12 +61,13 @@ class EtherDeltaMarketMakerChart:
         start_timestamp = get_block_timestamp(self.infura, self.web3.eth.blockNumber - self.arguments.past_blocks)
         end_timestamp = int(time.time())
 
-        events = self.etherdelta.past_trade(self.arguments.past_blocks, {'get': self.market_maker_address.address})
+        events = past_trade(self.etherdelta, self.arguments.past_blocks, {'get': self.market_maker_address.address})
         trades = etherdelta_trades(self.infura, self.market_maker_address, self.sai_address, self.eth_address, events)
 
-        prices = get_gdax_prices(self.arguments.gdax_price, start_timestamp, end_timestamp)
+        resolution = chart_price_resolution(start_timestamp, end_timestamp)
+        prices = get_gdax_prices(self.arguments.gdax_price, start_timestamp, end_timestamp, resolution)
 
-        draw_chart(start_timestamp, end_timestamp, prices, [], 180, [], trades, [], self.arguments.output)
+        draw_chart(start_timestamp, end_timestamp, prices, PriceSeries.empty(), max(180, 3*resolution), OrderBookSeries.empty(), trades, [], self.arguments.output)
 
 
 if __name__ == '__main__':
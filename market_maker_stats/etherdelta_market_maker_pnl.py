@@ -22,9 +22,11 @@ import time
 
 from web3 import Web3, HTTPProvider
 
-from market_maker_stats.etherdelta import etherdelta_trades
-from market_maker_stats.pnl import get_approx_vwaps, pnl_text, pnl_chart
-from market_maker_stats.util import sort_trades_for_pnl, get_gdax_prices, get_block_timestamp, get_prices
+from market_maker_stats.etherdelta import etherdelta_trades, trade_between
+from market_maker_stats.export import write_columns, daily_pnl_columns, trade_profit_columns
+from market_maker_stats.ledger import PnlLedger, pnl_ledger_key
+from market_maker_stats.pnl import get_multi_approx_vwaps, daily_pnl, stream_daily_pnl, pnl_text, pnl_chart
+from market_maker_stats.util import sort_trades_for_pnl, get_gdax_prices, get_block_timestamp, get_prices, iter_prices
 from pymaker import Address
 from pymaker.etherdelta import EtherDelta
 
@@ -44,11 +46,17 @@ class EtherDeltaMarketMakerPnl:
         parser.add_argument("--gdax-price", help="GDAX product (ETH-USD, BTC-USD) to use as the price history source", type=str)
         parser.add_argument("--price-feed", help="Price endpoint to use as the price history source", type=str)
         parser.add_argument("--price-history-file", help="File to use as the price history source", type=str)
-        parser.add_argument("--vwap-minutes", help="Rolling VWAP window size (default: 240)", type=int, default=240)
+        parser.add_argument("--vwap-minutes", help="Rolling VWAP window size(s), profit gets reported for each of them (default: 240)", type=int, nargs='+', default=[240])
         parser.add_argument("--buy-token", help="Name of the buy token", required=True, type=str)
         parser.add_argument("--sell-token", help="Name of the sell token", required=True, type=str)
         parser.add_argument("--past-blocks", help="Number of past blocks to analyze", required=True, type=int)
+        parser.add_argument("--ledger", help="Keep finalized days in a persistent PnL ledger, so subsequent runs only process new trades (text mode only). "
+                                             "When resuming from the ledger, the first day of the report covers the whole day, not only the part within --past-blocks", dest='ledger', action='store_true')
+        parser.add_argument("--stream", help="Calculate profits from prices streamed in batches, without keeping the whole price history in memory "
+                                             "(text mode only, can not be used with --ledger or --export-trades)", dest='stream', action='store_true')
         parser.add_argument("-o", "--output", help="File to save the chart or the table to", required=False, type=str)
+        parser.add_argument("--export", help="File to export daily PnL to (.csv, .npz or .parquet)", required=False, type=str)
+        parser.add_argument("--export-trades", help="File to export per-trade profits to (.csv, .npz or .parquet)", required=False, type=str)
 
         parser_mode = parser.add_mutually_exclusive_group(required=True)
         parser_mode.add_argument('--text', help="Show PnL as a text table", dest='text', action='store_true')
@@ -56,6 +64,9 @@ class EtherDeltaMarketMakerPnl:
 
         self.arguments = parser.parse_args(args)
 
+        if self.arguments.stream and (not self.arguments.text or self.arguments.ledger or self.arguments.export_trades):
+            parser.error("--stream can only be used with --text, and without --ledger and --export-trades")
+
         self.web3 = Web3(HTTPProvider(endpoint_uri=f"http://{self.arguments.rpc_host}:{self.arguments.rpc_port}",
                                       request_kwargs={'timeout': self.arguments.rpc_timeout}))
         self.infura = Web3(HTTPProvider(endpoint_uri=f"https://mainnet.infura.io/", request_kwargs={'timeout': 120}))
@@ -72,22 +83,46 @@ class EtherDeltaMarketMakerPnl:
         logging.getLogger("filelock").setLevel(logging.WARNING)
 
     def main(self):
-        start_timestamp = get_block_timestamp(self.infura, self.web3.eth.blockNumber - self.arguments.past_blocks)
+        block_number = self.web3.eth.blockNumber
+        start_timestamp = get_block_timestamp(self.infura, block_number - self.arguments.past_blocks)
         end_timestamp = int(time.time())
 
-        events = self.etherdelta.past_trade(self.arguments.past_blocks, {'get': self.market_maker_address.address})
+        # with the ledger, we only need to process trades from days which have not been finalized yet
+        ledger = PnlLedger(pnl_ledger_key('etherdelta-market-maker-pnl', self.arguments)) if self.arguments.ledger and self.arguments.text else None
+        resume_point = ledger.resume_point(start_timestamp) if ledger is not None else None
+        from_timestamp, from_block = resume_point if resume_point is not None else (start_timestamp, block_number - self.arguments.past_blocks)
+
+        events = trade_between(self.etherdelta, from_block, block_number, {'get': self.market_maker_address.address})
         trades = etherdelta_trades(self.infura, self.market_maker_address, self.sai_address, self.eth_address, events)
-        trades = sort_trades_for_pnl(trades)
+        trades = sort_trades_for_pnl(list(filter(lambda trade: trade.timestamp >= from_timestamp, trades)))
+
+        # in the streaming mode, prices get processed batch by batch separately for each report
+        if not self.arguments.stream:
+            prices = get_prices(self.arguments.gdax_price, self.arguments.price_feed, self.arguments.price_history_file, from_timestamp, end_timestamp)
+            vwaps = get_multi_approx_vwaps(prices, self.arguments.vwap_minutes)
+            vwaps_start = int(prices.timestamps[0])
 
-        prices = get_prices(self.arguments.gdax_price, self.arguments.price_feed, self.arguments.price_history_file, start_timestamp, end_timestamp)
-        vwaps = get_approx_vwaps(prices, self.arguments.vwap_minutes)
-        vwaps_start = prices[0].timestamp
+        if self.arguments.text or self.arguments.export:
+            if self.arguments.stream:
+                price_batches = iter_prices(self.arguments.gdax_price, self.arguments.price_feed, self.arguments.price_history_file, from_timestamp, end_timestamp)
+                days, vwaps_start = stream_daily_pnl(trades, price_batches, self.arguments.vwap_minutes)
+            else:
+                days = daily_pnl(trades, vwaps, vwaps_start)
+
+            if ledger is not None:
+                days = ledger.update(self.infura, days, vwaps, vwaps_start, start_timestamp, from_block, block_number)
 
         if self.arguments.text:
-            pnl_text(trades, vwaps, vwaps_start, self.arguments.buy_token, self.arguments.sell_token, self.arguments.vwap_minutes, self.arguments.output)
+            pnl_text(days, vwaps_start, self.arguments.buy_token, self.arguments.sell_token, self.arguments.vwap_minutes, self.arguments.output)
+
+        if self.arguments.export:
+            write_columns(daily_pnl_columns(days, self.arguments.vwap_minutes), self.arguments.export)
+
+        if self.arguments.export_trades:
+            write_columns(trade_profit_columns(trades, vwaps, vwaps_start, self.arguments.vwap_minutes), self.arguments.export_trades)
 
         if self.arguments.chart:
-            pnl_chart(start_timestamp, end_timestamp, prices, trades, vwaps, vwaps_start, self.arguments.buy_token, self.arguments.sell_token, self.arguments.output)
+            pnl_chart(start_timestamp, end_timestamp, prices, trades, vwaps, vwaps_start, self.arguments.buy_token, self.arguments.sell_token, self.arguments.vwap_minutes, self.arguments.output)
 
 
 if __name__ == '__main__':
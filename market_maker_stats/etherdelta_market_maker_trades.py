@@ -26,7 +26,8 @@ import pytz
 from texttable import Texttable
 from web3 import Web3, HTTPProvider
 
-from market_maker_stats.etherdelta import etherdelta_trades, Trade
+from market_maker_stats.etherdelta import etherdelta_trades, Trade, past_trade
+from market_maker_stats.export import write_columns, trade_columns
 from market_maker_stats.trades import text_trades, json_trades
 from market_maker_stats.util import format_timestamp, sort_trades
 from pymaker import Address
@@ -47,6 +48,7 @@ class EtherDeltaMarketMakerTrades:
         parser.add_argument("--market-maker-address", help="Ethereum account of the market maker to analyze", required=True, type=str)
         parser.add_argument("--past-blocks", help="Number of past blocks to analyze", required=True, type=int)
         parser.add_argument("-o", "--output", help="File to save the table or the JSON to", required=False, type=str)
+        parser.add_argument("--export", help="File to export trades to (.csv, .npz or .parquet)", required=False, type=str)
 
         parser_mode = parser.add_mutually_exclusive_group(required=True)
         parser_mode.add_argument('--text', help="List trades as a text table", dest='text', action='store_true')
@@ -72,7 +74,7 @@ class EtherDeltaMarketMakerTrades:
         return "DAI"
 
     def main(self):
-        past_trades = self.etherdelta.past_trade(self.arguments.past_blocks, {'get': self.market_maker_address.address})
+        past_trades = past_trade(self.etherdelta, self.arguments.past_blocks, {'get': self.market_maker_address.address})
         trades = etherdelta_trades(self.infura, self.market_maker_address, self.sai_address, self.eth_address, past_trades)
         trades = sort_trades(trades)
 
@@ -82,6 +84,9 @@ class EtherDeltaMarketMakerTrades:
         if self.arguments.json:
             json_trades(trades, self.arguments.output, include_taker=True)
 
+        if self.arguments.export:
+            write_columns(trade_columns(trades), self.arguments.export)
+
 
 if __name__ == '__main__':
     EtherDeltaMarketMakerTrades(sys.argv[1:]).main()
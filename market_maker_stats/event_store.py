@@ -0,0 +1,122 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import logging
+import os
+import sqlite3
+from contextlib import closing
+from typing import List, Optional
+
+from web3 import Web3
+
+from market_maker_stats.events import get_logs_in_chunks
+from market_maker_stats.util import cache_folder
+from pymaker import Address
+
+
+class EventStore:
+    """Local on-disk store of raw contract event logs.
+
+    For each contract address and topic filter, the store remembers the contiguous range of blocks
+    it has already downloaded, so subsequent calls only fetch the blocks it has not seen yet. The most
+    recent `confirmations` blocks are never stored, they get fetched from the node every time instead
+    so chain reorganizations can not leave stale events behind.
+    """
+
+    def __init__(self, web3: Web3, confirmations: int = 12, filename: Optional[str] = None):
+        assert(isinstance(web3, Web3))
+        assert(isinstance(confirmations, int))
+        assert(isinstance(filename, str) or (filename is None))
+
+        self.web3 = web3
+        self.confirmations = confirmations
+        self.filename = filename if filename is not None else os.path.join(cache_folder(), 'events.db')
+
+        with closing(self._connect()) as connection, connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS logs (contract TEXT, topics TEXT, block_number INTEGER, "
+                               "log_index INTEGER, log TEXT, PRIMARY KEY (contract, topics, block_number, log_index))")
+            connection.execute("CREATE TABLE IF NOT EXISTS ranges (contract TEXT, topics TEXT, from_block INTEGER, "
+                               "to_block INTEGER, PRIMARY KEY (contract, topics))")
+
+    def _connect(self):
+        return sqlite3.connect(self.filename, timeout=60)
+
+    def past_logs(self, contract_address: Address, topics: list, number_of_past_blocks: int) -> List[dict]:
+        assert(isinstance(contract_address, Address))
+        assert(isinstance(topics, list))
+        assert(isinstance(number_of_past_blocks, int))
+
+        block_number = self.web3.eth.blockNumber
+        return self.logs(contract_address, topics, max(block_number - number_of_past_blocks, 0), block_number)
+
+    # All the logs get downloaded before the database gets written to, and then written in one short transaction,
+    # so other processes using the same store never have to wait for the node while we hold the write lock.
+    def logs(self, contract_address: Address, topics: list, from_block: int, to_block: int) -> List[dict]:
+        assert(isinstance(contract_address, Address))
+        assert(isinstance(topics, list))
+        assert(isinstance(from_block, int))
+        assert(isinstance(to_block, int))
+
+        contract = contract_address.address.lower()
+        topics_key = json.dumps(topics)
+        safe_block = min(self.web3.eth.blockNumber - self.confirmations, to_block)
+
+        if safe_block < from_block:
+            return get_logs_in_chunks(self.web3, contract_address, topics, from_block, to_block)
+
+        with closing(self._connect()) as connection:
+            stored_range = connection.execute("SELECT from_block, to_block FROM ranges WHERE contract = ? AND topics = ?",
+                                              (contract, topics_key)).fetchone()
+
+        # We only keep one contiguous range of blocks. If the requested range is disjoint from the stored one,
+        # the gap between them gets downloaded as well, so the blocks stored already never get thrown away.
+        if stored_range is None:
+            missing_ranges = [(from_block, safe_block)]
+            new_range = (from_block, safe_block)
+        else:
+            stored_from, stored_to = stored_range
+            missing_ranges = [(from_block, stored_from - 1), (stored_to + 1, safe_block)]
+            new_range = (min(from_block, stored_from), max(safe_block, stored_to))
+
+        missing_ranges = list(filter(lambda missing_range: missing_range[0] <= missing_range[1], missing_ranges))
+        new_logs = [log for missing_from, missing_to in missing_ranges for log in self._fetch(contract_address, topics, missing_from, missing_to)]
+
+        with closing(self._connect()) as connection:
+            if len(missing_ranges) > 0:
+                with connection:
+                    connection.executemany("INSERT OR REPLACE INTO logs (contract, topics, block_number, log_index, log) VALUES (?, ?, ?, ?, ?)",
+                                           map(lambda log: (contract, topics_key, log['blockNumber'], log['logIndex'], json.dumps(log)), new_logs))
+
+                    # another process may have extended the stored range in the meantime
+                    current_range = connection.execute("SELECT from_block, to_block FROM ranges WHERE contract = ? AND topics = ?",
+                                                       (contract, topics_key)).fetchone()
+                    if current_range is not None and current_range[0] <= new_range[1] + 1 and current_range[1] >= new_range[0] - 1:
+                        new_range = (min(new_range[0], current_range[0]), max(new_range[1], current_range[1]))
+
+                    connection.execute("INSERT OR REPLACE INTO ranges (contract, topics, from_block, to_block) VALUES (?, ?, ?, ?)",
+                                       (contract, topics_key, new_range[0], new_range[1]))
+
+            rows = connection.execute("SELECT log FROM logs WHERE contract = ? AND topics = ? AND block_number BETWEEN ? AND ? "
+                                      "ORDER BY block_number, log_index", (contract, topics_key, from_block, safe_block)).fetchall()
+
+        return list(map(lambda row: json.loads(row[0]), rows)) + \
+               get_logs_in_chunks(self.web3, contract_address, topics, safe_block + 1, to_block)
+
+    def _fetch(self, contract_address: Address, topics: list, from_block: int, to_block: int) -> List[dict]:
+        logging.info(f"Syncing events of {contract_address} from block #{from_block} to block #{to_block}")
+        return get_logs_in_chunks(self.web3, contract_address, topics, from_block, to_block)
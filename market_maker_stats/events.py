@@ -0,0 +1,205 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+import requests
+from eth_utils import event_abi_to_log_topic, encode_hex
+from web3 import Web3
+from web3.utils.events import get_event_data
+
+from market_maker_stats.util import to_hex
+from pymaker import Address
+
+
+def find_event_abi(contract_abi: list, event_name: str) -> dict:
+    assert(isinstance(contract_abi, list))
+    assert(isinstance(event_name, str))
+
+    for item in contract_abi:
+        if item.get('type') == 'event' and item.get('name') == event_name:
+            return item
+
+    raise Exception(f"Event '{event_name}' not found in the contract ABI")
+
+
+def event_topic(event_abi: dict) -> str:
+    return encode_hex(event_abi_to_log_topic(event_abi))
+
+
+# Raw logs are kept in a JSON-friendly form (hex strings and ints only), so they can be
+# stored on disk as they are and decoded into events only when actually needed.
+def normalize_log(log) -> dict:
+    return {'address': to_hex(log['address']),
+            'blockHash': to_hex(log['blockHash']),
+            'blockNumber': int(log['blockNumber']),
+            'transactionHash': to_hex(log['transactionHash']),
+            'transactionIndex': int(log['transactionIndex']),
+            'logIndex': int(log['logIndex']),
+            'topics': list(map(to_hex, log['topics'])),
+            'data': to_hex(log['data'])}
+
+
+def get_logs(web3: Web3, contract_address: Address, topics: list, from_block: int, to_block: int) -> List[dict]:
+    assert(isinstance(web3, Web3))
+    assert(isinstance(contract_address, Address))
+    assert(isinstance(topics, list))
+    assert(isinstance(from_block, int))
+    assert(isinstance(to_block, int))
+
+    if from_block > to_block:
+        return []
+
+    logs = web3.manager.request_blocking("eth_getLogs", [{'address': contract_address.address,
+                                                          'topics': topics,
+                                                          'fromBlock': hex(from_block),
+                                                          'toBlock': hex(to_block)}])
+
+    return list(map(normalize_log, logs))
+
+
+# Fetches logs from the `from_block`..`to_block` range by splitting it into `chunk_size` blocks long chunks,
+# which are then fetched concurrently on a pool of `max_workers` threads. If the node rejects a chunk
+# as too large (or times out on it), that chunk gets split in half and each half is retried separately.
+# All the chunks fetched afterwards are no larger than these halves, so we do not keep hitting the same
+# limit over and over again. Logs are always returned in block order.
+def get_logs_in_chunks(web3: Web3, contract_address: Address, topics: list, from_block: int, to_block: int,
+                       chunk_size: int = 5000, max_workers: int = 4) -> List[dict]:
+    assert(isinstance(chunk_size, int))
+    assert(isinstance(max_workers, int))
+
+    lock = threading.Lock()
+    state = {'next_block': from_block, 'chunk_size': chunk_size}
+
+    def next_chunk() -> Optional[tuple]:
+        with lock:
+            if state['next_block'] > to_block:
+                return None
+
+            chunk = (state['next_block'], min(state['next_block'] + state['chunk_size'] - 1, to_block))
+            state['next_block'] = chunk[1] + 1
+            return chunk
+
+    def fetch_chunk(chunk: tuple) -> List[dict]:
+        chunk_from, chunk_to = chunk
+        try:
+            return get_logs(web3, contract_address, topics, chunk_from, chunk_to)
+        except (ValueError, requests.exceptions.Timeout) as e:
+            if chunk_from == chunk_to:
+                raise
+
+            chunk_middle = (chunk_from + chunk_to) // 2
+            with lock:
+                state['chunk_size'] = min(state['chunk_size'], chunk_middle - chunk_from + 1)
+
+            logging.info(f"Fetching logs from block #{chunk_from} to block #{chunk_to} failed ({e}), splitting the range in half")
+            return fetch_chunk((chunk_from, chunk_middle)) + fetch_chunk((chunk_middle + 1, chunk_to))
+
+    def fetch_chunks() -> List[dict]:
+        result = []
+        chunk = next_chunk()
+        while chunk is not None:
+            result.extend(fetch_chunk(chunk))
+            chunk = next_chunk()
+
+        return result
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(fetch_chunks) for _ in range(max_workers)]
+        logs = [log for future in futures for log in future.result()]
+
+    return sorted(logs, key=lambda log: (log['blockNumber'], log['logIndex']))
+
+
+def encode_topic(abi_type: str, value) -> str:
+    if abi_type == 'address':
+        return '0x' + value.lower().replace('0x', '').rjust(64, '0')
+    elif abi_type.startswith('uint') or abi_type.startswith('int'):
+        return '0x' + format(value, '064x')
+    else:
+        return to_hex(value)
+
+
+# Converts a pymaker-style `event_filter` dictionary into log topics and a client-side filter.
+# Values of indexed arguments become topics, so the node does the filtering. Filters on arguments
+# which are not indexed can not be handled by the node, so these get applied on decoded events.
+# A list of values means any of these values will match.
+def event_filter_topics(event_abi: dict, event_filter: Optional[dict]) -> tuple:
+    assert(isinstance(event_abi, dict))
+    assert(isinstance(event_filter, dict) or (event_filter is None))
+
+    event_filter = event_filter if event_filter is not None else {}
+
+    def as_list(value) -> list:
+        return value if isinstance(value, list) else [value]
+
+    topics = [event_topic(event_abi)]
+    for argument in filter(lambda argument: argument['indexed'], event_abi['inputs']):
+        if argument['name'] in event_filter:
+            topics.append(list(map(lambda value: encode_topic(argument['type'], value), as_list(event_filter[argument['name']]))))
+        else:
+            topics.append(None)
+
+    while topics[-1] is None:
+        topics.pop()
+
+    def normalize(value):
+        return value.lower() if isinstance(value, str) else value
+
+    non_indexed = {argument['name']: list(map(normalize, as_list(event_filter[argument['name']])))
+                   for argument in event_abi['inputs'] if not argument['indexed'] and argument['name'] in event_filter}
+
+    def event_matches(event) -> bool:
+        return all(normalize(event['args'][name]) in values for name, values in non_indexed.items())
+
+    return topics, event_matches
+
+
+def past_events(web3: Web3, contract_address: Address, contract_abi: list, event_name: str, cls: type,
+                number_of_past_blocks: int, event_filter: Optional[dict] = None) -> list:
+    assert(isinstance(web3, Web3))
+    assert(isinstance(number_of_past_blocks, int))
+
+    block_number = web3.eth.blockNumber
+    return events_between(web3, contract_address, contract_abi, event_name, cls,
+                          max(block_number - number_of_past_blocks, 0), block_number, event_filter)
+
+
+def events_between(web3: Web3, contract_address: Address, contract_abi: list, event_name: str, cls: type,
+                   from_block: int, to_block: int, event_filter: Optional[dict] = None) -> list:
+    assert(isinstance(web3, Web3))
+    assert(isinstance(from_block, int))
+    assert(isinstance(to_block, int))
+
+    event_abi = find_event_abi(contract_abi, event_name)
+    topics, event_matches = event_filter_topics(event_abi, event_filter)
+
+    logs = get_logs_in_chunks(web3, contract_address, topics, from_block, to_block)
+    events = list(filter(event_matches, decode_logs(event_abi, logs)))
+
+    return list(map(cls, events))
+
+
+def decode_logs(event_abi: dict, logs: List[dict], cls: Optional[type] = None) -> list:
+    assert(isinstance(event_abi, dict))
+    assert(isinstance(logs, list))
+
+    events = map(lambda log: get_event_data(event_abi, log), logs)
+    return list(map(cls, events)) if cls is not None else list(events)
@@ -0,0 +1,126 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import csv
+import os
+from typing import List
+
+import numpy as np
+
+from market_maker_stats.pnl import prepare_trades_for_pnl, calculate_pnl
+
+
+# Trades as columns, one NumPy array per field. `is_sell` is 1 for sells, 0 for buys and -1 if unknown.
+def trade_columns(trades: list) -> dict:
+    assert(isinstance(trades, list))
+
+    def text(value) -> str:
+        return str(value) if value is not None else ''
+
+    return {'timestamp': np.array([trade.timestamp for trade in trades], dtype=np.int64),
+            'exchange': np.array([text(getattr(trade, 'exchange', None)) for trade in trades], dtype=np.str_),
+            'pair': np.array([text(getattr(trade, 'pair', None)) for trade in trades], dtype=np.str_),
+            'maker': np.array([text(getattr(trade, 'maker', None)) for trade in trades], dtype=np.str_),
+            'taker': np.array([text(getattr(trade, 'taker', None)) for trade in trades], dtype=np.str_),
+            'is_sell': np.array([1 if trade.is_sell is True else 0 if trade.is_sell is False else -1 for trade in trades], dtype=np.int8),
+            'price': np.array([float(trade.price) for trade in trades], dtype=np.float64),
+            'amount': np.array([float(trade.amount) for trade in trades], dtype=np.float64),
+            'money': np.array([float(trade.money) for trade in trades], dtype=np.float64)}
+
+
+def profit_column_names(vwap_minutes: List[int]) -> List[str]:
+    if len(vwap_minutes) == 1:
+        return ['profit']
+    else:
+        return [f'profit_{window}m' for window in vwap_minutes]
+
+
+# Trades (sorted by timestamp) together with the profit of each of them, one profit column per VWAP window.
+# Profits of trades which could not be calculated, either because of missing price information or because
+# the trade falls into the last VWAP window, are NaN.
+def trade_profit_columns(trades: list, vwaps: List[np.ndarray], vwaps_start: int, vwap_minutes: List[int]) -> dict:
+    assert(isinstance(trades, list))
+    assert(isinstance(vwaps, list))
+    assert(isinstance(vwaps_start, int))
+    assert(isinstance(vwap_minutes, list))
+
+    trades = sorted(trades, key=lambda trade: trade.timestamp)
+    columns = trade_columns(trades)
+
+    pnl_trades, pnl_prices, pnl_timestamps = prepare_trades_for_pnl(trades)
+    for name, window_vwaps in zip(profit_column_names(vwap_minutes), vwaps):
+        profits = np.full(len(trades), np.nan)
+        if vwaps_start != -1:
+            trade_profits = calculate_pnl(pnl_trades, pnl_prices, pnl_timestamps, window_vwaps, vwaps_start)
+            profits[:len(trade_profits)] = trade_profits
+
+        columns[name] = profits
+
+    return columns
+
+
+# Daily aggregates, as returned by `daily_pnl`, as columns.
+def daily_pnl_columns(days: dict, vwap_minutes: List[int]) -> dict:
+    assert(isinstance(days, dict))
+    assert(isinstance(vwap_minutes, list))
+
+    columns = {'day': np.array(days['days'], dtype=np.str_),
+               'timestamp': np.asarray(days['timestamps'], dtype=np.int64),
+               'trades': np.asarray(days['counts'], dtype=np.int64),
+               'volume': days['volumes'],
+               'bought': days['bought'],
+               'sold': days['sold'],
+               'net_bought': days['nets'],
+               'cumulative_net_bought': np.cumsum(days['nets'])}
+
+    for name, profits in zip(profit_column_names(vwap_minutes), days['profits']):
+        columns[name] = profits
+
+    columns['missing_profits'] = np.asarray(days['missing_profits'], dtype=bool)
+    return columns
+
+
+# Writes `columns` to `filename`, in a format depending on its extension:
+# * `.npz` - NumPy arrays, can be loaded back with `np.load()` without any parsing,
+# * `.parquet` - Apache Parquet, requires `pyarrow` to be installed,
+# * `.csv` - comma separated values, with a header row.
+def write_columns(columns: dict, filename: str):
+    assert(isinstance(columns, dict))
+    assert(isinstance(filename, str))
+
+    extension = os.path.splitext(filename)[1].lower()
+
+    if extension == '.npz':
+        np.savez(filename, **columns)
+
+    elif extension == '.parquet':
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise Exception("Exporting to Parquet requires the `pyarrow` package to be installed")
+
+        pyarrow.parquet.write_table(pyarrow.table({name: column for name, column in columns.items()}), filename)
+
+    elif extension == '.csv':
+        with open(filename, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(list(columns.keys()))
+            writer.writerows(zip(*[column.tolist() for column in columns.values()]))
+
+    else:
+        raise Exception(f"Unsupported export format '{extension}', should be one of: .npz, .parquet, .csv")
@@ -0,0 +1,166 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import json
+import logging
+import os
+from typing import List, Optional
+
+import filelock
+import numpy as np
+from web3 import Web3
+
+from market_maker_stats.pnl import concatenate_daily_pnl
+from market_maker_stats.util import cache_folder, get_block_timestamp, get_block_number_at
+
+DAY = 86400
+
+
+class PnlLedger:
+    """Persistent ledger of finalized daily PnL aggregates.
+
+    A day is finalized once all of its trades are in confirmed blocks and prices are known far enough
+    into the future for every VWAP window to be calculated. Aggregates of finalized days never change,
+    so they get stored in the ledger together with the first block which may still contain trades from
+    days which have not been finalized yet. Subsequent runs only need to process trades from that block
+    onwards, which usually means the last day plus the trailing VWAP window.
+
+    The ledger always covers a contiguous range of days. Each tool invocation (tool, market, market maker,
+    price source and VWAP windows) gets a separate ledger, identified by `key`.
+
+    Only whole days get stored, so when a report gets resumed from the ledger its first day covers the whole
+    day, while without the ledger it only covers the part of the day after the start of the report.
+    """
+
+    def __init__(self, key: str, confirmations: int = 12, filename: Optional[str] = None):
+        assert(isinstance(key, str))
+        assert(isinstance(confirmations, int))
+        assert(isinstance(filename, str) or (filename is None))
+
+        key_hash = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        self.filename = filename if filename is not None else os.path.join(cache_folder(), f'pnl_ledger_{key_hash}.json')
+        self.confirmations = confirmations
+        self.lock = filelock.FileLock(self.filename + '.lock')
+        self.state = self._read()
+
+    def _read(self) -> Optional[dict]:
+        with self.lock:
+            if os.path.isfile(self.filename):
+                with open(self.filename, 'r') as file:
+                    return json.load(file)
+            else:
+                return None
+
+    def _write(self, state: dict):
+        with self.lock:
+            temporary_file = self.filename + '.tmp'
+            with open(temporary_file, 'w') as file:
+                json.dump(state, file)
+
+            os.replace(temporary_file, self.filename)
+
+        self.state = state
+
+    # Returns the (timestamp, block_number) tuple from which trades and prices have to be processed for
+    # a report starting at `start_timestamp`, or `None` if the ledger can not be used for that report.
+    def resume_point(self, start_timestamp: int) -> Optional[tuple]:
+        assert(isinstance(start_timestamp, int))
+
+        if self.state is None:
+            return None
+
+        first_day = start_timestamp - start_timestamp % DAY
+        if self.state['covered_from'] > first_day or self.state['finalized_until'] <= first_day:
+            return None
+
+        return self.state['finalized_until'], self.state['resume_block']
+
+    def _finalized_days(self, start_timestamp: int, windows: int) -> dict:
+        first_day = start_timestamp - start_timestamp % DAY
+        records = [record for record in self.state['days'] if record['timestamp'] >= first_day] if self.state is not None else []
+
+        return {'days': [record['day'] for record in records],
+                'timestamps': np.array([record['timestamp'] for record in records], dtype=np.int64),
+                'counts': np.array([record['count'] for record in records], dtype=np.int64),
+                'volumes': np.array([record['volume'] for record in records], dtype=np.float64),
+                'bought': np.array([record['bought'] for record in records], dtype=np.float64),
+                'sold': np.array([record['sold'] for record in records], dtype=np.float64),
+                'nets': np.array([record['bought'] - record['sold'] for record in records], dtype=np.float64),
+                'profits': [np.array([record['profits'][index] for record in records], dtype=np.float64) for index in range(windows)],
+                'missing_profits': np.array([record['missing_profits'] for record in records], dtype=bool)}
+
+    # Records newly finalized days from `days` (as returned by `daily_pnl`), which were calculated from
+    # trades from blocks `from_block`..`to_block`, and returns all days of the report starting at
+    # `start_timestamp`, i.e. the finalized ones from the ledger followed by `days`.
+    def update(self, infura: Web3, days: dict, vwaps: List[np.ndarray], vwaps_start: int,
+               start_timestamp: int, from_block: int, to_block: int) -> dict:
+        assert(isinstance(infura, Web3))
+        assert(isinstance(days, dict))
+        assert(isinstance(vwaps, list))
+        assert(isinstance(vwaps_start, int))
+        assert(isinstance(start_timestamp, int))
+        assert(isinstance(from_block, int))
+        assert(isinstance(to_block, int))
+
+        resumed = self.resume_point(start_timestamp) is not None
+        report_days = concatenate_daily_pnl([self._finalized_days(start_timestamp, len(vwaps)), days]) if resumed else days
+
+        if vwaps_start == -1:
+            return report_days
+
+        # trades from `timestamp` have got VWAPs for every window if `timestamp <= vwaps_start + 60*(len(vwaps)-1)`
+        confirmed_timestamp = get_block_timestamp(infura, to_block - self.confirmations)
+        priced_timestamp = min([vwaps_start + 60*(len(window_vwaps) - 1) for window_vwaps in vwaps])
+        finalized_until = min(confirmed_timestamp, priced_timestamp + 1)
+        finalized_until = finalized_until - finalized_until % DAY
+
+        if resumed:
+            state = self.state
+        else:
+            # the first day of the report may not be complete, so it never gets finalized
+            covered_from = start_timestamp + (-start_timestamp) % DAY
+            state = {'covered_from': covered_from, 'finalized_until': covered_from, 'resume_block': from_block, 'days': []}
+
+        if finalized_until <= state['finalized_until']:
+            return report_days
+
+        for index, timestamp in enumerate(days['timestamps']):
+            if state['finalized_until'] <= timestamp < finalized_until:
+                state['days'].append({'day': days['days'][index],
+                                      'timestamp': int(timestamp),
+                                      'count': int(days['counts'][index]),
+                                      'volume': float(days['volumes'][index]),
+                                      'bought': float(days['bought'][index]),
+                                      'sold': float(days['sold'][index]),
+                                      'profits': [float(profits[index]) for profits in days['profits']],
+                                      'missing_profits': bool(days['missing_profits'][index])})
+
+        state['finalized_until'] = finalized_until
+        state['resume_block'] = get_block_number_at(infura, finalized_until, from_block, to_block)
+
+        logging.info(f"PnL ledger finalized until {np.datetime64(finalized_until // DAY, 'D')}, next run will resume from block #{state['resume_block']}")
+        self._write(state)
+
+        return report_days
+
+
+def pnl_ledger_key(tool: str, arguments) -> str:
+    key_arguments = {name: value for name, value in sorted(vars(arguments).items())
+                     if name not in ['rpc_host', 'rpc_port', 'rpc_timeout', 'past_blocks', 'output', 'export', 'export_trades', 'text', 'chart', 'ledger']}
+
+    return json.dumps([tool, key_arguments])
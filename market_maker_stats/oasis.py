@@ -15,12 +15,19 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from typing import List
+import heapq
+from typing import List, Dict, Optional
 
+import numpy as np
+from eth_utils import keccak, decode_hex
+
+from market_maker_stats.event_store import EventStore
+from market_maker_stats.events import find_event_abi, decode_logs, event_filter_topics
 from market_maker_stats.model import AllTrade
+from market_maker_stats.util import OrderBookSeries
 from pymaker import Address
 from pymaker.numeric import Wad
-from pymaker.oasis import LogTake
+from pymaker.oasis import SimpleMarket, Order, LogMake, LogTake, LogKill
 
 
 class Trade:
@@ -36,28 +43,302 @@ class Trade:
         self.taker = taker
 
 
+class OasisEvents:
+    """Serves past `LogMake`, `LogTake` and `LogKill` events of an OasisDEX contract from the local event store."""
+
+    def __init__(self, otc: SimpleMarket, event_store: EventStore):
+        assert(isinstance(otc, SimpleMarket))
+        assert(isinstance(event_store, EventStore))
+
+        self.otc = otc
+        self.event_store = event_store
+
+    def _events_between(self, event_name: str, cls: type, event_filter: dict, from_block: int, to_block: int) -> list:
+        assert(isinstance(from_block, int))
+        assert(isinstance(to_block, int))
+
+        event_abi = find_event_abi(SimpleMarket.abi, event_name)
+        topics, _ = event_filter_topics(event_abi, event_filter)
+        return decode_logs(event_abi, self.event_store.logs(self.otc.address, topics, from_block, to_block), cls)
+
+    # All `LogTake` events from blocks `from_block`..`to_block`.
+    def take_between(self, from_block: int, to_block: int) -> List[LogTake]:
+        return self._events_between('LogTake', LogTake, {}, from_block, to_block)
+
+    # `LogMake`, `LogTake` and `LogKill` events of orders of `market_maker_address` from blocks `from_block`..`to_block`,
+    # i.e. exactly the events its order book can be reconstructed from. Returns them as a (makes, takes, kills) tuple.
+    # As `maker` is indexed in all of them, the filtering gets done by the node.
+    def order_events_of(self, market_maker_address: Address, from_block: int, to_block: int) -> tuple:
+        assert(isinstance(market_maker_address, Address))
+
+        event_filter = {'maker': market_maker_address.address}
+        return (self._events_between('LogMake', LogMake, event_filter, from_block, to_block),
+                self._events_between('LogTake', LogTake, event_filter, from_block, to_block),
+                self._events_between('LogKill', LogKill, event_filter, from_block, to_block))
+
+    # Fetches only these `LogTake` events which `our_oasis_trades` would be interested in, i.e. where
+    # any of `market_maker_addresses` is either the maker or the taker, on the `buy_token_address`/`sell_token_address`
+    # pair. As all of these are indexed, the filtering gets done by the node. It has to be done
+    # in two queries though, as log topics can not express `maker == x OR taker == x`.
+    def past_take_of(self, number_of_past_blocks: int, market_maker_addresses: List[Address], buy_token_address: Address, sell_token_address: Address) -> List[LogTake]:
+        assert(isinstance(number_of_past_blocks, int))
+
+        return self._take_of(lambda topics: self.event_store.past_logs(self.otc.address, topics, number_of_past_blocks),
+                             market_maker_addresses, buy_token_address, sell_token_address)
+
+    # Same as `past_take_of`, but from blocks `from_block`..`to_block`, so the range does not depend
+    # on the block the node happens to be at when the events get fetched.
+    def take_of_between(self, from_block: int, to_block: int, market_maker_addresses: List[Address], buy_token_address: Address, sell_token_address: Address) -> List[LogTake]:
+        assert(isinstance(from_block, int))
+        assert(isinstance(to_block, int))
+
+        return self._take_of(lambda topics: self.event_store.logs(self.otc.address, topics, from_block, to_block),
+                             market_maker_addresses, buy_token_address, sell_token_address)
+
+    def _take_of(self, get_logs, market_maker_addresses: List[Address], buy_token_address: Address, sell_token_address: Address) -> List[LogTake]:
+        assert(callable(get_logs))
+        assert(isinstance(market_maker_addresses, list))
+        assert(isinstance(buy_token_address, Address))
+        assert(isinstance(sell_token_address, Address))
+
+        event_abi = find_event_abi(SimpleMarket.abi, 'LogTake')
+        pairs = [oasis_pair(sell_token_address, buy_token_address), oasis_pair(buy_token_address, sell_token_address)]
+        addresses = sorted(map(lambda address: address.address, market_maker_addresses))
+        maker_topics, _ = event_filter_topics(event_abi, {'pair': pairs, 'maker': addresses})
+        taker_topics, _ = event_filter_topics(event_abi, {'pair': pairs, 'taker': addresses})
+
+        logs = get_logs(maker_topics) + get_logs(taker_topics)
+
+        # takes of our own orders by ourselves get returned by both queries
+        logs = {(log['blockNumber'], log['logIndex']): log for log in logs}
+        return decode_logs(event_abi, [logs[key] for key in sorted(logs)], LogTake)
+
+# The `pair` topic of OasisDEX events is keccak256 of the tightly packed `pay_gem` and `buy_gem` addresses.
+def oasis_pair(pay_token_address: Address, buy_token_address: Address) -> bytes:
+    assert(isinstance(pay_token_address, Address))
+    assert(isinstance(buy_token_address, Address))
+
+    return keccak(decode_hex(pay_token_address.address) + decode_hex(buy_token_address.address))
+
+
 def our_oasis_trades(market_maker_address: Address, buy_token_address: Address, sell_token_address: Address, past_takes: List[LogTake], pair: str) -> list:
     assert(isinstance(market_maker_address, Address))
+
+    return our_oasis_trades_by_maker([market_maker_address], buy_token_address, sell_token_address, past_takes, pair)[market_maker_address]
+
+
+# Partitions trades of many market makers at once, in a single pass over `past_takes`.
+# A take where one market maker took an order of another one is a trade for each of them.
+def our_oasis_trades_by_maker(market_maker_addresses: List[Address], buy_token_address: Address, sell_token_address: Address, past_takes: List[LogTake], pair: str) -> Dict[Address, list]:
+    assert(isinstance(market_maker_addresses, list))
     assert(isinstance(buy_token_address, Address))
     assert(isinstance(sell_token_address, Address))
     assert(isinstance(past_takes, list))
 
-    def sell_trades() -> List[Trade]:
-        regular = map(lambda log_take: Trade('oasis', log_take.maker, pair, log_take.timestamp, log_take.give_amount / log_take.take_amount, log_take.take_amount, log_take.give_amount, True, log_take.taker),
-                      filter(lambda log_take: log_take.maker == market_maker_address and log_take.buy_token == buy_token_address and log_take.pay_token == sell_token_address, past_takes))
-        matched = map(lambda log_take: Trade('oasis', log_take.taker, pair, log_take.timestamp, log_take.take_amount / log_take.give_amount, log_take.give_amount, log_take.take_amount, True, log_take.maker),
-                      filter(lambda log_take: log_take.taker == market_maker_address and log_take.buy_token == sell_token_address and log_take.pay_token == buy_token_address, past_takes))
-        return list(regular) + list(matched)
-
-    def buy_trades() -> List[Trade]:
-        regular = map(lambda log_take: Trade('oasis', log_take.maker, pair, log_take.timestamp, log_take.take_amount / log_take.give_amount, log_take.give_amount, log_take.take_amount, False, log_take.taker),
-                      filter(lambda log_take: log_take.maker == market_maker_address and log_take.buy_token == sell_token_address and log_take.pay_token == buy_token_address, past_takes))
-        matched = map(lambda log_take: Trade('oasis', log_take.taker, pair, log_take.timestamp, log_take.give_amount / log_take.take_amount, log_take.take_amount, log_take.give_amount, False, log_take.maker),
-                      filter(lambda log_take: log_take.taker == market_maker_address and log_take.buy_token == buy_token_address and log_take.pay_token == sell_token_address, past_takes))
-        return list(regular) + list(matched)
-
-    trades = sell_trades() + buy_trades()
-    return sorted(trades, key=lambda trade: trade.timestamp)
+    trades = {market_maker_address: [] for market_maker_address in market_maker_addresses}
+    for log_take in past_takes:
+        is_sell_pair = log_take.buy_token == buy_token_address and log_take.pay_token == sell_token_address
+        is_buy_pair = log_take.buy_token == sell_token_address and log_take.pay_token == buy_token_address
+        if not is_sell_pair and not is_buy_pair:
+            continue
+
+        if log_take.maker in trades:
+            if is_sell_pair:
+                trades[log_take.maker].append(Trade('oasis', log_take.maker, pair, log_take.timestamp, log_take.give_amount / log_take.take_amount, log_take.take_amount, log_take.give_amount, True, log_take.taker))
+            else:
+                trades[log_take.maker].append(Trade('oasis', log_take.maker, pair, log_take.timestamp, log_take.take_amount / log_take.give_amount, log_take.give_amount, log_take.take_amount, False, log_take.taker))
+
+        if log_take.taker in trades:
+            if is_buy_pair:
+                trades[log_take.taker].append(Trade('oasis', log_take.taker, pair, log_take.timestamp, log_take.take_amount / log_take.give_amount, log_take.give_amount, log_take.take_amount, True, log_take.maker))
+            else:
+                trades[log_take.taker].append(Trade('oasis', log_take.taker, pair, log_take.timestamp, log_take.give_amount / log_take.take_amount, log_take.take_amount, log_take.give_amount, False, log_take.maker))
+
+    return {market_maker_address: sorted(maker_trades, key=lambda trade: trade.timestamp) for market_maker_address, maker_trades in trades.items()}
+
+
+class OasisOrderBook:
+    """Live orders of a single market maker, reconstructed from OasisDEX events.
+
+    Orders on both sides of the `buy_token`-`sell_token` market are also kept in heaps keyed by price, so
+    the closest sell and buy prices are always at hand. Entries of orders which have been taken or killed
+    only get removed from the heaps once they reach the top. Orders of other markets are kept as well, so
+    the whole order book can be saved in a snapshot and used for charting any market later.
+    """
+
+    def __init__(self, otc: SimpleMarket, market_maker_address: Address, buy_token: Address, sell_token: Address, orders: List[Order]):
+        assert(isinstance(otc, SimpleMarket))
+        assert(isinstance(market_maker_address, Address))
+        assert(isinstance(buy_token, Address))
+        assert(isinstance(sell_token, Address))
+        assert(isinstance(orders, list))
+
+        self.otc = otc
+        self.market_maker_address = market_maker_address
+        self.buy_token = buy_token
+        self.sell_token = sell_token
+
+        # `heap_keys` maps order ids to the key of their current heap entry
+        self._orders = {}
+        self._heap_keys = {}
+        self._sell_heap = []
+        self._buy_heap = []
+
+        for order in orders:
+            self._add(order)
+
+    def _add(self, order: Order):
+        self._orders[order.order_id] = order
+
+        if order.buy_token == self.buy_token and order.pay_token == self.sell_token:
+            self._heap_keys[order.order_id] = float(order.buy_to_sell_price)
+            heapq.heappush(self._sell_heap, (self._heap_keys[order.order_id], order.order_id))
+
+        elif order.buy_token == self.sell_token and order.pay_token == self.buy_token:
+            self._heap_keys[order.order_id] = -float(order.sell_to_buy_price)
+            heapq.heappush(self._buy_heap, (self._heap_keys[order.order_id], order.order_id))
+
+    def _remove(self, order_id: int):
+        del self._orders[order_id]
+        self._heap_keys.pop(order_id, None)
+
+    def _top(self, heap: list) -> float:
+        while len(heap) > 0 and self._heap_keys.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+
+        return heap[0][0] if len(heap) > 0 else np.nan
+
+    def orders(self) -> List[Order]:
+        return list(self._orders.values())
+
+    def closest_sell_price(self) -> float:
+        return self._top(self._sell_heap)
+
+    def closest_buy_price(self) -> float:
+        return -self._top(self._buy_heap)
+
+    def apply_make(self, log_make: LogMake):
+        if log_make.maker == self.market_maker_address:
+            self._add(Order(self.otc,
+                            order_id=log_make.order_id,
+                            pay_amount=log_make.pay_amount,
+                            pay_token=log_make.pay_token,
+                            buy_amount=log_make.buy_amount,
+                            buy_token=log_make.buy_token,
+                            maker=log_make.maker,
+                            timestamp=log_make.timestamp))
+
+    def apply_take(self, log_take: LogTake):
+        if log_take.order_id in self._orders:
+            this_order = self._orders[log_take.order_id]
+            assert this_order.pay_token == log_take.pay_token
+            assert this_order.buy_token == log_take.buy_token
+
+            self._remove(this_order.order_id)
+            this_order = Order(self.otc,
+                               order_id=this_order.order_id,
+                               pay_amount=this_order.pay_amount - log_take.take_amount,
+                               pay_token=this_order.pay_token,
+                               buy_amount=this_order.buy_amount - log_take.give_amount,
+                               buy_token=this_order.buy_token,
+                               maker=this_order.maker,
+                               timestamp=this_order.timestamp)
+
+            if this_order.pay_amount > Wad(0) and this_order.buy_amount > Wad(0):
+                self._add(this_order)
+
+    def apply_kill(self, log_kill: LogKill):
+        if log_kill.order_id in self._orders:
+            self._remove(log_kill.order_id)
+
+    # Orders in a compact, JSON-friendly form, as used by `OrderBookSnapshots`.
+    def to_records(self) -> list:
+        return [[order.order_id, order.pay_token.address, str(order.pay_amount.value), order.buy_token.address, str(order.buy_amount.value), order.timestamp]
+                for order in self._orders.values()]
+
+    @staticmethod
+    def from_records(otc: SimpleMarket, market_maker_address: Address, buy_token: Address, sell_token: Address, records: list):
+        assert(isinstance(records, list))
+
+        return OasisOrderBook(otc, market_maker_address, buy_token, sell_token,
+                              [Order(otc,
+                                     order_id=order_id,
+                                     pay_amount=Wad(int(pay_amount)),
+                                     pay_token=Address(pay_token),
+                                     buy_amount=Wad(int(buy_amount)),
+                                     buy_token=Address(buy_token),
+                                     maker=market_maker_address,
+                                     timestamp=timestamp) for order_id, pay_token, pay_amount, buy_token, buy_amount, timestamp in records])
+
+
+# Applies `past_make`, `past_take` and `past_kill` events to `order_book` and returns the closest sell and buy
+# prices between `start_timestamp` and `end_timestamp`. Prices only get emitted when they change, so the result
+# is meant to be plotted as a step function. It always starts with the prices at `start_timestamp` and ends with
+# the ones at `end_timestamp`. All events get sorted once and then applied in a single pass. Within the same
+# timestamp, makes get applied first, then takes, then kills.
+#
+# Also returns records of the order book (see `OasisOrderBook.to_records()`) as of each of `snapshot_timestamps`,
+# i.e. with all the events up to and including that timestamp applied. These can not be later than `end_timestamp`.
+def replay_closest_prices(order_book: OasisOrderBook, past_make: List[LogMake], past_take: List[LogTake], past_kill: List[LogKill],
+                          start_timestamp: int, end_timestamp: int, snapshot_timestamps: Optional[List[int]] = None) -> tuple:
+    assert(isinstance(order_book, OasisOrderBook))
+    assert(isinstance(past_make, list))
+    assert(isinstance(past_take, list))
+    assert(isinstance(past_kill, list))
+    assert(isinstance(start_timestamp, int))
+    assert(isinstance(end_timestamp, int))
+    assert(isinstance(snapshot_timestamps, list) or (snapshot_timestamps is None))
+
+    events = [(log_make.timestamp, 0, index, order_book.apply_make, log_make) for index, log_make in enumerate(past_make)] + \
+             [(log_take.timestamp, 1, index, order_book.apply_take, log_take) for index, log_take in enumerate(past_take)] + \
+             [(log_kill.timestamp, 2, index, order_book.apply_kill, log_kill) for index, log_kill in enumerate(past_kill)]
+    events.sort(key=lambda event: event[:3])
+
+    snapshot_timestamps = sorted(snapshot_timestamps) if snapshot_timestamps is not None else []
+    assert all(timestamp <= end_timestamp for timestamp in snapshot_timestamps)
+    snapshots = []
+
+    timestamps = []
+    closest_sell_prices = []
+    closest_buy_prices = []
+
+    def emit(timestamp: int, always: bool):
+        closest_sell_price = order_book.closest_sell_price()
+        closest_buy_price = order_book.closest_buy_price()
+
+        def same(a: float, b: float) -> bool:
+            return a == b or (np.isnan(a) and np.isnan(b))
+
+        if always or not (same(closest_sell_price, closest_sell_prices[-1]) and same(closest_buy_price, closest_buy_prices[-1])):
+            timestamps.append(timestamp)
+            closest_sell_prices.append(closest_sell_price)
+            closest_buy_prices.append(closest_buy_price)
+
+    event_index = 0
+    while True:
+        # all events before `timestamp` have been applied at this point
+        timestamp = events[event_index][0] if event_index < len(events) else None
+
+        while len(snapshots) < len(snapshot_timestamps) and (timestamp is None or snapshot_timestamps[len(snapshots)] < timestamp):
+            snapshots.append(order_book.to_records())
+
+        if len(timestamps) == 0 and (timestamp is None or timestamp > start_timestamp):
+            emit(start_timestamp, always=True)
+
+        if timestamp is None or timestamp > end_timestamp:
+            break
+
+        while event_index < len(events) and events[event_index][0] == timestamp:
+            _, _, _, apply, event = events[event_index]
+            apply(event)
+            event_index += 1
+
+        if timestamp > start_timestamp:
+            emit(timestamp, always=False)
+
+    emit(end_timestamp, always=True)
+
+    return OrderBookSeries(timestamps, closest_sell_prices, closest_buy_prices), snapshots
 
 
 def all_oasis_trades(buy_token_address: Address, sell_token_address: Address, past_takes: List[LogTake], pair: str) -> List[AllTrade]:
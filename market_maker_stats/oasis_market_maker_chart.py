@@ -18,45 +18,16 @@
 import argparse
 import sys
 import time
-from functools import reduce
-from typing import List, Optional
 
 from web3 import Web3, HTTPProvider
 
-from market_maker_stats.chart import initialize_charting, draw_chart
-from market_maker_stats.oasis import our_oasis_trades, all_oasis_trades
-from market_maker_stats.util import get_block_timestamp, initialize_logging, get_prices
+from market_maker_stats.chart import initialize_charting, draw_chart, chart_price_resolution
+from market_maker_stats.event_store import EventStore
+from market_maker_stats.oasis import our_oasis_trades, all_oasis_trades, replay_closest_prices, OasisEvents, OasisOrderBook
+from market_maker_stats.snapshots import OrderBookSnapshots
+from market_maker_stats.util import get_block_timestamp, initialize_logging, get_prices, get_deployment_block
 from pymaker import Address
-from pymaker.numeric import Wad
-from pymaker.oasis import SimpleMarket, Order, LogMake, LogTake, LogKill
-
-
-class State:
-    def __init__(self, timestamp: int, order_book: List[Order], buy_token_address: Address, sell_token_address: Address):
-        self.timestamp = timestamp
-        self.order_book = order_book
-        self.buy_token_address = buy_token_address
-        self.sell_token_address = sell_token_address
-
-    def closest_sell_price(self) -> Optional[Wad]:
-        return min(self.sell_prices(), default=None)
-
-    def closest_buy_price(self) -> Optional[Wad]:
-        return max(self.buy_prices(), default=None)
-
-    def sell_orders(self) -> List[Order]:
-        return list(filter(lambda order: order.buy_token == self.buy_token_address and
-                                         order.pay_token == self.sell_token_address, self.order_book))
-
-    def sell_prices(self) -> List[Wad]:
-        return list(map(lambda order: order.buy_to_sell_price, self.sell_orders()))
-
-    def buy_orders(self) -> List[Order]:
-        return list(filter(lambda order: order.buy_token == self.sell_token_address and
-                                         order.pay_token == self.buy_token_address, self.order_book))
-
-    def buy_prices(self) -> List[Wad]:
-        return list(map(lambda order: order.sell_to_buy_price, self.buy_orders()))
+from pymaker.oasis import SimpleMarket
 
 
 class OasisMarketMakerChart:
@@ -77,6 +48,8 @@ class OasisMarketMakerChart:
         parser.add_argument("--price-feed", help="Price endpoint to use as the price history source", type=str)
         parser.add_argument("--alternative-price-feed", help="Price endpoint to use as the alternative price history source", type=str)
         parser.add_argument("--past-blocks", help="Number of past blocks to analyze", required=True, type=int)
+        parser.add_argument("--from-block", help="Block to replay the order book from if there are no order book snapshots yet"
+                                                 " (default: the block the OasisDEX contract got deployed in)", required=False, type=int)
         parser.add_argument("-o", "--output", help="Name of the filename to save to chart to."
                                                    " Will get displayed on-screen if empty", required=False, type=str)
         self.arguments = parser.parse_args(args)
@@ -88,116 +61,57 @@ class OasisMarketMakerChart:
         self.sell_token_address = Address(self.arguments.sell_token_address)
         self.market_maker_address = Address(self.arguments.market_maker_address)
         self.otc = SimpleMarket(web3=self.web3, address=Address(self.arguments.oasis_address))
+        self.otc_events = OasisEvents(self.otc, EventStore(self.web3))
+        self.snapshots = OrderBookSnapshots(f"{self.otc.address.address}-{self.market_maker_address.address}".lower())
+        self.confirmations = 12
 
         initialize_charting(self.arguments.output)
         initialize_logging()
 
     def main(self):
-        start_timestamp = get_block_timestamp(self.infura, self.web3.eth.blockNumber - self.arguments.past_blocks)
+        block_number = self.web3.eth.blockNumber
+        start_block = block_number - self.arguments.past_blocks
+        start_timestamp = get_block_timestamp(self.infura, start_block)
         end_timestamp = int(time.time())
 
-        # If we only fetch log events from the last `past_blocks` blocks, the left hand side of the chart
-        # will have some bid and ask lines missing as these orders were very likely created some blocks
-        # earlier. So we also retrieve events from the blocks from the 24h before in order to minimize
-        # the chance of it happening.
-        block_lookback = 15*60*24
-
-        past_make = self.otc.past_make(self.arguments.past_blocks + block_lookback)
-        past_take = self.otc.past_take(self.arguments.past_blocks + block_lookback)
-        past_kill = self.otc.past_kill(self.arguments.past_blocks + block_lookback)
-
-        def reduce_func(states, timestamp):
-            if len(states) == 0:
-                order_book = []
-            else:
-                order_book = states[-1].order_book
-
-            # apply all LogMake events having this timestamp
-            for log_make in filter(lambda log_make: log_make.timestamp == timestamp, past_make):
-                order_book = self.apply_make(order_book, log_make)
-                order_book = list(filter(lambda order: order.maker == self.market_maker_address, order_book))
-
-            # apply all LogTake events having this timestamp
-            for log_take in filter(lambda log_take: log_take.timestamp == timestamp, past_take):
-                order_book = self.apply_take(order_book, log_take)
-
-            # apply all LogKill events having this timestamp
-            for log_kill in filter(lambda log_kill: log_kill.timestamp == timestamp, past_kill):
-                order_book = self.apply_kill(order_book, log_kill)
-
-            return states + [State(timestamp=timestamp,
-                                   order_book=order_book,
-                                   buy_token_address=self.buy_token_address,
-                                   sell_token_address=self.sell_token_address)]
-
-        event_timestamps = sorted(set(map(lambda event: event.timestamp, past_make + past_take + past_kill)))
-        states_timestamps = self.tighten_timestamps(event_timestamps) + [end_timestamp]
-        states = list(filter(lambda state: state.timestamp >= start_timestamp, reduce(reduce_func, states_timestamps, [])))
-        states = sorted(states, key=lambda state: state.timestamp)
-
-        prices = get_prices(self.arguments.gdax_price, self.arguments.price_feed, None, start_timestamp, end_timestamp)
-        alternative_prices = get_prices(None, self.arguments.alternative_price_feed, None, start_timestamp, end_timestamp)
-
-        takes = list(filter(lambda log_take: log_take.timestamp >= start_timestamp, past_take))
+        # In order to draw the bid and ask lines right from the left hand side of the chart, we need to know
+        # which orders were alive at `start_block`. We start from the latest order book snapshot taken before
+        # it and only replay events of our orders from there. If there is no such snapshot yet, we replay all
+        # of them since `--from-block` or since the OasisDEX contract got deployed, so every snapshot we take
+        # is exact. The event store keeps them, so it only takes long the first time.
+        snapshot = self.snapshots.latest(start_block)
+        if snapshot is not None:
+            from_block = snapshot['block_number'] + 1
+            order_book = OasisOrderBook.from_records(self.otc, self.market_maker_address, self.buy_token_address, self.sell_token_address, snapshot['orders'])
+        else:
+            from_block = self.arguments.from_block if self.arguments.from_block is not None \
+                else get_deployment_block(self.infura, self.otc.address, start_block)
+            order_book = OasisOrderBook(self.otc, self.market_maker_address, self.buy_token_address, self.sell_token_address, [])
+
+        # both ranges end at `block_number`, so no events get lost if new blocks arrive while we are fetching them
+        past_make, past_take, past_kill = self.otc_events.order_events_of(self.market_maker_address, from_block, block_number)
+        takes = self.otc_events.take_between(start_block, block_number)
+
+        # we take new snapshots at the start of the chart and at the last confirmed block,
+        # so subsequent runs only have to replay events from there
+        snapshot_blocks = [start_block, block_number - self.confirmations]
+        snapshot_blocks = sorted(set(filter(lambda snapshot_block: from_block <= snapshot_block <= block_number - self.confirmations, snapshot_blocks)))
+        snapshot_timestamps = [get_block_timestamp(self.infura, snapshot_block) for snapshot_block in snapshot_blocks]
+
+        order_book, snapshots = replay_closest_prices(order_book, past_make, past_take, past_kill, start_timestamp, end_timestamp, snapshot_timestamps)
+        for snapshot_block, snapshot_timestamp, orders in zip(snapshot_blocks, snapshot_timestamps, snapshots):
+            self.snapshots.add(snapshot_block, snapshot_timestamp, orders)
+
+        resolution = chart_price_resolution(start_timestamp, end_timestamp)
+        prices = get_prices(self.arguments.gdax_price, self.arguments.price_feed, None, start_timestamp, end_timestamp, resolution)
+        alternative_prices = get_prices(None, self.arguments.alternative_price_feed, None, start_timestamp, end_timestamp, resolution)
+
+        takes = list(filter(lambda log_take: log_take.timestamp >= start_timestamp, takes))
         pair = self.arguments.sell_token + "-" + self.arguments.buy_token
         our_trades = our_oasis_trades(self.market_maker_address, self.buy_token_address, self.sell_token_address, takes, pair)
         all_trades = all_oasis_trades(self.buy_token_address, self.sell_token_address, takes, pair)
 
-        draw_chart(start_timestamp, end_timestamp, prices, alternative_prices, 180, states, our_trades, all_trades, self.arguments.output)
-
-    def tighten_timestamps(self, timestamps: list) -> list:
-        if len(timestamps) == 0:
-            return []
-
-        result = [timestamps[0]]
-        for index in range(1, len(timestamps)):
-            last_ts = timestamps[index-1]
-            while True:
-                last_ts += 60
-                if last_ts >= timestamps[index]:
-                    break
-                result.append(last_ts)
-
-            result.append(timestamps[index])
-
-        return result
-
-    def apply_make(self, order_book: List[Order], log_make: LogMake) -> List[Order]:
-        return order_book + [Order(self.otc,
-                                   order_id=log_make.order_id,
-                                   pay_amount=log_make.pay_amount,
-                                   pay_token=log_make.pay_token,
-                                   buy_amount=log_make.buy_amount,
-                                   buy_token=log_make.buy_token,
-                                   maker=log_make.maker,
-                                   timestamp=log_make.timestamp)]
-
-    def apply_take(self, order_book: List[Order], log_take: LogTake):
-        this_order = next(filter(lambda order: order.order_id == log_take.order_id, order_book), None)
-
-        if this_order is not None:
-            assert this_order.pay_token == log_take.pay_token
-            assert this_order.buy_token == log_take.buy_token
-
-            remaining_orders = list(filter(lambda order: order.order_id != log_take.order_id, order_book))
-            this_order = Order(self.otc,
-                               order_id=this_order.order_id,
-                               pay_amount=this_order.pay_amount - log_take.take_amount,
-                               pay_token=this_order.pay_token,
-                               buy_amount=this_order.buy_amount - log_take.give_amount,
-                               buy_token=this_order.buy_token,
-                               maker=this_order.maker,
-                               timestamp=this_order.timestamp)
-
-            if this_order.pay_amount > Wad(0) and this_order.buy_amount > Wad(0):
-                return remaining_orders + [this_order]
-            else:
-                return remaining_orders
-        else:
-            return order_book
-
-    def apply_kill(self, order_book: List[Order], log_kill: LogKill) -> List[Order]:
-        return list(filter(lambda order: order.order_id != log_kill.order_id, order_book))
+        draw_chart(start_timestamp, end_timestamp, prices, alternative_prices, max(180, 3*resolution), order_book, our_trades, all_trades, self.arguments.output)
 
 
 if __name__ == '__main__':
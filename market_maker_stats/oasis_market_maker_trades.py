@@ -26,9 +26,12 @@ import pytz
 from texttable import Texttable
 from web3 import Web3, HTTPProvider
 
-from market_maker_stats.oasis import Trade, our_oasis_trades
-from market_maker_stats.trades import text_trades, json_trades
-from market_maker_stats.util import format_timestamp, sort_trades
+from market_maker_stats.event_store import EventStore
+from market_maker_stats.oasis import Trade, our_oasis_trades_by_maker, OasisEvents
+from market_maker_stats.export import write_columns, trade_columns
+from market_maker_stats.trades import text_trades, json_market_maker_trades
+from market_maker_stats.util import format_timestamp, sort_trades, market_maker_addresses, market_maker_reports, \
+    market_maker_output
 from pymaker import Address
 from pymaker.oasis import SimpleMarket
 
@@ -46,15 +49,21 @@ class OasisMarketMakerTrades:
         parser.add_argument("--buy-token-address", help="Ethereum address of the buy token", required=True, type=str)
         parser.add_argument("--sell-token", help="Name of the sell token", required=True, type=str)
         parser.add_argument("--sell-token-address", help="Ethereum address of the sell token", required=True,type=str)
-        parser.add_argument("--market-maker-address", help="Ethereum account of the market maker to analyze", required=True, type=str)
+        parser.add_argument("--market-maker-address", help="Ethereum account(s) of the market maker(s) to analyze", nargs='+', type=str)
+        parser.add_argument("--market-maker-address-file", help="File with Ethereum accounts of the market makers to analyze, one per line", type=str)
         parser.add_argument("--past-blocks", help="Number of past blocks to analyze", required=True, type=int)
         parser.add_argument("-o", "--output", help="File to save the table or the JSON to", required=False, type=str)
+        parser.add_argument("--export", help="File to export trades to (.csv, .npz or .parquet)", required=False, type=str)
 
         parser_mode = parser.add_mutually_exclusive_group(required=True)
         parser_mode.add_argument('--text', help="List trades as a text table", dest='text', action='store_true')
         parser_mode.add_argument('--json', help="List trades as a JSON document", dest='json', action='store_true')
 
         self.arguments = parser.parse_args(args)
+        self.market_maker_addresses = market_maker_addresses(self.arguments.market_maker_address, self.arguments.market_maker_address_file)
+
+        if len(self.market_maker_addresses) == 0:
+            parser.error("at least one of --market-maker-address and --market-maker-address-file is required")
 
         self.web3 = Web3(HTTPProvider(endpoint_uri=f"http://{self.arguments.rpc_host}:{self.arguments.rpc_port}",
                                       request_kwargs={'timeout': self.arguments.rpc_timeout}))
@@ -62,23 +71,29 @@ class OasisMarketMakerTrades:
         self.buy_token_address = Address(self.arguments.buy_token_address)
         self.sell_token = self.arguments.sell_token
         self.sell_token_address = Address(self.arguments.sell_token_address)
-        self.market_maker_address = Address(self.arguments.market_maker_address)
         self.otc = SimpleMarket(web3=self.web3, address=Address(self.arguments.oasis_address))
+        self.otc_events = OasisEvents(self.otc, EventStore(self.web3))
 
         logging.basicConfig(format='%(asctime)-15s %(levelname)-8s %(message)s', level=logging.INFO)
         logging.getLogger("filelock").setLevel(logging.WARNING)
 
     def main(self):
-        take_events = self.otc.past_take(self.arguments.past_blocks)
+        take_events = self.otc_events.past_take_of(self.arguments.past_blocks, self.market_maker_addresses, self.buy_token_address, self.sell_token_address)
         pair = self.arguments.sell_token + "-" + self.arguments.buy_token
-        trades = our_oasis_trades(self.market_maker_address, self.buy_token_address, self.sell_token_address, take_events, pair)
-        trades = sort_trades(trades)
+        trades_by_maker = our_oasis_trades_by_maker(self.market_maker_addresses, self.buy_token_address, self.sell_token_address, take_events, pair)
 
-        if self.arguments.text:
-            text_trades(self.buy_token, self.sell_token, trades, self.arguments.output, include_taker=True)
+        reports = [(market_maker, sort_trades(trades), suffix) for market_maker, trades, suffix in market_maker_reports(trades_by_maker)]
 
+        # with many market makers, all of them end up in one JSON document so it stays valid JSON
         if self.arguments.json:
-            json_trades(trades, self.arguments.output, include_taker=True)
+            json_market_maker_trades(reports, self.arguments.output, include_taker=True)
+
+        for market_maker, trades, suffix in reports:
+            if self.arguments.text:
+                text_trades(self.buy_token, self.sell_token, trades, market_maker_output(self.arguments.output, suffix), include_taker=True, market_maker=market_maker)
+
+            if self.arguments.export:
+                write_columns(trade_columns(trades), market_maker_output(self.arguments.export, suffix))
 
 
 if __name__ == '__main__':
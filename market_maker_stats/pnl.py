@@ -16,65 +16,124 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import datetime
-from itertools import groupby
 
 import numpy as np
 import pytz
 from texttable import Texttable
-from typing import List, Optional
+from typing import List, Optional, Iterable, Iterator
 
-from market_maker_stats.util import get_day, sum_wads, Price, timestamp_to_x
-from pymaker import Wad
+from market_maker_stats.chart import chart_width, downsample
+from market_maker_stats.util import PriceSeries, timestamp_to_x, timestamps_to_x
 
 
-def rolling_window(a, window):
-    shape = a.shape[:-1] + (a.shape[-1] - window + 1, window)
-    strides = a.strides + (a.strides[-1],)
-    return np.lib.stride_tricks.as_strided(a, shape=shape, strides=strides)
+# Sums of all `window`-long windows of `values`, i.e. `result[i] = sum(values[i:i+window])`, in O(n) time and memory.
+# These are computed as differences of prefix sums, but the prefix sums get restarted every `block_size` elements.
+# This way their magnitude, and so the cancellation error when subtracting them, is bounded by the sum of at most
+# `block_size + window` elements rather than by the sum of the whole series.
+#
+# Sums for multiple window sizes can be calculated at once, in which case they all share the same prefix sums.
+def multi_rolling_sums(values: np.ndarray, windows: List[int], block_size: int = 1024) -> List[np.ndarray]:
+    assert(isinstance(windows, list))
+
+    counts = [max(len(values) - window + 1, 0) for window in windows]
+    results = [np.empty(count, dtype=np.float64) for count in counts]
+
+    block_size = max([block_size] + windows)
+    for begin in range(0, max(counts + [0]), block_size):
+        prefix_sums = np.concatenate([[0.0], np.cumsum(values[begin:begin + block_size + max(windows) - 1], dtype=np.float64)])
+
+        for window, count, result in zip(windows, counts, results):
+            end = min(begin + block_size, count)
+            if end > begin:
+                result[begin:end] = prefix_sums[window:window + end - begin] - prefix_sums[:end - begin]
+
+    return results
+
+
+def rolling_sums(values: np.ndarray, window: int, block_size: int = 1024) -> np.ndarray:
+    return multi_rolling_sums(values, [window], block_size)[0]
 
 
 # prices can have gaps, but for PnL calculation we need minute-by-minute data, that's why we fill the gaps.
 # zero price and zero volume is fine, this way it won't count towards vwap as we don't know what was there anyway
 # in case there is more than one sample per minute, we only leave the first one
-def granularize_prices(prices: list) -> list:
-    def get_minute(ts):
-        return int(ts/60)
+def granularize_prices(prices: PriceSeries) -> PriceSeries:
+    assert(isinstance(prices, PriceSeries))
 
-    granular_prices = []
-    last_timestamp = -1
-    for price in prices:
-        if last_timestamp != -1:
-            minute_increment = get_minute(price.timestamp) - get_minute(last_timestamp)
-            for i in range(0, minute_increment-1):
-                granular_prices.append(Price(last_timestamp + 60*(i+1), 0.0, 0.0, 0.0, 0.0))
+    if len(prices) == 0:
+        return prices
 
-            if minute_increment > 0:
-                granular_prices.append(price)
+    timestamps = prices.timestamps
+    minutes = timestamps // 60
+    minute_increments = np.diff(minutes)
 
-        else:
-            granular_prices.append(price)
+    # a sample is kept only if it is the first one in its minute (the very first sample is always kept),
+    # and `fills[i]` empty samples get inserted right before sample `i`, spaced 60s apart starting
+    # from the timestamp of the preceding sample
+    keep = np.concatenate([[True], minute_increments > 0])
+    fills = np.concatenate([[0], np.maximum(minute_increments - 1, 0)])
+    rows = fills + keep
+    offsets = np.cumsum(rows) - rows
+
+    kept_indices = np.nonzero(keep)[0]
+    kept_positions = offsets[kept_indices] + fills[kept_indices]
 
-        last_timestamp = price.timestamp
+    filled_indices = np.repeat(np.arange(len(timestamps)), fills)
+    fill_numbers = np.arange(len(filled_indices)) - np.repeat(np.cumsum(fills) - fills, fills)
+    fill_positions = offsets[filled_indices] + fill_numbers
 
-    return granular_prices
+    granular_timestamps = np.empty(np.sum(rows), dtype=np.int64)
+    granular_timestamps[kept_positions] = timestamps[kept_indices]
+    granular_timestamps[fill_positions] = timestamps[filled_indices - 1] + 60 * (fill_numbers + 1)
 
+    def column(values: np.ndarray) -> np.ndarray:
+        result = np.zeros(len(granular_timestamps), dtype=np.float64)
+        result[kept_positions] = values[kept_indices]
+        return result
 
-def get_approx_vwaps(prices: list, vwap_minutes: int):
-    granular_prices = granularize_prices(prices)
+    return PriceSeries(timestamps=granular_timestamps,
+                       prices=column(prices.prices),
+                       buy_prices=column(prices.buy_prices),
+                       sell_prices=column(prices.sell_prices),
+                       volumes=column(prices.volumes))
+
+
+def get_approx_vwaps(prices: PriceSeries, vwap_minutes: int):
+    return get_multi_approx_vwaps(prices, [vwap_minutes])[0]
+
+
+# Calculates VWAPs for several window sizes at once, from one set of shared cumulative sums.
+def get_multi_approx_vwaps(prices: PriceSeries, vwap_minutes: List[int]) -> List[np.ndarray]:
+    assert(isinstance(vwap_minutes, list))
+
+    return granular_vwaps(granularize_prices(prices), vwap_minutes)
+
+
+# `granular_prices` need to be already granularized with `granularize_prices`.
+def granular_vwaps(granular_prices: PriceSeries, vwap_minutes: List[int]) -> List[np.ndarray]:
+    assert(isinstance(granular_prices, PriceSeries))
+    assert(isinstance(vwap_minutes, list))
 
     # approximates historical vwap_minutes VWAPs from GDAX by querying historical at minimal
     # (60 second) granularity, using (low+high)/2 as price for each bucket, then weighting by volume
     # traded in each bucket. Might not be that accurate, consider applying smoothing on top of this
-    granular_prices_avg = np.array(list(map(lambda price: price.price, granular_prices)))
-    granular_volumes = np.array(list(map(lambda price: price.volume, granular_prices)))
+    weighted_prices = granular_prices.prices * granular_prices.volumes
 
-    rolling_volumes = rolling_window(granular_volumes, vwap_minutes)
-    rolling_prices = rolling_window(granular_prices_avg, vwap_minutes)
-    weighted_prices = rolling_prices * rolling_volumes
+    # NaNs would poison all subsequent prefix sums, so we sum zeros instead and mark
+    # every window which contains at least one missing value as NaN afterwards
+    missing = np.isnan(weighted_prices) | np.isnan(granular_prices.volumes)
+    rolling_weighted_prices = multi_rolling_sums(np.where(missing, 0.0, weighted_prices), vwap_minutes)
+    rolling_volumes = multi_rolling_sums(np.where(missing, 0.0, granular_prices.volumes), vwap_minutes)
+    rolling_missing = multi_rolling_sums(missing.astype(np.float64), vwap_minutes)
 
-    vwaps = np.sum(weighted_prices, axis=1) / np.sum(rolling_volumes, axis=1)
+    def vwaps(index: int) -> np.ndarray:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result = rolling_weighted_prices[index] / rolling_volumes[index]
 
-    return vwaps
+        result[rolling_missing[index] > 0.5] = np.nan
+        return result
+
+    return [vwaps(index) for index in range(len(vwap_minutes))]
 
 
 def to_direction(x):
@@ -119,63 +178,224 @@ def calculate_pnl(pnl_trades, pnl_prices, pnl_timestamps, vwaps, vwaps_start):
     return profits
 
 
-def pnl_text(trades: list, vwaps: list, vwaps_start: int, buy_token: str, sell_token: str, vwap_minutes: int, output: Optional[str]):
-    if buy_token.upper() in ['DAI', 'USD', 'USDT']:
-        amount_format = "{:,.2f} " + buy_token.upper()
-    else:
-        amount_format = "{:,.4f} " + buy_token.upper()
+# Joins daily aggregates produced by `daily_pnl` for consecutive periods into one.
+def concatenate_daily_pnl(days_list: List[dict]) -> dict:
+    assert(isinstance(days_list, list))
 
-    data = []
-    total_volume = Wad(0)
-    total_net = Wad(0)
-    total_profit = 0
-    for day, day_trades in groupby(trades, lambda trade: get_day(trade.timestamp)):
-        day_trades = list(day_trades)
+    return {'days': [day for days in days_list for day in days['days']],
+            'timestamps': np.concatenate([days['timestamps'] for days in days_list]).astype(np.int64),
+            'counts': np.concatenate([days['counts'] for days in days_list]).astype(np.int64),
+            'volumes': np.concatenate([days['volumes'] for days in days_list]),
+            'bought': np.concatenate([days['bought'] for days in days_list]),
+            'sold': np.concatenate([days['sold'] for days in days_list]),
+            'nets': np.concatenate([days['nets'] for days in days_list]),
+            'profits': [np.concatenate(profits) for profits in zip(*[days['profits'] for days in days_list])],
+            'missing_profits': np.concatenate([days['missing_profits'] for days in days_list]).astype(bool)}
 
-        if vwaps_start != -1:
-            pnl_trades, pnl_prices, pnl_timestamps = prepare_trades_for_pnl(day_trades)
-            pnl_profits = calculate_pnl(pnl_trades, pnl_prices, pnl_timestamps, vwaps, vwaps_start)
 
-            # 'pnl_profits' will contain NaN for these trades where missing price information
-            # made profit calculation impossible. we count number of these in `missing_profits`
-            pnl_profits_len_before = len(pnl_profits)
-            pnl_profits = pnl_profits[~np.isnan(pnl_profits)]
-            missing_profits = len(pnl_profits) != pnl_profits_len_before
-            calculated_profits = True
+def profit_headers(vwap_minutes: List[int]) -> List[str]:
+    if len(vwap_minutes) == 1:
+        return ["Profit"]
+    else:
+        return [f"Profit ({window}m VWAP)" for window in vwap_minutes]
+
 
+# Streaming counterpart of `get_multi_approx_vwaps` followed by `calculate_pnl`, for histories too long to be kept
+# in memory as a whole. `trades` have to be sorted by timestamp and `price_batches` have to be consecutive,
+# time-ordered price batches, like the ones produced by `iter_prices`. Between batches, only the last
+# `max(vwap_minutes) - 1` minutes of prices and the trades still waiting for their VWAP windows to complete are kept.
+#
+# Yields `(timestamps, profits)` tuples as soon as profits of consecutive trades become known, with one array of
+# profits per VWAP window in `profits`. Profits of trades from the last window of each size never become known,
+# so after the last batch, like with `calculate_pnl`, these arrays can be shorter than `timestamps`.
+# Trades from before the first price get NaN profits, as there is no price information for them.
+def stream_pnl(trades: Iterable, price_batches: Iterable[PriceSeries], vwap_minutes: List[int]) -> Iterator[tuple]:
+    assert(isinstance(vwap_minutes, list))
+
+    trades = iter(trades)
+    next_trade = next(trades, None)
+
+    vwaps_start = None
+    last_price = None
+    window = PriceSeries.empty()
+    window_minute = 0
+
+    def trade_profits(ready_trades: list, vwaps: List[np.ndarray]) -> tuple:
+        pnl_trades, pnl_prices, pnl_timestamps = prepare_trades_for_pnl(ready_trades)
+        indices = np.ceil((pnl_timestamps - vwaps_start) / 60).astype('int') - window_minute
+
+        profits = []
+        for window_vwaps in vwaps:
+            count = int(np.count_nonzero(indices < len(window_vwaps)))
+            known = indices[:count] >= 0
+
+            trade_market_vwaps = np.full(count, np.nan)
+            trade_market_vwaps[known] = window_vwaps[indices[:count][known]]
+            profits.append((trade_market_vwaps - pnl_prices[:count]) * pnl_trades[:count, 0])
+
+        return pnl_timestamps, profits
+
+    for prices in price_batches:
+        assert(isinstance(prices, PriceSeries))
+
+        if len(prices) == 0:
+            continue
+
+        # the last price of the previous batch gets granularized again together with the new batch,
+        # so gaps and duplicate minutes spanning the batch boundary get handled the same way as within a batch
+        if last_price is None:
+            vwaps_start = int(prices.timestamps[0])
+            granular_prices = granularize_prices(prices)
         else:
-            pnl_profits = np.array([])
-            missing_profits = False
-            calculated_profits = False
-
-        day_volume = sum_wads(map(lambda trade: trade.money, day_trades))
-        day_bought = sum_wads(map(lambda trade: trade.money, filter(lambda trade: trade.is_sell, day_trades)))
-        day_sold = sum_wads(map(lambda trade: trade.money, filter(lambda trade: not trade.is_sell, day_trades)))
-        day_net = day_bought - day_sold
-        day_profit = np.sum(pnl_profits)
-
-        total_volume += day_volume
-        total_net += day_net
-        total_profit += day_profit
-
-        data.append([day.strftime('%Y-%m-%d'),
-                     len(day_trades),
-                     amount_format.format(float(day_volume)),
-                     amount_format.format(float(day_bought)),
-                     amount_format.format(float(day_sold)),
-                     amount_format.format(float(day_net)),
-                     amount_format.format(float(total_net)),
-                     amount_format.format(day_profit) if calculated_profits else "n/a",
-                     "*" if missing_profits else ""])
-
-    table = Texttable(max_width=250)
+            granular_prices = granularize_prices(PriceSeries.concatenate([last_price, prices]))[1:]
+
+        last_price = prices[len(prices) - 1:]
+        window = PriceSeries.concatenate([window, granular_prices])
+
+        # the longest window has got the fewest VWAPs, trades get yielded once VWAPs of all the windows are known
+        vwaps = granular_vwaps(window, vwap_minutes)
+        known_minutes = min(len(window_vwaps) for window_vwaps in vwaps)
+
+        ready_trades = []
+        while next_trade is not None and np.ceil((next_trade.timestamp - vwaps_start) / 60) < window_minute + known_minutes:
+            ready_trades.append(next_trade)
+            next_trade = next(trades, None)
+
+        if len(ready_trades) > 0:
+            yield trade_profits(ready_trades, vwaps)
+
+        # minutes of all VWAPs calculated so far will never be needed again
+        window = window[known_minutes:]
+        window_minute += known_minutes
+
+    remaining_trades = ([next_trade] + list(trades)) if next_trade is not None else []
+    if vwaps_start is not None and len(remaining_trades) > 0:
+        yield trade_profits(remaining_trades, granular_vwaps(window, vwap_minutes))
+
+
+# Same as `daily_pnl`, but with profits calculated by `stream_pnl` from consecutive `price_batches`, so neither
+# the whole price history nor the VWAPs have to be kept in memory. Returns the daily aggregates together with
+# the timestamp of the first price, or -1 if there were no prices at all.
+def stream_daily_pnl(trades: list, price_batches: Iterable[PriceSeries], vwap_minutes: List[int]) -> tuple:
+    assert(isinstance(trades, list))
+    assert(isinstance(vwap_minutes, list))
+
+    trades = sorted(trades, key=lambda trade: trade.timestamp)
+    first_timestamps = []
+
+    def observed_batches() -> Iterator[PriceSeries]:
+        for prices in price_batches:
+            if len(prices) > 0 and len(first_timestamps) == 0:
+                first_timestamps.append(int(prices.timestamps[0]))
+
+            yield prices
+
+    chunks = [profits for _, profits in stream_pnl(trades, observed_batches(), vwap_minutes)]
+    if len(first_timestamps) == 0:
+        return daily_trade_pnl(trades, None, len(vwap_minutes)), -1
+
+    trade_profits = [np.concatenate([np.array([])] + [profits[index] for profits in chunks]) for index in range(len(vwap_minutes))]
+    return daily_trade_pnl(trades, trade_profits, len(vwap_minutes)), first_timestamps[0]
+
+
+# Aggregates trades into daily buckets (UTC days, i.e. `timestamp // 86400`). All per-trade values are
+# prepared once as arrays and then summed per day with `np.bincount`, with one `profits` array per VWAP window.
+# Trades from the last VWAP window get excluded from profit calculation by `calculate_pnl`, these do not count
+# as missing profits. Only trades for which price information was missing do.
+def daily_pnl(trades: list, vwaps: List[np.ndarray], vwaps_start: int) -> dict:
+    assert(isinstance(trades, list))
+    assert(isinstance(vwaps, list))
+    assert(isinstance(vwaps_start, int))
+
+    trades = sorted(trades, key=lambda trade: trade.timestamp)
+
+    if vwaps_start != -1:
+        pnl_trades, pnl_prices, pnl_timestamps = prepare_trades_for_pnl(trades)
+        trade_profits = [calculate_pnl(pnl_trades, pnl_prices, pnl_timestamps, window_vwaps, vwaps_start) for window_vwaps in vwaps]
+    else:
+        trade_profits = None
+
+    return daily_trade_pnl(trades, trade_profits, len(vwaps))
+
+
+# `trades` have to be sorted by timestamp, `trade_profits` has got one array of profits per VWAP window, each of them
+# covering the first trades only (see `calculate_pnl`), or is `None` if profits could not be calculated at all.
+def daily_trade_pnl(trades: list, trade_profits: Optional[List[np.ndarray]], windows: int) -> dict:
+    assert(isinstance(trades, list))
+    assert(isinstance(trade_profits, list) or (trade_profits is None))
+    assert(isinstance(windows, int))
+
+    timestamps = np.array([trade.timestamp for trade in trades], dtype=np.int64)
+    money = np.array([float(trade.money) for trade in trades], dtype=np.float64)
+    is_sell = np.array([trade.is_sell for trade in trades], dtype=bool)
+
+    days, day_indices = np.unique(timestamps // 86400, return_inverse=True)
+
+    def per_day(weights: np.ndarray, length: int = len(trades)) -> np.ndarray:
+        return np.bincount(day_indices[:length], weights=weights, minlength=len(days))
+
+    bought = per_day(np.where(is_sell, money, 0.0))
+    sold = per_day(np.where(is_sell, 0.0, money))
+
+    profits = []
+    missing_profits = np.zeros(len(days), dtype=bool)
+    if trade_profits is not None:
+        for window_profits in trade_profits:
+            trade_missing = np.isnan(window_profits)
+
+            profits.append(per_day(np.where(trade_missing, 0.0, window_profits), len(window_profits)))
+            missing_profits |= per_day(trade_missing.astype(np.float64), len(window_profits)) > 0
+
+    else:
+        profits = [np.zeros(len(days)) for _ in range(windows)]
+
+    return {'days': list(np.datetime_as_string(days.astype('datetime64[D]'))),
+            'timestamps': days * 86400,
+            'counts': np.bincount(day_indices, minlength=len(days)),
+            'volumes': per_day(money),
+            'bought': bought,
+            'sold': sold,
+            'nets': bought - sold,
+            'profits': profits,
+            'missing_profits': missing_profits}
+
+
+# `days` are the daily aggregates as returned by `daily_pnl`.
+def pnl_text(days: dict, vwaps_start: int, buy_token: str, sell_token: str, vwap_minutes: List[int], output: Optional[str], market_maker: Optional[str] = None):
+    assert(isinstance(days, dict))
+    assert(isinstance(vwap_minutes, list))
+
+    if buy_token.upper() in ['DAI', 'USD', 'USDT']:
+        amount_format = "{:,.2f} " + buy_token.upper()
+    else:
+        amount_format = "{:,.4f} " + buy_token.upper()
+
+    calculated_profits = vwaps_start != -1
+
+    data = [[day,
+             int(count),
+             amount_format.format(volume),
+             amount_format.format(bought),
+             amount_format.format(sold),
+             amount_format.format(net),
+             amount_format.format(cumulative_net)] +
+            [amount_format.format(profits[index]) if calculated_profits else "n/a" for profits in days['profits']] +
+            ["*" if missing_profits else ""]
+            for index, (day, count, volume, bought, sold, net, cumulative_net, missing_profits)
+            in enumerate(zip(days['days'], days['counts'], days['volumes'], days['bought'], days['sold'],
+                             days['nets'], np.cumsum(days['nets']), days['missing_profits']))]
+
+    total_volume = np.sum(days['volumes'])
+    total_profits = [np.sum(profits) for profits in days['profits']]
+
+    table = Texttable(max_width=250 + 25 * (len(vwap_minutes) - 1))
     table.set_deco(Texttable.HEADER)
-    table.set_cols_dtype(['t', 't', 't', 't', 't', 't', 't', 't', 't'])
-    table.set_cols_align(['l', 'r', 'r', 'r', 'r', 'r', 'r', 'r', 'l'])
-    table.set_cols_width([11, 9, 18, 22, 18, 26, 20, 25, 10])
-    table.add_rows([["Day", "# trades", "Volume", "Bought", "Sold", "Net bought", "Cumulative net bought", "Profit", "Remarks"]] + data)
+    table.set_cols_dtype(['t', 't', 't', 't', 't', 't', 't'] + ['t'] * len(vwap_minutes) + ['t'])
+    table.set_cols_align(['l', 'r', 'r', 'r', 'r', 'r', 'r'] + ['r'] * len(vwap_minutes) + ['l'])
+    table.set_cols_width([11, 9, 18, 22, 18, 26, 20] + [25] * len(vwap_minutes) + [10])
+    table.add_rows([["Day", "# trades", "Volume", "Bought", "Sold", "Net bought", "Cumulative net bought"] + profit_headers(vwap_minutes) + ["Remarks"]] + data)
 
-    result = f"PnL report for {sell_token}/{buy_token} market-making:" + "\n" + \
+    result = f"PnL report for {sell_token}/{buy_token} market-making{f' by {market_maker}' if market_maker else ''}:" + "\n" + \
              f"" + "\n" + \
              table.draw() + "\n" + \
              f"" + "\n" + \
@@ -183,19 +403,20 @@ def pnl_text(trades: list, vwaps: list, vwaps_start: int, buy_token: str, sell_t
 
     if vwaps_start != -1:
         result = result + \
-                 f"The last window of {vwap_minutes} minutes of trades is excluded from profit calculation." + "\n" + \
+                 f"The last window of {' / '.join(map(str, vwap_minutes))} minutes of trades is excluded from profit calculation." + "\n" + \
                  f"" + "\n" + \
                  f"Remarks:" + "\n" + \
                  f"*) Profit calculation for that day incomplete due to missing price information." + "\n"
 
     result = result + \
              f"" + "\n" + \
-             f"Total number of trades: {len(trades)}" + "\n" + \
-             f"Total volume: " + amount_format.format(float(total_volume)) + "\n"
+             f"Total number of trades: {int(np.sum(days['counts']))}" + "\n" + \
+             f"Total volume: " + amount_format.format(total_volume) + "\n"
 
     if vwaps_start != -1:
-        result = result + \
-               f"Total profit: " + amount_format.format(total_profit) + "\n"
+        for header, total_profit in zip(profit_headers(vwap_minutes), total_profits):
+            result = result + \
+                   f"Total {header.replace('Profit', 'profit')}: " + amount_format.format(total_profit) + "\n"
 
     result = result + \
              f"" + "\n" + \
@@ -209,13 +430,14 @@ def pnl_text(trades: list, vwaps: list, vwaps_start: int, buy_token: str, sell_t
         print(result)
 
 
-def pnl_chart(start_timestamp: int, end_timestamp: int, prices: List[Price], trades: list, vwaps: list, vwaps_start: int, buy_token: str, sell_token: str, output: Optional[str]):
+def pnl_chart(start_timestamp: int, end_timestamp: int, prices: PriceSeries, trades: list, vwaps: List[np.ndarray], vwaps_start: int, buy_token: str, sell_token: str, vwap_minutes: List[int], output: Optional[str], market_maker: Optional[str] = None):
     import matplotlib.dates as md
     import matplotlib.pyplot as plt
 
+    assert(isinstance(vwaps, list))
+    assert(isinstance(vwap_minutes, list))
+
     pnl_trades, pnl_prices, pnl_timestamps = prepare_trades_for_pnl(trades)
-    pnl_profits = calculate_pnl(pnl_trades, pnl_prices, pnl_timestamps, vwaps, vwaps_start)
-    pnl_profits = pnl_profits[~np.isnan(pnl_profits)]
 
     fig, ax = plt.subplots()
     ax.set_xlim(left=timestamp_to_x(start_timestamp), right=timestamp_to_x(end_timestamp))
@@ -227,15 +449,26 @@ def pnl_chart(start_timestamp: int, end_timestamp: int, prices: List[Price], tra
     ax.set_zorder(ax2.get_zorder()+1)
     ax.patch.set_visible(False)
 
-    dt_timestamps = [datetime.datetime.fromtimestamp(timestamp) for timestamp in pnl_timestamps]
-    ax.plot(dt_timestamps[:len(pnl_profits)], np.cumsum(pnl_profits), color='green')
+    pnl_x = timestamps_to_x(pnl_timestamps)
+    colors = ['green', 'blue', 'orange', 'purple', 'brown', 'olive', 'cyan']
+
+    titles = []
+    for index, (window_vwaps, header) in enumerate(zip(vwaps, profit_headers(vwap_minutes))):
+        pnl_profits = calculate_pnl(pnl_trades, pnl_prices, pnl_timestamps, window_vwaps, vwaps_start)
+        pnl_profits = pnl_profits[~np.isnan(pnl_profits)]
+
+        ax.plot(pnl_x[:len(pnl_profits)], np.cumsum(pnl_profits), color=colors[index % len(colors)], label=header)
+        titles.append("{}: {:,.2f} {}".format(header, np.sum(pnl_profits), buy_token))
+
+    price_timestamps, price_values = downsample(prices.timestamps, prices.prices, start_timestamp, end_timestamp, chart_width(output))
+    ax2.plot(timestamps_to_x(price_timestamps), price_values, color='red')
 
-    ax2.plot(list(map(lambda price: timestamp_to_x(price.timestamp), prices)),
-             list(map(lambda price: price.price, prices)), color='red')
+    if len(vwaps) > 1:
+        ax.legend(loc='upper left')
 
     ax.set_ylabel(f"Cumulative PnL ({buy_token})")
     ax2.set_ylabel(f"{sell_token} price in {buy_token}")
-    plt.title("Profit: {:,.2f} {}".format(np.sum(pnl_profits), buy_token))
+    plt.title((f"{market_maker}\n" if market_maker else "") + ", ".join(titles))
 
     if output:
         plt.savefig(fname=output, dpi=300, bbox_inches='tight', pad_inches=0)
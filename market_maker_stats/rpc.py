@@ -0,0 +1,121 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# One session per connection pool size, shared by all threads, so `pool_size` is the actual
+# number of connections kept open to each node. Sessions can be safely shared for plain POSTs.
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _session(pool_size: int) -> requests.Session:
+    with _sessions_lock:
+        if pool_size not in _sessions:
+            session = requests.Session()
+            session.mount('http://', HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
+            session.mount('https://', HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
+            _sessions[pool_size] = session
+
+        return _sessions[pool_size]
+
+
+class TransientError(Exception):
+    pass
+
+
+def _post_batch_once(endpoint_uri: str, method: str, params_batch: list, timeout: float, pool_size: int) -> list:
+    payload = [{'jsonrpc': '2.0', 'id': index, 'method': method, 'params': params} for index, params in enumerate(params_batch)]
+
+    try:
+        response = _session(pool_size).post(endpoint_uri, json=payload, timeout=timeout)
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+        raise TransientError(f"JSON-RPC batch request failed: {e}")
+
+    if response.status_code == 429 or response.status_code >= 500:
+        raise TransientError(f"JSON-RPC batch request failed: {response.status_code} {response.reason}")
+
+    if not response.ok:
+        raise Exception(f"JSON-RPC batch request failed: {response.status_code} {response.reason}")
+
+    # if the node rejects the batch as a whole (for example because it is too large),
+    # it responds with a single error object instead of a list of responses
+    data = response.json()
+    if not isinstance(data, list):
+        error = data.get('error', data) if isinstance(data, dict) else data
+        raise Exception(f"JSON-RPC batch request of {len(params_batch)} `{method}` calls rejected by the node: {error}")
+
+    # nodes are allowed to return batch responses in any order, so we match them by `id`
+    results = {}
+    for item in data:
+        if 'error' in item:
+            raise Exception(f"JSON-RPC batch request failed: {item['error']}")
+
+        results[item.get('id')] = item.get('result')
+
+    missing = [index for index in range(len(params_batch)) if index not in results]
+    if len(missing) > 0:
+        raise Exception(f"JSON-RPC batch request failed: no responses for {len(missing)} out of {len(params_batch)} `{method}` calls")
+
+    return [results[index] for index in range(len(params_batch))]
+
+
+# Retries transient failures (network errors, timeouts, rate limiting and server errors)
+# with exponential backoff and full jitter, errors reported by the node are not retried.
+def _post_batch(endpoint_uri: str, method: str, params_batch: list, timeout: float, pool_size: int, max_retries: int = 5) -> list:
+    for attempt in range(max_retries + 1):
+        try:
+            return _post_batch_once(endpoint_uri, method, params_batch, timeout, pool_size)
+        except TransientError as e:
+            if attempt == max_retries:
+                raise Exception(f"{e} (gave up after {max_retries + 1} attempts)")
+
+            backoff = random.uniform(0, min(30.0, 0.5 * 2 ** attempt))
+            logging.info(f"{e}, retrying in {backoff:.1f} secs...")
+            time.sleep(backoff)
+
+
+# Calls the JSON-RPC `method` once for each element of `params_list`. Calls are grouped into JSON-RPC
+# batches of `batch_size` calls each, which are then sent to the node over at most `max_workers`
+# concurrent connections. Results are returned in the same order as `params_list`.
+def batch_request(endpoint_uri: str, method: str, params_list: list, batch_size: int = 100, max_workers: int = 4, timeout: float = 120) -> list:
+    assert(isinstance(endpoint_uri, str))
+    assert(isinstance(method, str))
+    assert(isinstance(params_list, list))
+    assert(isinstance(batch_size, int))
+    assert(isinstance(max_workers, int))
+
+    batches = [params_list[index:index + batch_size] for index in range(0, len(params_list), batch_size)]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(lambda batch: _post_batch(endpoint_uri, method, batch, timeout, max_workers), batches)
+        return [result for batch_results in results for result in batch_results]
+
+
+def get_blocks_by_hash(endpoint_uri: str, block_hashes: List[str]) -> List[dict]:
+    return batch_request(endpoint_uri, 'eth_getBlockByHash', [[block_hash, False] for block_hash in block_hashes])
+
+
+def get_blocks_by_number(endpoint_uri: str, block_numbers: List[int]) -> List[dict]:
+    return batch_request(endpoint_uri, 'eth_getBlockByNumber', [[hex(block_number), False] for block_number in block_numbers])
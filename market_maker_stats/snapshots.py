@@ -0,0 +1,98 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import json
+import os
+from typing import Optional
+
+import filelock
+
+from market_maker_stats.util import cache_folder
+
+
+class OrderBookSnapshots:
+    """Persistent snapshots of a reconstructed order book, each taken at a specific block.
+
+    A snapshot consists of the block number, its timestamp and the live orders as of that block, in the compact
+    form returned by `OasisOrderBook.to_records()`. Charts starting at any later block can then be drawn by replaying
+    events from the snapshot onwards only, instead of replaying a fixed lookback window and hoping all the orders
+    alive at the start of the chart were created within it. Snapshots should only be taken at confirmed blocks.
+
+    Each order book (exchange contract and market maker) gets separate snapshots, identified by `key`.
+    At most `max_snapshots` snapshots are kept. Instead of simply dropping the oldest ones, snapshots get
+    thinned out by age, so they stay dense close to the most recent one but still reach further back. This way
+    a chart starting well before the most recent snapshot still finds one shortly before its start.
+    """
+
+    def __init__(self, key: str, max_snapshots: int = 64, filename: Optional[str] = None):
+        assert(isinstance(key, str))
+        assert(isinstance(max_snapshots, int))
+        assert(isinstance(filename, str) or (filename is None))
+
+        key_hash = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        self.filename = filename if filename is not None else os.path.join(cache_folder(), f'order_book_snapshots_{key_hash}.json')
+        self.max_snapshots = max_snapshots
+        self.lock = filelock.FileLock(self.filename + '.lock')
+
+    def _read(self) -> list:
+        if os.path.isfile(self.filename):
+            with open(self.filename, 'r') as file:
+                return json.load(file)
+        else:
+            return []
+
+    # Returns the latest snapshot taken at or before `block_number`, or `None` if there is none.
+    def latest(self, block_number: int) -> Optional[dict]:
+        assert(isinstance(block_number, int))
+
+        with self.lock:
+            snapshots = self._read()
+
+        return max(filter(lambda snapshot: snapshot['block_number'] <= block_number, snapshots),
+                   key=lambda snapshot: snapshot['block_number'], default=None)
+
+    def add(self, block_number: int, timestamp: int, orders: list):
+        assert(isinstance(block_number, int))
+        assert(isinstance(timestamp, int))
+        assert(isinstance(orders, list))
+
+        with self.lock:
+            snapshots = {snapshot['block_number']: snapshot for snapshot in self._read()}
+            snapshots[block_number] = {'block_number': block_number, 'timestamp': timestamp, 'orders': orders}
+            snapshots = self._thin([snapshots[key] for key in sorted(snapshots)])
+
+            temporary_file = self.filename + '.tmp'
+            with open(temporary_file, 'w') as file:
+                json.dump(snapshots, file, separators=(',', ':'))
+
+            os.replace(temporary_file, self.filename)
+
+    # Evicts snapshots one by one until only `max_snapshots` are left, each time the one whose removal leaves
+    # the smallest gap between its neighbours relative to its age. The oldest and the most recent snapshot
+    # are always kept, so charts starting anywhere after the oldest one can always be replayed from a snapshot.
+    def _thin(self, snapshots: list) -> list:
+        snapshots = list(snapshots)
+        while len(snapshots) > max(self.max_snapshots, 2):
+            blocks = [snapshot['block_number'] for snapshot in snapshots]
+
+            def cost(index: int) -> float:
+                return (blocks[index + 1] - blocks[index - 1]) / (blocks[-1] - blocks[index])
+
+            del snapshots[min(range(1, len(snapshots) - 1), key=cost)]
+
+        return snapshots
@@ -27,6 +27,24 @@ def json_trades(trades: list, output: Optional[str], include_taker: bool = False
     assert(isinstance(trades, list))
     assert(isinstance(include_taker, bool))
 
+    write_result(json.dumps(json_trade_items(trades, include_taker), indent=True), output)
+
+
+# Lists trades of many market makers as a single JSON document, keyed by market maker address
+# with the aggregate report under the "all" key, as `market_maker_reports` returns them. A single
+# market maker gets listed as a plain JSON array, the same way `json_trades` does it.
+def json_market_maker_trades(reports: list, output: Optional[str], include_taker: bool = False):
+    assert(isinstance(reports, list))
+    assert(isinstance(include_taker, bool))
+
+    if len(reports) == 1:
+        json_trades(reports[0][1], output, include_taker)
+    else:
+        write_result(json.dumps({suffix if suffix is not None else 'all': json_trade_items(trades, include_taker)
+                                 for _, trades, suffix in reports}, indent=True), output)
+
+
+def json_trade_items(trades: list, include_taker: bool) -> list:
     def build_item(trade) -> dict:
         item = {
             'exchange': trade.exchange,
@@ -47,8 +65,10 @@ def json_trades(trades: list, output: Optional[str], include_taker: bool = False
 
         return item
 
-    result = json.dumps(list(map(build_item, trades)), indent=True)
+    return list(map(build_item, trades))
 
+
+def write_result(result: str, output: Optional[str]):
     if output is not None:
         with open(output, "w") as file:
             file.write(result)
@@ -57,7 +77,7 @@ def json_trades(trades: list, output: Optional[str], include_taker: bool = False
         print(result)
 
 
-def text_trades(buy_token, sell_token, trades, output: Optional[str], include_taker: bool = False):
+def text_trades(buy_token, sell_token, trades, output: Optional[str], include_taker: bool = False, market_maker: Optional[str] = None):
     assert(isinstance(buy_token, str) or (buy_token is None))
     assert(isinstance(sell_token, str) or (sell_token is None))
     assert(isinstance(trades, list))
@@ -92,16 +112,12 @@ def text_trades(buy_token, sell_token, trades, output: Optional[str], include_ta
                      f"Amount",
                      f"Value"] + (["Taker"] if include_taker else [])] + list(map(table_row, trades)))
 
-    result = table.draw() + "\n\n" + \
+    result = (f"Trades of {market_maker}:" + "\n\n" if market_maker else "") + \
+             table.draw() + "\n\n" + \
              f"Number of trades: {len(trades)}" + "\n" + \
              f"Generated at: {datetime.datetime.now(tz=pytz.UTC).strftime('%Y.%m.%d %H:%M:%S %Z')}"
 
-    if output is not None:
-        with open(output, "w") as file:
-            file.write(result)
-
-    else:
-        print(result)
+    write_result(result, output)
 
 
 def format_timestamp(timestamp: int):
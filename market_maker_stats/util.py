@@ -20,22 +20,30 @@ import json
 import logging
 
 import errno
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import closing
 from functools import reduce
 from pprint import pformat
 
-import filelock
 import pytz
 import re
 import requests
 import os
+import random
+import sqlite3
+import threading
 import time
 import numpy as np
-from typing import List, Optional
+from typing import List, Optional, Iterator
 
 from appdirs import user_cache_dir
+from eth_utils import encode_hex
 from web3 import Web3
 
+from market_maker_stats.candles import CandleStore, rollup_candles
 from market_maker_stats.model import AllTrade
+from market_maker_stats.rpc import get_blocks_by_hash, get_blocks_by_number
+from pymaker import Address
 from pymaker.numeric import Wad
 
 SIZE_MIN = 5
@@ -80,6 +88,100 @@ class Price:
         return pformat(vars(self))
 
 
+class PriceSeries:
+    """Time series of prices, stored column by column in NumPy arrays.
+
+    Timestamps are kept in an `int64` array, all other columns are `float64` arrays in which
+    missing values are represented as NaN. Slicing a `PriceSeries` does not copy any data.
+    """
+
+    def __init__(self, timestamps, prices, buy_prices, sell_prices, volumes):
+        self.timestamps = np.asarray(timestamps, dtype=np.int64)
+        self.prices = np.asarray(prices, dtype=np.float64)
+        self.buy_prices = np.asarray(buy_prices, dtype=np.float64)
+        self.sell_prices = np.asarray(sell_prices, dtype=np.float64)
+        self.volumes = np.asarray(volumes, dtype=np.float64)
+
+        assert(len(self.timestamps) == len(self.prices) == len(self.buy_prices) == len(self.sell_prices) == len(self.volumes))
+
+    @staticmethod
+    def empty():
+        return PriceSeries([], [], [], [], [])
+
+    @staticmethod
+    def from_prices(prices: List[Price]):
+        assert(isinstance(prices, list))
+
+        def column(name: str) -> np.ndarray:
+            return np.array([getattr(price, name) if getattr(price, name) is not None else np.nan for price in prices], dtype=np.float64)
+
+        return PriceSeries(timestamps=np.array([price.timestamp for price in prices], dtype=np.int64),
+                           prices=column('price'),
+                           buy_prices=column('buy_price'),
+                           sell_prices=column('sell_price'),
+                           volumes=column('volume'))
+
+    @staticmethod
+    def concatenate(series: list):
+        assert(isinstance(series, list))
+
+        if len(series) == 0:
+            return PriceSeries.empty()
+
+        return PriceSeries(timestamps=np.concatenate([item.timestamps for item in series]),
+                           prices=np.concatenate([item.prices for item in series]),
+                           buy_prices=np.concatenate([item.buy_prices for item in series]),
+                           sell_prices=np.concatenate([item.sell_prices for item in series]),
+                           volumes=np.concatenate([item.volumes for item in series]))
+
+    def to_prices(self) -> List[Price]:
+        def optional(value):
+            return None if np.isnan(value) else float(value)
+
+        return [Price(timestamp=int(self.timestamps[index]),
+                      price=optional(self.prices[index]),
+                      buy_price=optional(self.buy_prices[index]),
+                      sell_price=optional(self.sell_prices[index]),
+                      volume=optional(self.volumes[index])) for index in range(len(self))]
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __getitem__(self, index):
+        assert(isinstance(index, slice))
+
+        return PriceSeries(timestamps=self.timestamps[index],
+                           prices=self.prices[index],
+                           buy_prices=self.buy_prices[index],
+                           sell_prices=self.sell_prices[index],
+                           volumes=self.volumes[index])
+
+    # Assumes the series is sorted by timestamp. Both `start_timestamp` and `end_timestamp` are inclusive.
+    def between(self, start_timestamp: int, end_timestamp: int):
+        begin = np.searchsorted(self.timestamps, start_timestamp, side='left')
+        end = np.searchsorted(self.timestamps, end_timestamp, side='right')
+
+        return self[begin:end]
+
+    def inverse(self):
+        with np.errstate(divide='ignore'):
+            return PriceSeries(timestamps=self.timestamps,
+                               prices=1/self.prices,
+                               buy_prices=1/self.buy_prices,
+                               sell_prices=1/self.sell_prices,
+                               volumes=self.volumes)
+
+    # Returns indices `i` such that there is a gap of more than `max_gap` seconds between sample `i-1` and sample `i`.
+    def gaps(self, max_gap: int) -> np.ndarray:
+        return np.nonzero(np.diff(self.timestamps) > max_gap)[0] + 1
+
+    def buy_or_mid_prices(self) -> np.ndarray:
+        return np.where(np.isnan(self.buy_prices), self.prices, self.buy_prices)
+
+    def sell_or_mid_prices(self) -> np.ndarray:
+        return np.where(np.isnan(self.sell_prices), self.prices, self.sell_prices)
+
+
 class OrderHistoryItem:
     def __init__(self, timestamp: int, orders: list):
         self.timestamp = timestamp
@@ -104,6 +206,46 @@ class OrderHistoryItem:
         return list(map(lambda order: Wad.from_number(order['price']), self.buy_orders()))
 
 
+class OrderBookSeries:
+    """Time series of the closest sell (best ask) and closest buy (best bid) prices of our orders.
+
+    Timestamps are kept in an `int64` array, prices in `float64` arrays in which the lack
+    of orders on the given side is represented as NaN.
+    """
+
+    def __init__(self, timestamps, closest_sell_prices, closest_buy_prices):
+        self.timestamps = np.asarray(timestamps, dtype=np.int64)
+        self.closest_sell_prices = np.asarray(closest_sell_prices, dtype=np.float64)
+        self.closest_buy_prices = np.asarray(closest_buy_prices, dtype=np.float64)
+
+        assert(len(self.timestamps) == len(self.closest_sell_prices) == len(self.closest_buy_prices))
+
+    @staticmethod
+    def empty():
+        return OrderBookSeries([], [], [])
+
+    @staticmethod
+    def from_order_history(items: List[OrderHistoryItem]):
+        assert(isinstance(items, list))
+
+        def optional(price: Optional[Wad]) -> float:
+            return float(price) if price is not None else np.nan
+
+        return OrderBookSeries(timestamps=np.array([item.timestamp for item in items], dtype=np.int64),
+                               closest_sell_prices=np.array([optional(item.closest_sell_price()) for item in items], dtype=np.float64),
+                               closest_buy_prices=np.array([optional(item.closest_buy_price()) for item in items], dtype=np.float64))
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __getitem__(self, index):
+        assert(isinstance(index, slice))
+
+        return OrderBookSeries(timestamps=self.timestamps[index],
+                               closest_sell_prices=self.closest_sell_prices[index],
+                               closest_buy_prices=self.closest_buy_prices[index])
+
+
 def to_seconds(string: str) -> int:
     assert(isinstance(string, str))
     seconds_per_unit = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
@@ -140,12 +282,169 @@ def amount_in_usd_to_size(amount_in_usd: Wad):
     return max(min(float(amount_in_usd) / float(SIZE_PRICE_MAX) * SIZE_MAX, SIZE_MAX), SIZE_MIN)
 
 
+class BlockTimestamps:
+    """Persistent block hash/number to block timestamp index, backed by an SQLite database.
+
+    Lookups are memoized in memory as well, so each block gets fetched from the node at most once
+    per run, and at most once ever as long as the cache folder is kept.
+    """
+
+    def __init__(self, filename: str):
+        assert(isinstance(filename, str))
+
+        self.filename = filename
+        self.by_hash = {}
+        self.by_number = {}
+
+        with closing(self._connect()) as connection, connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS blocks (hash TEXT PRIMARY KEY, number INTEGER, timestamp INTEGER)")
+            connection.execute("CREATE INDEX IF NOT EXISTS blocks_number ON blocks (number)")
+
+    def _connect(self):
+        return sqlite3.connect(self.filename, timeout=60)
+
+    def _remember(self, block_hash: str, block_number: int, timestamp: int):
+        self.by_hash[block_hash] = timestamp
+        self.by_number[block_number] = timestamp
+
+    def _load(self, column: str, keys: list):
+        with closing(self._connect()) as connection, connection:
+            for index in range(0, len(keys), 500):
+                chunk = keys[index:index + 500]
+                rows = connection.execute(f"SELECT hash, number, timestamp FROM blocks WHERE {column} IN ({','.join('?' * len(chunk))})", chunk)
+                for row in rows:
+                    self._remember(row[0], row[1], row[2])
+
+    def _store(self, blocks: list):
+        if None in blocks:
+            raise Exception("Unable to fetch block timestamps, some blocks were not found")
+
+        rows = [(block['hash'], int(block['number'], 16), int(block['timestamp'], 16)) for block in blocks]
+
+        with closing(self._connect()) as connection, connection:
+            connection.executemany("INSERT OR REPLACE INTO blocks (hash, number, timestamp) VALUES (?, ?, ?)", rows)
+
+        for row in rows:
+            self._remember(row[0], row[1], row[2])
+
+    # Makes sure timestamps of all given blocks are known, first by looking them up in the database
+    # and then by fetching the remaining ones from the node using batched JSON-RPC requests.
+    def prefetch(self, infura: Web3, block_hashes: list, block_numbers: list):
+        assert(isinstance(infura, Web3))
+        assert(isinstance(block_hashes, list))
+        assert(isinstance(block_numbers, list))
+
+        block_hashes = list(set(map(to_hex, block_hashes)) - set(self.by_hash))
+        block_numbers = list(set(block_numbers) - set(self.by_number))
+
+        self._load('hash', block_hashes)
+        self._load('number', block_numbers)
+
+        block_hashes = list(filter(lambda block_hash: block_hash not in self.by_hash, block_hashes))
+        block_numbers = list(filter(lambda block_number: block_number not in self.by_number, block_numbers))
+
+        endpoint_uri = infura.providers[0].endpoint_uri
+        if len(block_hashes) > 0:
+            self._store(get_blocks_by_hash(endpoint_uri, block_hashes))
+
+        if len(block_numbers) > 0:
+            self._store(get_blocks_by_number(endpoint_uri, block_numbers))
+
+    def by_block_hash(self, infura: Web3, block_hash) -> int:
+        block_hash = to_hex(block_hash)
+
+        if block_hash not in self.by_hash:
+            self.prefetch(infura, [block_hash], [])
+
+        return self.by_hash[block_hash]
+
+    # Lookups by block number are not reorg-proof, but as uncle blocks have got nearly identical
+    # timestamps it does not really matter for the purpose of these tools.
+    def by_block_number(self, infura: Web3, block_number: int) -> int:
+        assert(isinstance(block_number, int))
+
+        if block_number not in self.by_number:
+            self.prefetch(infura, [], [block_number])
+
+        return self.by_number[block_number]
+
+
+_block_timestamps = None
+
+
+def block_timestamps() -> BlockTimestamps:
+    global _block_timestamps
+
+    if _block_timestamps is None:
+        _block_timestamps = BlockTimestamps(os.path.join(cache_folder(), 'block_timestamps.db'))
+
+    return _block_timestamps
+
+
+def to_hex(value) -> str:
+    return encode_hex(value) if isinstance(value, (bytes, bytearray)) else value
+
+
 def get_block_timestamp(infura: Web3, block_number):
-    return infura.eth.getBlock(block_number).timestamp
+    return block_timestamps().by_block_number(infura, block_number)
+
+
+# Finds the first block in the `low`..`high` range with a timestamp not earlier than `timestamp`. Returns `high`
+# if there is no such block. Each round splits the range into `probes + 1` parts and fetches the timestamps of all
+# the probed blocks in one batch, so only a few round trips are needed even for long ranges. All blocks visited
+# along the way end up in the block timestamp index.
+def get_block_number_at(infura: Web3, timestamp: int, low: int, high: int, probes: int = 15) -> int:
+    assert(isinstance(timestamp, int))
+    assert(isinstance(low, int))
+    assert(isinstance(high, int))
+    assert(isinstance(probes, int))
+
+    while low < high:
+        if high - low <= probes:
+            block_numbers = list(range(low, high))
+        else:
+            block_numbers = sorted(set(low + (high - low) * index // (probes + 1) for index in range(1, probes + 1)))
+
+        block_timestamps().prefetch(infura, [], block_numbers)
+
+        for block_number in block_numbers:
+            if get_block_timestamp(infura, block_number) < timestamp:
+                low = block_number + 1
+            else:
+                high = block_number
+                break
+
+    return low
+
+
+# Finds the block `contract_address` got deployed in, i.e. the first block not later than `to_block` at which
+# the contract already has code, by bisecting `eth_getCode` calls. Needs a node which keeps historical state.
+def get_deployment_block(web3: Web3, contract_address: Address, to_block: int) -> int:
+    assert(isinstance(web3, Web3))
+    assert(isinstance(contract_address, Address))
+    assert(isinstance(to_block, int))
+
+    def has_code(block_number: int) -> bool:
+        code = web3.manager.request_blocking("eth_getCode", [contract_address.address, hex(block_number)])
+        return to_hex(code) not in ['0x', '0x0', '']
+
+    low, high = 0, to_block
+    while low < high:
+        middle = (low + high) // 2
+        if has_code(middle):
+            high = middle
+        else:
+            low = middle + 1
+
+    return low
 
 
 def get_event_timestamp(infura: Web3, event):
-    return infura.eth.getBlock(event.raw['blockHash']).timestamp
+    return block_timestamps().by_block_hash(infura, event.raw['blockHash'])
+
+
+def prefetch_event_timestamps(infura: Web3, events: list):
+    block_timestamps().prefetch(infura, list(map(lambda event: event.raw['blockHash'], events)), [])
 
 
 def cache_folder():
@@ -160,15 +459,70 @@ def cache_folder():
     return db_folder
 
 
-def get_prices(gdax_price: Optional[str], price_feed: Optional[str], price_history_file: Optional[str], start_timestamp: int, end_timestamp: int):
+# Prices can be requested at a coarser `resolution` (in seconds) than one minute, in which case they get
+# rolled up to the coarsest of `PRICE_RESOLUTIONS` not exceeding it. GDAX prices come from the rollups kept
+# in the candle store, prices from other sources get rolled up on the fly.
+def get_prices(gdax_price: Optional[str], price_feed: Optional[str], price_history_file: Optional[str], start_timestamp: int, end_timestamp: int,
+               resolution: int = 60) -> PriceSeries:
+    assert(isinstance(resolution, int))
+
+    resolution = price_resolution(resolution)
     if price_feed:
-        return get_price_feed(price_feed, start_timestamp, end_timestamp)
+        return rollup_prices(get_price_feed(price_feed, start_timestamp, end_timestamp), resolution)
     elif price_history_file:
-        return get_file_prices(price_history_file, start_timestamp, end_timestamp)
+        return rollup_prices(get_file_prices(price_history_file, start_timestamp, end_timestamp), resolution)
     elif gdax_price:
-        return get_gdax_prices(gdax_price, start_timestamp, end_timestamp)
+        return get_gdax_prices(gdax_price, start_timestamp, end_timestamp, resolution)
     else:
-        return []
+        return PriceSeries.empty()
+
+
+PRICE_RESOLUTIONS = [60] + CandleStore.RESOLUTIONS
+
+# Number of GDAX batches (four hours each) downloaded at once when streaming prices.
+GDAX_WINDOW = 24
+
+
+def price_resolution(resolution: int) -> int:
+    assert(isinstance(resolution, int))
+    return max(filter(lambda level: level <= resolution, PRICE_RESOLUTIONS), default=60)
+
+
+# Rolls up `prices` (sorted by timestamp) to `resolution` seconds. Prices get averaged weighted by volume,
+# or without any weights if there is no volume information, buy and sell prices are plain averages.
+def rollup_prices(prices: PriceSeries, resolution: int) -> PriceSeries:
+    assert(isinstance(prices, PriceSeries))
+    assert(isinstance(resolution, int))
+
+    if resolution == 60 or len(prices) == 0:
+        return prices
+
+    buckets = prices.timestamps - prices.timestamps % resolution
+    starts = np.flatnonzero(np.concatenate([[True], buckets[1:] != buckets[:-1]]))
+
+    def average(values: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        weights = np.where(np.isnan(values), 0.0, weights)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.add.reduceat(np.where(np.isnan(values), 0.0, values) * weights, starts) / np.add.reduceat(weights, starts)
+
+    volumes = np.where(np.isnan(prices.volumes), 0.0, prices.volumes)
+    weighted_prices = average(prices.prices, volumes)
+    plain_prices = average(prices.prices, np.ones(len(prices)))
+
+    return PriceSeries(timestamps=buckets[starts],
+                       prices=np.where(np.isnan(weighted_prices), plain_prices, weighted_prices),
+                       buy_prices=average(prices.buy_prices, np.ones(len(prices))),
+                       sell_prices=average(prices.sell_prices, np.ones(len(prices))),
+                       volumes=np.add.reduceat(volumes, starts))
+
+
+# Same as `get_prices`, but yields prices in consecutive batches instead. Only GDAX prices can actually
+# be streamed, prices from other sources are always yielded as one batch.
+def iter_prices(gdax_price: Optional[str], price_feed: Optional[str], price_history_file: Optional[str], start_timestamp: int, end_timestamp: int) -> Iterator[PriceSeries]:
+    if gdax_price and not price_feed and not price_history_file:
+        yield from iter_gdax_prices(gdax_price, start_timestamp, end_timestamp)
+    else:
+        yield get_prices(gdax_price, price_feed, price_history_file, start_timestamp, end_timestamp)
 
 
 def get_order_history(endpoint: Optional[str], start_timestamp: int, end_timestamp: int):
@@ -190,60 +544,165 @@ def get_order_history(endpoint: Optional[str], start_timestamp: int, end_timesta
                                                   orders=list(item['orders'])), result.json()['items']))
 
 
-def get_file_prices(filename: str, start_timestamp: int, end_timestamp: int):
+def get_file_prices(filename: str, start_timestamp: int, end_timestamp: int) -> PriceSeries:
+    timestamps = []
     prices = []
+    volumes = []
     with open(filename, "r") as file:
         for line in file:
             try:
                 record = json.loads(line)
                 timestamp = record['timestamp']
-                price = record['price']
+                price = float(record['price'])
+                volume = float(record['volume']) if 'volume' in record and record['volume'] is not None else np.nan
 
                 if start_timestamp <= timestamp <= end_timestamp:
-                    prices.append(Price(timestamp=timestamp,
-                                        price=price,
-                                        buy_price=None,
-                                        sell_price=None,
-                                        volume=record['volume'] if 'volume' in record else None))
+                    timestamps.append(timestamp)
+                    prices.append(price)
+                    volumes.append(volume)
             except:
                 pass
 
-    return sorted(prices, key=lambda price: price.timestamp)
+    order = np.argsort(np.array(timestamps, dtype=np.int64), kind='stable')
+    return PriceSeries(timestamps=np.array(timestamps, dtype=np.int64)[order],
+                       prices=np.array(prices, dtype=np.float64)[order],
+                       buy_prices=np.full(len(order), np.nan),
+                       sell_prices=np.full(len(order), np.nan),
+                       volumes=np.array(volumes, dtype=np.float64)[order])
 
 
-def get_price_feed(endpoint: str, start_timestamp: int, end_timestamp: int):
+def get_price_feed(endpoint: str, start_timestamp: int, end_timestamp: int) -> PriceSeries:
 
     if endpoint.startswith("fixed:"):
         price = float(endpoint.replace("fixed:", ""))
+        timestamps = np.arange(start_timestamp, end_timestamp, 60, dtype=np.int64)
 
-        result = []
-        for timestamp in range(start_timestamp, end_timestamp, 60):
-            result.append(Price(timestamp=timestamp, price=price, buy_price=price, sell_price=price, volume=1.0))
-
-        return result
+        return PriceSeries(timestamps=timestamps,
+                           prices=np.full(len(timestamps), price),
+                           buy_prices=np.full(len(timestamps), price),
+                           sell_prices=np.full(len(timestamps), price),
+                           volumes=np.full(len(timestamps), 1.0))
 
     result = requests.get(f"{endpoint}?min={start_timestamp}&max={end_timestamp}", timeout=15.5)
     if not result.ok:
         raise Exception(f"Failed to fetch price feed history: {result.status_code} {result.reason}")
 
-    return list(map(lambda item: Price(timestamp=item['timestamp'],
-                                       price=float(item['data']['price']) if 'price' in item['data'] else None,
-                                       buy_price=float(item['data']['buyPrice']) if 'buyPrice' in item['data'] else None,
-                                       sell_price=float(item['data']['sellPrice']) if 'sellPrice' in item['data'] else None,
-                                       volume=None), result.json()['items']))
+    def column(items: list, name: str) -> np.ndarray:
+        return np.array([float(item['data'][name]) if name in item['data'] else np.nan for item in items], dtype=np.float64)
 
+    items = result.json()['items']
+    return PriceSeries(timestamps=np.array([item['timestamp'] for item in items], dtype=np.int64),
+                       prices=column(items, 'price'),
+                       buy_prices=column(items, 'buyPrice'),
+                       sell_prices=column(items, 'sellPrice'),
+                       volumes=np.full(len(items), np.nan))
 
-def get_gdax_prices(product: str, start_timestamp: int, end_timestamp: int):
-    prices = []
+
+def get_gdax_prices(product: str, start_timestamp: int, end_timestamp: int, resolution: int = 60) -> PriceSeries:
+    assert(isinstance(resolution, int))
+
+    resolution = price_resolution(resolution)
+    if resolution == 60:
+        return PriceSeries.concatenate(list(iter_gdax_prices(product, start_timestamp, end_timestamp)))
+
+    if product == 'USD-ETH':
+        return get_gdax_prices('ETH-USD', start_timestamp, end_timestamp, resolution).inverse()
+
+    if product == 'USD-BTC':
+        return get_gdax_prices('BTC-USD', start_timestamp, end_timestamp, resolution).inverse()
+
+    store, batches, downloaded, can_cache = gdax_sync(product, start_timestamp, end_timestamp)
+
+    # We return all buckets `start_timestamp`..`end_timestamp` falls into. Cached batches always precede the ones
+    # which can not be cached yet. Buckets which lie entirely within the cached batches come from the rollups in
+    # the store, the remaining ones get rolled up on the fly.
+    first_bucket = start_timestamp - start_timestamp % resolution
+    uncached = list(filter(lambda batch: not can_cache(batch), batches))
+    split_timestamp = uncached[0][0] if len(uncached) > 0 else end_timestamp + 1
+    split_bucket = split_timestamp - split_timestamp % resolution
+
+    cached_candles = store.candles(first_bucket, min(split_bucket - resolution, end_timestamp), resolution)
+    remaining_candles = [store.candles(max(split_bucket, first_bucket), split_timestamp - 1)] + \
+                        [gdax_candles(downloaded[batch], max(batch[0], first_bucket), min(batch[1] - 1, end_timestamp)) for batch in uncached]
+    remaining_candles = rollup_candles({name: np.concatenate([candles[name] for candles in remaining_candles]) for name in CandleStore.COLUMNS}, resolution)
+
+    return PriceSeries.concatenate([get_gdax_partial(cached_candles), get_gdax_partial(remaining_candles)])
+
+
+# Yields prices batch by batch, in chronological order. Batches are treated as half-open ranges
+# so candles on batch boundaries do not get duplicated, which means the concatenation of all the
+# yielded series is already sorted and does not need any post-processing.
+#
+# Missing batches get downloaded in windows of `window` batches, each just before it is needed,
+# so the first prices get yielded without waiting for the whole range to be downloaded.
+def iter_gdax_prices(product: str, start_timestamp: int, end_timestamp: int, window: int = GDAX_WINDOW) -> Iterator[PriceSeries]:
+    assert(isinstance(window, int))
+
+    if product == 'USD-ETH':
+        yield from map(lambda prices: prices.inverse(), iter_gdax_prices('ETH-USD', start_timestamp, end_timestamp, window))
+        return
+
+    if product == 'USD-BTC':
+        yield from map(lambda prices: prices.inverse(), iter_gdax_prices('BTC-USD', start_timestamp, end_timestamp, window))
+        return
+
+    store = CandleStore(cache_folder(), product)
+    batches, can_cache = gdax_batches(start_timestamp, end_timestamp)
+
+    for window_start in range(0, len(batches), window):
+        window_batches = batches[window_start:window_start + window]
+        downloaded = gdax_fill(store, product, window_batches, can_cache)
+
+        for batch in window_batches:
+            range_start = max(batch[0], start_timestamp)
+            range_end = min(batch[1] - 1, end_timestamp)
+
+            if can_cache(batch):
+                yield get_gdax_partial(store.candles(range_start, range_end))
+            else:
+                yield get_gdax_partial(gdax_candles(downloaded[batch], range_start, range_end))
+
+
+# Makes sure the candle store has all the batches covering `start_timestamp`..`end_timestamp` which can be
+# cached. Returns the store, the list of batches, the downloaded data of each batch which had to be downloaded
+# and the function telling whether a batch can be cached.
+def gdax_sync(product: str, start_timestamp: int, end_timestamp: int) -> tuple:
+    store = CandleStore(cache_folder(), product)
+    batches, can_cache = gdax_batches(start_timestamp, end_timestamp)
+
+    return store, batches, gdax_fill(store, product, batches, can_cache), can_cache
+
+
+# Returns the list of batches covering `start_timestamp`..`end_timestamp`
+# and the function telling whether a batch can be cached.
+def gdax_batches(start_timestamp: int, end_timestamp: int) -> tuple:
+    batches = []
     timestamp = gdax_batch_begin(start_timestamp)
     while timestamp <= end_timestamp:
-        timestamp_range_start = timestamp
-        timestamp_range_end = gdax_batch_end(timestamp)
-        prices = prices + get_gdax_partial(product, timestamp_range_start, timestamp_range_end)
-        timestamp = timestamp_range_end
+        batches.append((timestamp, gdax_batch_end(timestamp)))
+        timestamp = gdax_batch_end(timestamp)
+
+    # We only cache batches if their end timestamp is at least one hour in the past.
+    # There is no good reason for choosing exactly one hour as the cutoff time.
+    cutoff_timestamp = int(time.time()) - 3600
+
+    def can_cache(batch: tuple) -> bool:
+        return batch[1] < cutoff_timestamp
+
+    return batches, can_cache
+
+
+# Downloads those of `batches` which are not in the candle store yet, or can not be cached at all, and adds
+# the ones which can be cached to the store. Returns the downloaded data of each batch which had to be downloaded.
+def gdax_fill(store: CandleStore, product: str, batches: list, can_cache) -> dict:
+    assert(isinstance(store, CandleStore))
+    assert(isinstance(product, str))
+    assert(isinstance(batches, list))
+
+    downloaded = gdax_download(product, list(filter(lambda batch: not (can_cache(batch) and store.has_batch(batch[0])), batches)))
+    store.add_batches([(batch[0], data) for batch, data in downloaded.items() if can_cache(batch)])
 
-    prices = list(filter(lambda price: start_timestamp <= price.timestamp <= end_timestamp, prices))
-    return sorted(prices, key=lambda price: price.timestamp)
+    return downloaded
 
 
 def gdax_batch_begin(start_timestamp):
@@ -255,76 +714,110 @@ def gdax_batch_end(batch_begin):
     return int((datetime.datetime.fromtimestamp(batch_begin) + datetime.timedelta(hours=4)).timestamp())
 
 
-def gdax_fetch(url):
-    try:
-        data = requests.get(url, timeout=30.5).json()
-    except:
-        logging.info("GDAX API network error, waiting 10 secs...")
-        time.sleep(10)
-        return gdax_fetch(url)
+def gdax_url(product: str, timestamp_range_start: int, timestamp_range_end: int) -> str:
+    start = datetime.datetime.fromtimestamp(timestamp_range_start, pytz.UTC)
+    end = datetime.datetime.fromtimestamp(timestamp_range_end, pytz.UTC)
+    return f"https://api.gdax.com/products/{product.upper()}/candles?" \
+           f"start={iso_8601(start)}&" \
+           f"end={iso_8601(end)}&" \
+           f"granularity=60"
+
+
+class TokenBucket:
+    """Thread-safe token bucket rate limiter, allowing `rate` calls per second with bursts of up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: int):
+        assert(isinstance(rate, float) or isinstance(rate, int))
+        assert(isinstance(capacity, int))
+
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait_time = (1 - self.tokens) / self.rate
 
-    if 'message' in data:
-        logging.info("GDAX API rate limiting, slowing down for 2 secs...")
-        time.sleep(2)
-        return gdax_fetch(url)
+            time.sleep(wait_time)
 
-    return data
 
+# GDAX public endpoints are rate limited to 3 requests per second, with bursts of up to 6 requests.
+gdax_rate_limiter = TokenBucket(rate=3, capacity=6)
 
-def get_gdax_partial(product: str, timestamp_range_start: int, timestamp_range_end: int) -> List[Price]:
+
+def gdax_fetch(url, max_retries: int = 8):
+    for attempt in range(max_retries + 1):
+        gdax_rate_limiter.acquire()
+
+        try:
+            data = requests.get(url, timeout=30.5).json()
+            if 'message' not in data:
+                return data
+
+            reason = f"GDAX API error ({data['message']})"
+        except Exception as e:
+            reason = f"GDAX API network error ({e})"
+
+        if attempt < max_retries:
+            # exponential backoff with full jitter, capped at 60 seconds
+            backoff = random.uniform(0, min(60.0, 0.5 * 2 ** attempt))
+            logging.info(f"{reason}, retrying in {backoff:.1f} secs...")
+            time.sleep(backoff)
+
+    raise Exception(f"Unable to fetch {url} from GDAX API after {max_retries + 1} attempts")
+
+
+def gdax_download(product: str, batches: list, max_workers: int = 4) -> dict:
     assert(isinstance(product, str))
-    assert(isinstance(timestamp_range_start, int))
-    assert(isinstance(timestamp_range_end, int))
+    assert(isinstance(batches, list))
 
-    if product == 'USD-ETH':
-        return list(map(lambda price: price.inverse(), get_gdax_partial('ETH-USD', timestamp_range_start, timestamp_range_end)))
+    if len(batches) == 0:
+        return {}
 
-    if product == 'USD-BTC':
-        return list(map(lambda price: price.inverse(), get_gdax_partial('BTC-USD', timestamp_range_start, timestamp_range_end)))
+    logging.info(f"Downloading {len(batches)} batches of {product} candles from GDAX...")
 
-    # We only cache batches if their end timestamp is at least one hour in the past.
-    # There is no good reason for choosing exactly one hour as the cutoff time.
-    can_cache = timestamp_range_end < int(time.time()) - 3600
-    cache_file = os.path.join(cache_folder(), f'gdax_{product.upper()}_{timestamp_range_start}_{timestamp_range_end}_60.json')
+    downloaded = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(gdax_fetch, gdax_url(product, batch[0], batch[1])): batch for batch in batches}
+        for future in as_completed(futures):
+            downloaded[futures[future]] = future.result()
 
-    start = datetime.datetime.fromtimestamp(timestamp_range_start, pytz.UTC)
-    end = datetime.datetime.fromtimestamp(timestamp_range_end, pytz.UTC)
-    url = f"https://api.gdax.com/products/{product.upper()}/candles?" \
-          f"start={iso_8601(start)}&" \
-          f"end={iso_8601(end)}&" \
-          f"granularity=60"
-
-    # Try do get data from cache
-    data_from_cache = None
-    if can_cache:
-        with filelock.FileLock(cache_file + ".lock"):
-            try:
-                if os.path.isfile(cache_file):
-                    with open(cache_file, 'r') as infile:
-                        data_from_cache = json.load(infile)
-            except:
-                pass
+            if len(downloaded) % 50 == 0 or len(downloaded) == len(batches):
+                logging.info(f"Downloaded {len(downloaded)} out of {len(batches)} batches of {product} candles")
+
+    return downloaded
 
-    if data_from_cache is None:
-        data_from_server = gdax_fetch(url)
 
-        if can_cache:
-            with filelock.FileLock(cache_file + ".lock"):
-                try:
-                    with open(cache_file, 'w') as outfile:
-                        json.dump(data_from_server, outfile)
-                except:
-                    pass
+# data is: [[ time, low, high, open, close, volume ], [...]], in the same form as it gets returned by `CandleStore.candles()`
+def gdax_candles(data: list, timestamp_range_start: int, timestamp_range_end: int) -> dict:
+    array = np.array(data, dtype=np.float64).reshape(len(data), len(CandleStore.COLUMNS))
+    array = array[np.argsort(array[:, 0], kind='stable')]
+    array = array[(array[:, 0] >= timestamp_range_start) & (array[:, 0] <= timestamp_range_end)]
 
-    # data is: [[ time, low, high, open, close, volume ], [...]]
-    data = data_from_cache if data_from_cache is not None else data_from_server
-    prices = list(map(lambda array: Price(timestamp=array[0],
-                                          price=(array[1] + array[2]) / 2,
-                                          buy_price=None,
-                                          sell_price=None,
-                                          volume=array[5]), data))
+    return {name: array[:, index].astype(np.int64) if name == 'timestamp' else array[:, index]
+            for index, name in enumerate(CandleStore.COLUMNS)}
 
-    return list(filter(lambda price: timestamp_range_start <= price.timestamp <= timestamp_range_end, prices))
+
+def get_gdax_partial(candles: dict) -> PriceSeries:
+    assert(isinstance(candles, dict))
+
+    # rolled up candles have got the volume weighted average price already
+    return PriceSeries(timestamps=candles['timestamp'],
+                       prices=candles['vwap'] if 'vwap' in candles else (candles['low'] + candles['high']) / 2,
+                       buy_prices=np.full(len(candles['timestamp']), np.nan),
+                       sell_prices=np.full(len(candles['timestamp']), np.nan),
+                       volumes=candles['volume'])
 
 
 def get_day(timestamp: int):
@@ -343,8 +836,51 @@ def format_timestamp(timestamp: int):
 
 
 def timestamp_to_x(timestamp):
+    return float(timestamps_to_x([timestamp])[0])
+
+
+# Matplotlib dates are days since the matplotlib epoch, so converting Unix timestamps
+# to them is just an offset and a division, which can be done for all of them at once.
+def timestamps_to_x(timestamps) -> np.ndarray:
     from matplotlib.dates import date2num
-    return date2num(datetime.datetime.fromtimestamp(int(timestamp), tz=pytz.UTC))
+    return date2num(datetime.datetime(1970, 1, 1, tzinfo=pytz.UTC)) + np.asarray(timestamps, dtype=np.float64) / 86400
+
+
+# Market maker addresses can be passed on the command line, or in a file with one address per line.
+def market_maker_addresses(addresses: Optional[List[str]], address_file: Optional[str]) -> List[Address]:
+    result = list(addresses) if addresses else []
+
+    if address_file:
+        with open(address_file, 'r') as file:
+            result += [line.strip() for line in file if line.strip() and not line.strip().startswith('#')]
+
+    return list(map(Address, dict.fromkeys(map(str.lower, result))))
+
+
+# With a single market maker, its report goes to the output file as before. With many of them, a report for each of them
+# goes to the output file with the market maker address appended to the file name, and the aggregate report goes to the
+# output file itself. Returns a list of (market maker label, trades, output file suffix) tuples. The label is `None` if
+# there is only one market maker, the suffix is `None` for the report which goes to the output file as given.
+#
+# Trades between two of the market makers only move tokens between them, so they get left out of the aggregate report.
+# Otherwise their volume would be counted twice, and the aggregate would show a position change which did not happen.
+def market_maker_reports(trades_by_maker: dict) -> list:
+    assert(isinstance(trades_by_maker, dict))
+
+    if len(trades_by_maker) == 1:
+        return [(None, next(iter(trades_by_maker.values())), None)]
+
+    all_trades = sorted((trade for trades in trades_by_maker.values() for trade in trades if trade.taker not in trades_by_maker), key=lambda trade: trade.timestamp)
+    return [(market_maker_address.address, trades, market_maker_address.address) for market_maker_address, trades in trades_by_maker.items()] + \
+           [(f"all {len(trades_by_maker)} market makers", all_trades, None)]
+
+
+def market_maker_output(output: Optional[str], suffix: Optional[str]) -> Optional[str]:
+    if output is None or suffix is None:
+        return output
+
+    base, extension = os.path.splitext(output)
+    return f"{base}-{suffix}{extension}"
 
 
 def sort_trades(trades: list) -> list:
@@ -15,14 +15,15 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from typing import List
+from typing import List, Dict
 
 from web3 import Web3
 
-from market_maker_stats.util import get_event_timestamp
+from market_maker_stats.events import past_events, events_between
+from market_maker_stats.util import get_event_timestamp, prefetch_event_timestamps
 from pymaker import Address
 from pymaker.numeric import Wad
-from pymaker.zrx import LogFill
+from pymaker.zrx import ZrxExchange, LogFill
 
 
 class Trade:
@@ -38,9 +39,26 @@ class Trade:
         self.taker = taker
 
 
+def past_fill(exchange: ZrxExchange, number_of_past_blocks: int, event_filter: dict = None) -> List[LogFill]:
+    assert(isinstance(exchange, ZrxExchange))
+    return past_events(exchange.web3, exchange.address, ZrxExchange.abi, 'LogFill', LogFill, number_of_past_blocks, event_filter)
+
+
+def fill_between(exchange: ZrxExchange, from_block: int, to_block: int, event_filter: dict = None) -> List[LogFill]:
+    assert(isinstance(exchange, ZrxExchange))
+    return events_between(exchange.web3, exchange.address, ZrxExchange.abi, 'LogFill', LogFill, from_block, to_block, event_filter)
+
+
 def zrx_trades(infura: Web3, market_maker_address: Address, buy_token: str, buy_token_address: Address, buy_token_decimals: int, sell_token: str, sell_token_addresses: List[Address], sell_token_decimals: int, past_fills: List[LogFill], exchange_name: str) -> list:
-    assert(isinstance(infura, Web3))
     assert(isinstance(market_maker_address, Address))
+
+    return zrx_trades_by_maker(infura, [market_maker_address], buy_token, buy_token_address, buy_token_decimals, sell_token, sell_token_addresses, sell_token_decimals, past_fills, exchange_name)[market_maker_address]
+
+
+# Partitions trades of many market makers at once, in a single pass over `past_fills`.
+def zrx_trades_by_maker(infura: Web3, market_maker_addresses: List[Address], buy_token: str, buy_token_address: Address, buy_token_decimals: int, sell_token: str, sell_token_addresses: List[Address], sell_token_decimals: int, past_fills: List[LogFill], exchange_name: str) -> Dict[Address, list]:
+    assert(isinstance(infura, Web3))
+    assert(isinstance(market_maker_addresses, list))
     assert(isinstance(buy_token, str))
     assert(isinstance(buy_token_address, Address))
     assert(isinstance(buy_token_decimals, int))
@@ -51,13 +69,21 @@ def zrx_trades(infura: Web3, market_maker_address: Address, buy_token: str, buy_
 
     pair = sell_token + '-' + buy_token
 
-    def sell_trades() -> List[Trade]:
-        return list(map(lambda log_fill: Trade(exchange_name, log_fill.maker, pair, get_event_timestamp(infura, log_fill), (log_fill.filled_buy_amount * Wad.from_number(10 ** (18 - buy_token_decimals))) / (log_fill.filled_pay_amount * Wad.from_number(10 ** (18 - sell_token_decimals))), log_fill.filled_pay_amount * Wad.from_number(10 ** (18 - sell_token_decimals)), log_fill.filled_buy_amount * Wad.from_number(10 ** (18 - buy_token_decimals)), True, log_fill.taker),
-                        filter(lambda log_take: log_take.maker == market_maker_address and log_take.buy_token == buy_token_address and log_take.pay_token in sell_token_addresses, past_fills)))
+    fills = {market_maker_address: [] for market_maker_address in market_maker_addresses}
+    for log_fill in past_fills:
+        if log_fill.maker in fills:
+            if log_fill.buy_token == buy_token_address and log_fill.pay_token in sell_token_addresses:
+                fills[log_fill.maker].append((log_fill, True))
+            elif log_fill.buy_token in sell_token_addresses and log_fill.pay_token == buy_token_address:
+                fills[log_fill.maker].append((log_fill, False))
+
+    prefetch_event_timestamps(infura, [log_fill for maker_fills in fills.values() for log_fill, _ in maker_fills])
 
-    def buy_trades() -> List[Trade]:
-        return list(map(lambda log_fill: Trade(exchange_name, log_fill.maker, pair, get_event_timestamp(infura, log_fill), (log_fill.filled_pay_amount * Wad.from_number(10 ** (18 - buy_token_decimals))) / (log_fill.filled_buy_amount * Wad.from_number(10 ** (18 - sell_token_decimals))), log_fill.filled_buy_amount * Wad.from_number(10 ** (18 - sell_token_decimals)), log_fill.filled_pay_amount * Wad.from_number(10 ** (18 - buy_token_decimals)), False, log_fill.taker),
-                        filter(lambda log_take: log_take.maker == market_maker_address and log_take.buy_token in sell_token_addresses and log_take.pay_token == buy_token_address, past_fills)))
+    def to_trade(log_fill: LogFill, is_sell: bool) -> Trade:
+        if is_sell:
+            return Trade(exchange_name, log_fill.maker, pair, get_event_timestamp(infura, log_fill), (log_fill.filled_buy_amount * Wad.from_number(10 ** (18 - buy_token_decimals))) / (log_fill.filled_pay_amount * Wad.from_number(10 ** (18 - sell_token_decimals))), log_fill.filled_pay_amount * Wad.from_number(10 ** (18 - sell_token_decimals)), log_fill.filled_buy_amount * Wad.from_number(10 ** (18 - buy_token_decimals)), True, log_fill.taker)
+        else:
+            return Trade(exchange_name, log_fill.maker, pair, get_event_timestamp(infura, log_fill), (log_fill.filled_pay_amount * Wad.from_number(10 ** (18 - buy_token_decimals))) / (log_fill.filled_buy_amount * Wad.from_number(10 ** (18 - sell_token_decimals))), log_fill.filled_buy_amount * Wad.from_number(10 ** (18 - sell_token_decimals)), log_fill.filled_pay_amount * Wad.from_number(10 ** (18 - buy_token_decimals)), False, log_fill.taker)
 
-    trades = sell_trades() + buy_trades()
-    return sorted(trades, key=lambda trade: trade.timestamp)
+    return {market_maker_address: sorted(map(lambda fill: to_trade(*fill), maker_fills), key=lambda trade: trade.timestamp)
+            for market_maker_address, maker_fills in fills.items()}
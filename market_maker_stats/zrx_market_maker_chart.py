@@ -23,10 +23,10 @@ from typing import List
 
 from web3 import Web3, HTTPProvider
 
-from market_maker_stats.chart import initialize_charting, draw_chart, prepare_order_history_for_charting
-from market_maker_stats.zrx import zrx_trades, Trade
+from market_maker_stats.chart import initialize_charting, draw_chart, chart_price_resolution, prepare_order_history_for_charting
+from market_maker_stats.zrx import zrx_trades, Trade, past_fill
 from market_maker_stats.util import amount_in_usd_to_size, get_gdax_prices, Price, get_block_timestamp, \
-    timestamp_to_x, initialize_logging, get_order_history, get_prices
+    timestamp_to_x, initialize_logging, get_order_history, get_prices, OrderBookSeries
 from pymaker import Address
 from pymaker.zrx import ZrxExchange
 
@@ -72,16 +72,18 @@ class ZrxMarketMakerChart:
         start_timestamp = get_block_timestamp(self.infura, self.web3.eth.blockNumber - self.arguments.past_blocks)
         end_timestamp = int(time.time())
 
-        events = self.exchange.past_fill(self.arguments.past_blocks, {'maker': self.market_maker_address.address})
+        events = past_fill(self.exchange, self.arguments.past_blocks, {'maker': self.market_maker_address.address})
         trades = zrx_trades(self.infura, self.market_maker_address, 'DAI', self.buy_token_address, self.arguments.buy_token_decimals, 'WETH', self.sell_token_addresses, self.arguments.sell_token_decimals, events, '-')
 
-        prices = get_prices(self.arguments.gdax_price, self.arguments.price_feed, None, start_timestamp, end_timestamp)
-        alternative_prices = get_prices(None, self.arguments.alternative_price_feed, None, start_timestamp, end_timestamp)
+        resolution = chart_price_resolution(start_timestamp, end_timestamp)
+        prices = get_prices(self.arguments.gdax_price, self.arguments.price_feed, None, start_timestamp, end_timestamp, resolution)
+        alternative_prices = get_prices(None, self.arguments.alternative_price_feed, None, start_timestamp, end_timestamp, resolution)
 
         order_history = get_order_history(self.arguments.order_history, start_timestamp, end_timestamp)
         order_history = prepare_order_history_for_charting(order_history)
+        order_book = OrderBookSeries.from_order_history(order_history)
 
-        draw_chart(start_timestamp, end_timestamp, prices, alternative_prices, 180, order_history, trades, [], self.arguments.output)
+        draw_chart(start_timestamp, end_timestamp, prices, alternative_prices, max(180, 3*resolution), order_book, trades, [], self.arguments.output)
 
 
 if __name__ == '__main__':
@@ -22,9 +22,12 @@ import time
 
 from web3 import Web3, HTTPProvider
 
-from market_maker_stats.pnl import get_approx_vwaps, pnl_text, pnl_chart
-from market_maker_stats.zrx import zrx_trades
-from market_maker_stats.util import get_block_timestamp, sort_trades_for_pnl, get_gdax_prices, get_prices
+from market_maker_stats.export import write_columns, daily_pnl_columns, trade_profit_columns
+from market_maker_stats.ledger import PnlLedger, pnl_ledger_key
+from market_maker_stats.pnl import get_multi_approx_vwaps, daily_pnl, stream_daily_pnl, pnl_text, pnl_chart
+from market_maker_stats.zrx import zrx_trades_by_maker, fill_between
+from market_maker_stats.util import get_block_timestamp, sort_trades_for_pnl, get_gdax_prices, get_prices, market_maker_addresses, \
+    market_maker_reports, market_maker_output, iter_prices
 from pymaker import Address
 from pymaker.zrx import ZrxExchange
 
@@ -38,11 +41,12 @@ class ZrxMarketMakerPnl:
         parser.add_argument("--rpc-port", help="JSON-RPC port (default: `8545')", default=8545, type=int)
         parser.add_argument("--rpc-timeout", help="JSON-RPC timeout (in seconds, default: 60)", type=int, default=60)
         parser.add_argument("--exchange-address", help="Ethereum address of the 0x contract", required=True, type=str)
-        parser.add_argument("--market-maker-address", help="Ethereum account of the market maker to analyze", required=True, type=str)
+        parser.add_argument("--market-maker-address", help="Ethereum account(s) of the market maker(s) to analyze", nargs='+', type=str)
+        parser.add_argument("--market-maker-address-file", help="File with Ethereum accounts of the market makers to analyze, one per line", type=str)
         parser.add_argument("--gdax-price", help="GDAX product (ETH-USD, BTC-USD) to use as the price history source", type=str)
         parser.add_argument("--price-feed", help="Price endpoint to use as the price history source", type=str)
         parser.add_argument("--price-history-file", help="File to use as the price history source", type=str)
-        parser.add_argument("--vwap-minutes", help="Rolling VWAP window size (default: 240)", type=int, default=240)
+        parser.add_argument("--vwap-minutes", help="Rolling VWAP window size(s), profit gets reported for each of them (default: 240)", type=int, nargs='+', default=[240])
         parser.add_argument("--buy-token", help="Name of the buy token", required=True, type=str)
         parser.add_argument("--buy-token-address", help="Ethereum address of the buy token", required=True, type=str)
         parser.add_argument("--buy-token-decimals", help="Number of decimals for the buy token", type=int, default=18)
@@ -51,7 +55,13 @@ class ZrxMarketMakerPnl:
         parser.add_argument("--sell-token-decimals", help="Number of decimals for the sell token", type=int, default=18)
         parser.add_argument("--old-sell-token-address", help="Ethereum address of the old sell token", required=False, type=str)
         parser.add_argument("--past-blocks", help="Number of past blocks to analyze", required=True, type=int)
+        parser.add_argument("--ledger", help="Keep finalized days in a persistent PnL ledger, so subsequent runs only process new trades (text mode only). "
+                                             "When resuming from the ledger, the first day of the report covers the whole day, not only the part within --past-blocks", dest='ledger', action='store_true')
+        parser.add_argument("--stream", help="Calculate profits from prices streamed in batches, without keeping the whole price history in memory "
+                                             "(text mode only, can not be used with --ledger or --export-trades)", dest='stream', action='store_true')
         parser.add_argument("-o", "--output", help="File to save the chart or the table to", required=False, type=str)
+        parser.add_argument("--export", help="File to export daily PnL to (.csv, .npz or .parquet)", required=False, type=str)
+        parser.add_argument("--export-trades", help="File to export per-trade profits to (.csv, .npz or .parquet)", required=False, type=str)
 
         parser_mode = parser.add_mutually_exclusive_group(required=True)
         parser_mode.add_argument('--text', help="Show PnL as a text table", dest='text', action='store_true')
@@ -59,6 +69,17 @@ class ZrxMarketMakerPnl:
 
         self.arguments = parser.parse_args(args)
 
+        if self.arguments.stream and (not self.arguments.text or self.arguments.ledger or self.arguments.export_trades):
+            parser.error("--stream can only be used with --text, and without --ledger and --export-trades")
+
+        self.market_maker_addresses = market_maker_addresses(self.arguments.market_maker_address, self.arguments.market_maker_address_file)
+
+        if len(self.market_maker_addresses) == 0:
+            parser.error("at least one of --market-maker-address and --market-maker-address-file is required")
+
+        if self.arguments.ledger and len(self.market_maker_addresses) > 1:
+            parser.error("--ledger can only be used with a single market maker address")
+
         self.web3 = Web3(HTTPProvider(endpoint_uri=f"http://{self.arguments.rpc_host}:{self.arguments.rpc_port}",
                                       request_kwargs={'timeout': self.arguments.rpc_timeout}))
         self.infura = Web3(HTTPProvider(endpoint_uri=f"https://mainnet.infura.io/", request_kwargs={'timeout': 120}))
@@ -66,7 +87,6 @@ class ZrxMarketMakerPnl:
         self.sell_token_address = Address(self.arguments.sell_token_address)
         self.old_sell_token_address = Address(self.arguments.old_sell_token_address) if self.arguments.old_sell_token_address else None
         self.sell_token_addresses = list(filter(lambda address: address is not None, [self.sell_token_address, self.old_sell_token_address]))
-        self.market_maker_address = Address(self.arguments.market_maker_address)
         self.exchange = ZrxExchange(web3=self.web3, address=Address(self.arguments.exchange_address))
 
         if self.arguments.chart and self.arguments.output:
@@ -77,22 +97,49 @@ class ZrxMarketMakerPnl:
         logging.getLogger("filelock").setLevel(logging.WARNING)
 
     def main(self):
-        start_timestamp = get_block_timestamp(self.infura, self.web3.eth.blockNumber - self.arguments.past_blocks)
+        block_number = self.web3.eth.blockNumber
+        start_timestamp = get_block_timestamp(self.infura, block_number - self.arguments.past_blocks)
         end_timestamp = int(time.time())
 
-        events = self.exchange.past_fill(self.arguments.past_blocks, {'maker': self.market_maker_address.address})
-        trades = zrx_trades(self.infura, self.market_maker_address, self.arguments.buy_token, self.buy_token_address, self.arguments.buy_token_decimals, self.arguments.sell_token, self.sell_token_addresses, self.arguments.sell_token_decimals, events, '-')
-        trades = sort_trades_for_pnl(trades)
+        # with the ledger, we only need to process trades from days which have not been finalized yet
+        ledger = PnlLedger(pnl_ledger_key('0x-market-maker-pnl', self.arguments)) if self.arguments.ledger and self.arguments.text else None
+        resume_point = ledger.resume_point(start_timestamp) if ledger is not None else None
+        from_timestamp, from_block = resume_point if resume_point is not None else (start_timestamp, block_number - self.arguments.past_blocks)
+
+        events = fill_between(self.exchange, from_block, block_number, {'maker': [address.address for address in self.market_maker_addresses]})
+        trades_by_maker = zrx_trades_by_maker(self.infura, self.market_maker_addresses, self.arguments.buy_token, self.buy_token_address, self.arguments.buy_token_decimals, self.arguments.sell_token, self.sell_token_addresses, self.arguments.sell_token_decimals, events, '-')
+
+        # in the streaming mode, prices get processed batch by batch separately for each report
+        if not self.arguments.stream:
+            prices = get_prices(self.arguments.gdax_price, self.arguments.price_feed, self.arguments.price_history_file, from_timestamp, end_timestamp)
+            vwaps = get_multi_approx_vwaps(prices, self.arguments.vwap_minutes)
+            vwaps_start = int(prices.timestamps[0])
+
+        for market_maker, trades, suffix in market_maker_reports(trades_by_maker):
+            trades = sort_trades_for_pnl(list(filter(lambda trade: trade.timestamp >= from_timestamp, trades)))
+            output = market_maker_output(self.arguments.output, suffix)
+
+            if self.arguments.text or self.arguments.export:
+                if self.arguments.stream:
+                    price_batches = iter_prices(self.arguments.gdax_price, self.arguments.price_feed, self.arguments.price_history_file, from_timestamp, end_timestamp)
+                    days, vwaps_start = stream_daily_pnl(trades, price_batches, self.arguments.vwap_minutes)
+                else:
+                    days = daily_pnl(trades, vwaps, vwaps_start)
+
+                if ledger is not None:
+                    days = ledger.update(self.infura, days, vwaps, vwaps_start, start_timestamp, from_block, block_number)
+
+            if self.arguments.text:
+                pnl_text(days, vwaps_start, self.arguments.buy_token, self.arguments.sell_token, self.arguments.vwap_minutes, output, market_maker)
 
-        prices = get_prices(self.arguments.gdax_price, self.arguments.price_feed, self.arguments.price_history_file, start_timestamp, end_timestamp)
-        vwaps = get_approx_vwaps(prices, self.arguments.vwap_minutes)
-        vwaps_start = prices[0].timestamp
+            if self.arguments.export:
+                write_columns(daily_pnl_columns(days, self.arguments.vwap_minutes), market_maker_output(self.arguments.export, suffix))
 
-        if self.arguments.text:
-            pnl_text(trades, vwaps, vwaps_start, self.arguments.buy_token, self.arguments.sell_token, self.arguments.vwap_minutes, self.arguments.output)
+            if self.arguments.export_trades:
+                write_columns(trade_profit_columns(trades, vwaps, vwaps_start, self.arguments.vwap_minutes), market_maker_output(self.arguments.export_trades, suffix))
 
-        if self.arguments.chart:
-            pnl_chart(start_timestamp, end_timestamp, prices, trades, vwaps, vwaps_start, self.arguments.buy_token, self.arguments.sell_token, self.arguments.output)
+            if self.arguments.chart:
+                pnl_chart(start_timestamp, end_timestamp, prices, trades, vwaps, vwaps_start, self.arguments.buy_token, self.arguments.sell_token, self.arguments.vwap_minutes, output, market_maker)
 
 
 if __name__ == '__main__':
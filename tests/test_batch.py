@@ -0,0 +1,87 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+
+import pytest
+
+from market_maker_stats import batch, util
+from market_maker_stats.batch import load_jobs, run_job
+
+
+class FakeTool:
+    calls = []
+
+    def __init__(self, args: list):
+        if '--invalid' in args:
+            raise SystemExit(2)
+
+        self.args = args
+
+    def main(self):
+        FakeTool.calls.append(self.args)
+
+
+@pytest.fixture
+def fake_tool(monkeypatch):
+    FakeTool.calls = []
+    monkeypatch.setattr(batch, 'TOOLS', {'fake-tool': ('tests.test_batch', 'FakeTool')})
+    monkeypatch.setattr(batch, '_initialized', False)
+    monkeypatch.setattr(util, 'gdax_rate_limiter', util.gdax_rate_limiter)
+
+
+def test_load_jobs_prepends_default_arguments(tmpdir):
+    # given
+    filename = str(tmpdir.join('jobs.json'))
+    with open(filename, 'w') as file:
+        json.dump({'defaults': {'oasis-market-maker-pnl': ['--text']},
+                   'jobs': [{'tool': 'oasis-market-maker-pnl', 'args': ['--past-blocks', '100']},
+                            {'tool': '0x-market-maker-trades', 'args': ['--json']}]}, file)
+
+    # expect
+    assert load_jobs(filename) == [('oasis-market-maker-pnl', ['--text', '--past-blocks', '100']),
+                                   ('0x-market-maker-trades', ['--json'])]
+
+
+def test_load_jobs_rejects_unknown_tools(tmpdir):
+    # given
+    filename = str(tmpdir.join('jobs.json'))
+    with open(filename, 'w') as file:
+        json.dump([{'tool': 'oasis-market-maker-fun', 'args': []}], file)
+
+    # expect
+    with pytest.raises(Exception, match="Unknown tool 'oasis-market-maker-fun'"):
+        load_jobs(filename)
+
+
+def test_run_job_initializes_the_worker_once_and_runs_the_tool(fake_tool):
+    # when
+    run_job('fake-tool', ['--text'], 4)
+    rate_limiter = util.gdax_rate_limiter
+    run_job('fake-tool', ['--json'], 4)
+
+    # then
+    assert FakeTool.calls == [['--text'], ['--json']]
+    assert rate_limiter.rate == 0.75
+    assert rate_limiter.capacity == 1
+    assert util.gdax_rate_limiter is rate_limiter
+
+
+def test_run_job_turns_exits_into_exceptions(fake_tool):
+    # expect
+    with pytest.raises(Exception, match="fake-tool exited with code 2"):
+        run_job('fake-tool', ['--invalid'])
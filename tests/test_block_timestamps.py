@@ -0,0 +1,117 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from types import SimpleNamespace
+
+import pytest
+from web3 import Web3
+
+from market_maker_stats import util
+from market_maker_stats.util import BlockTimestamps, block_timestamps, get_block_timestamp, get_block_number_at
+
+BLOCK_HASH = '0x' + 'ab' * 32
+
+
+class FakeWeb3(Web3):
+    def __init__(self):
+        self.providers = [SimpleNamespace(endpoint_uri='http://node')]
+
+
+class FakeNode:
+    def __init__(self):
+        self.requests = []
+
+    def get_blocks_by_number(self, endpoint_uri: str, block_numbers: list) -> list:
+        self.requests.append(('number', sorted(block_numbers)))
+        return [{'hash': '0x%064x' % number, 'number': hex(number), 'timestamp': hex(1500000000 + number)} for number in block_numbers]
+
+    def get_blocks_by_hash(self, endpoint_uri: str, block_hashes: list) -> list:
+        self.requests.append(('hash', sorted(block_hashes)))
+        return [{'hash': block_hash, 'number': hex(77), 'timestamp': hex(1500000077)} if block_hash == BLOCK_HASH else None for block_hash in block_hashes]
+
+
+@pytest.fixture
+def node(monkeypatch) -> FakeNode:
+    node = FakeNode()
+    monkeypatch.setattr(util, 'get_blocks_by_number', node.get_blocks_by_number)
+    monkeypatch.setattr(util, 'get_blocks_by_hash', node.get_blocks_by_hash)
+    return node
+
+
+def test_timestamps_get_fetched_only_once_and_persisted(tmpdir, node):
+    # given
+    filename = str(tmpdir.join('block_timestamps.db'))
+    timestamps = BlockTimestamps(filename)
+
+    # when
+    timestamps.prefetch(FakeWeb3(), [], [10, 20])
+
+    # then
+    assert timestamps.by_block_number(FakeWeb3(), 10) == 1500000010
+    assert timestamps.by_block_number(FakeWeb3(), 30) == 1500000030
+    assert node.requests == [('number', [10, 20]), ('number', [30])]
+
+    # when
+    node.requests = []
+    reopened = BlockTimestamps(filename)
+
+    # then
+    assert reopened.by_block_number(FakeWeb3(), 20) == 1500000020
+    assert reopened.by_block_hash(FakeWeb3(), '0x%064x' % 30) == 1500000030
+    assert node.requests == []
+
+
+def test_timestamps_by_hash_and_missing_blocks(tmpdir, node):
+    # given
+    timestamps = BlockTimestamps(str(tmpdir.join('block_timestamps.db')))
+
+    # expect
+    assert timestamps.by_block_hash(FakeWeb3(), bytes.fromhex('ab' * 32)) == 1500000077
+    assert timestamps.by_block_number(FakeWeb3(), 77) == 1500000077
+    assert node.requests == [('hash', [BLOCK_HASH])]
+
+    # and
+    with pytest.raises(Exception):
+        timestamps.by_block_hash(FakeWeb3(), '0x' + 'cd' * 32)
+
+
+def test_block_timestamps_index_lives_in_the_cache_folder(tmpdir, node, monkeypatch):
+    # given
+    monkeypatch.setattr(util, 'cache_folder', lambda: str(tmpdir))
+    monkeypatch.setattr(util, '_block_timestamps', None)
+
+    # when
+    timestamp = get_block_timestamp(FakeWeb3(), 5)
+
+    # then
+    assert timestamp == 1500000005
+    assert block_timestamps() is block_timestamps()
+    assert tmpdir.join('block_timestamps.db').check()
+
+
+def test_block_number_at_timestamp_is_found_in_a_few_batched_rounds(tmpdir, node, monkeypatch):
+    # given
+    monkeypatch.setattr(util, 'cache_folder', lambda: str(tmpdir))
+    monkeypatch.setattr(util, '_block_timestamps', None)
+
+    # expect
+    assert get_block_number_at(FakeWeb3(), 1500000000 + 54321, 1000, 101000) == 54321
+    assert len(node.requests) <= 5
+    assert all(len(block_numbers) <= 15 for _, block_numbers in node.requests)
+
+    # and
+    assert get_block_number_at(FakeWeb3(), 1500000000 + 500, 1000, 2000) == 1000
+    assert get_block_number_at(FakeWeb3(), 1500000000 + 5000, 1000, 2000) == 2000
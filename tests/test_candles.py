@@ -0,0 +1,164 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import time
+
+import numpy as np
+
+from market_maker_stats import util
+from market_maker_stats.candles import CandleStore, rollup_candles
+from market_maker_stats.util import get_gdax_prices, iter_gdax_prices, gdax_batch_begin, gdax_batch_end
+
+# 1518393600 = 2018-02-12 00:00:00 UTC
+DAY_1 = 1518393600
+
+
+def minute_candles(batch_begin: int, batch_end: int) -> list:
+    return [[timestamp, 100 + (timestamp % 7), 102 + (timestamp % 11), 101, 101.5, float(timestamp % 3)]
+            for timestamp in range(batch_begin, batch_end, 60)]
+
+
+def batches(start_timestamp: int, end_timestamp: int) -> list:
+    result = []
+    timestamp = gdax_batch_begin(start_timestamp)
+    while timestamp <= end_timestamp:
+        result.append((timestamp, minute_candles(timestamp, gdax_batch_end(timestamp))))
+        timestamp = gdax_batch_end(timestamp)
+
+    return result
+
+
+def test_rollups_get_updated_when_candles_are_added(tmpdir):
+    # given
+    store = CandleStore(str(tmpdir), 'ETH-USD')
+    all_batches = batches(DAY_1, DAY_1 + 2*86400)
+
+    # when
+    store.add_batches(all_batches[::2])
+    store.add_batches(all_batches[1::2])
+
+    # then
+    for resolution in CandleStore.RESOLUTIONS:
+        expected = rollup_candles(store.candles(0, DAY_1 * 2), resolution)
+        actual = store.candles(0, DAY_1 * 2, resolution)
+
+        for name in CandleStore.ROLLUP_COLUMNS:
+            assert np.array_equal(actual[name], expected[name])
+
+
+def test_rollup_candles_aggregates_ohlc_and_vwap():
+    # given
+    candles = {'timestamp': np.array([DAY_1, DAY_1 + 60, DAY_1 + 300], dtype=np.int64),
+               'low': np.array([10.0, 8.0, 20.0]),
+               'high': np.array([12.0, 14.0, 20.0]),
+               'open': np.array([11.0, 12.0, 20.0]),
+               'close': np.array([12.0, 9.0, 20.0]),
+               'volume': np.array([1.0, 3.0, 0.0])}
+
+    # when
+    rollup = rollup_candles(candles, 300)
+
+    # then
+    assert list(rollup['timestamp']) == [DAY_1, DAY_1 + 300]
+    assert list(rollup['low']) == [8.0, 20.0]
+    assert list(rollup['high']) == [14.0, 20.0]
+    assert list(rollup['open']) == [11.0, 20.0]
+    assert list(rollup['close']) == [9.0, 20.0]
+    assert list(rollup['volume']) == [4.0, 0.0]
+    assert list(rollup['vwap']) == [(11.0 * 1 + 11.0 * 3) / 4, 20.0]
+
+
+def test_gdax_prices_at_coarser_resolution(tmpdir, monkeypatch):
+    # given
+    monkeypatch.setattr(util, 'cache_folder', lambda: str(tmpdir))
+    monkeypatch.setattr(util, 'gdax_download', lambda product, batches: {batch: minute_candles(batch[0], batch[1]) for batch in batches})
+
+    for start_timestamp, end_timestamp in [(DAY_1 + 5000, DAY_1 + 3*86400 + 7000), (int(time.time()) - 86400, int(time.time()))]:
+        # when
+        minute_prices = get_gdax_prices('ETH-USD', start_timestamp - start_timestamp % 3600, end_timestamp)
+        hourly_prices = get_gdax_prices('ETH-USD', start_timestamp, end_timestamp, 3600 + 120)
+
+        # then
+        expected = rollup_candles({'timestamp': minute_prices.timestamps,
+                                   'low': minute_prices.prices,
+                                   'high': minute_prices.prices,
+                                   'open': minute_prices.prices,
+                                   'close': minute_prices.prices,
+                                   'volume': minute_prices.volumes}, 3600)
+
+        assert list(hourly_prices.timestamps) == list(expected['timestamp'])
+        assert np.allclose(hourly_prices.prices, expected['vwap'])
+        assert np.allclose(hourly_prices.volumes, expected['volume'])
+
+
+def test_newer_candles_get_appended_in_place(tmpdir):
+    # given
+    appended_store = CandleStore(str(tmpdir.mkdir('appended')), 'ETH-USD')
+    merged_store = CandleStore(str(tmpdir.mkdir('merged')), 'ETH-USD')
+    all_batches = batches(DAY_1, DAY_1 + 86400 + 3600)
+
+    # when
+    appended_store.add_batches(all_batches[:2])
+    inode = os.stat(appended_store._file('timestamp')).st_ino
+    for batch in all_batches[2:]:
+        appended_store.add_batches([batch])
+
+    merged_store.add_batches(all_batches[2:])
+    merged_store.add_batches(all_batches[:2])
+
+    # then
+    assert os.stat(appended_store._file('timestamp')).st_ino == inode
+
+    for resolution in [60] + CandleStore.RESOLUTIONS:
+        appended = appended_store.candles(0, DAY_1 * 2, resolution)
+        merged = merged_store.candles(0, DAY_1 * 2, resolution)
+
+        for name in appended:
+            assert np.array_equal(appended[name], merged[name])
+
+    # and
+    assert len(appended_store.candles(0, DAY_1 * 2, 86400)['timestamp']) == 2
+    assert len(appended_store._rollups[86400]['timestamp']) == 1
+
+
+def test_gdax_prices_get_downloaded_window_by_window(tmpdir, monkeypatch):
+    # given
+    downloads = []
+
+    def gdax_download(product, batches):
+        downloads.append(batches)
+        return {batch: minute_candles(batch[0], batch[1]) for batch in batches}
+
+    monkeypatch.setattr(util, 'cache_folder', lambda: str(tmpdir))
+    monkeypatch.setattr(util, 'gdax_download', gdax_download)
+
+    # when
+    prices = iter_gdax_prices('ETH-USD', DAY_1, DAY_1 + 2*86400 - 1, window=4)
+    first_prices = next(prices)
+
+    # then
+    assert first_prices.timestamps[0] == DAY_1
+    assert len(downloads) == 1
+    assert len(downloads[0]) == 4
+
+    # when
+    all_prices = [first_prices] + list(prices)
+
+    # then
+    assert [len(batches) for batches in downloads] == [4, 4, 4]
+    assert len(all_prices) == 12
+    assert list(np.concatenate([prices.timestamps for prices in all_prices])) == list(range(DAY_1, DAY_1 + 2*86400, 60))
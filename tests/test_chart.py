@@ -0,0 +1,54 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import numpy as np
+
+from market_maker_stats.chart import downsample
+
+
+def test_downsample_keeps_extremes_and_gaps():
+    # given
+    timestamps = np.arange(0, 100000, 60, dtype=np.int64)
+    values = np.sin(timestamps / 5000.0)
+    values[500] = 7.0
+    values[900] = np.nan
+
+    # when
+    sampled_timestamps, sampled_values = downsample(timestamps, values, 0, 100000, 50)
+
+    # then
+    assert len(sampled_timestamps) <= 4 * 50 + 1
+    assert np.all(np.diff(sampled_timestamps) > 0)
+    assert np.nanmax(sampled_values) == 7.0
+    assert np.nanmin(sampled_values) == np.nanmin(values)
+    assert sampled_timestamps[0] == timestamps[0] and sampled_timestamps[-1] == timestamps[-1]
+
+    # and
+    gap = np.flatnonzero(np.isnan(sampled_values))
+    assert list(sampled_timestamps[gap]) == [timestamps[900]]
+    assert sampled_timestamps[gap[0] - 1] == timestamps[899] and sampled_timestamps[gap[0] + 1] == timestamps[901]
+
+
+def test_downsample_leaves_short_series_intact():
+    # given
+    timestamps = np.arange(0, 600, 60, dtype=np.int64)
+    values = np.arange(10, dtype=np.float64)
+
+    # when
+    sampled_timestamps, sampled_values = downsample(timestamps, values, 0, 600, 50)
+
+    # then
+    assert sampled_timestamps is timestamps and sampled_values is values
@@ -0,0 +1,101 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from types import SimpleNamespace
+
+from web3 import Web3
+
+from market_maker_stats import event_store
+from market_maker_stats.event_store import EventStore
+from pymaker import Address
+
+CONTRACT = Address('0x00000000000000000000000000000000000000c1')
+
+
+class FakeWeb3(Web3):
+    def __init__(self, block_number: int):
+        self.eth = SimpleNamespace(blockNumber=block_number)
+
+
+class FakeNode:
+    def __init__(self):
+        self.requests = []
+
+    def get_logs_in_chunks(self, web3, contract_address, topics, from_block, to_block):
+        if from_block <= to_block:
+            self.requests.append((from_block, to_block))
+
+        return [{'blockNumber': block_number, 'logIndex': 0} for block_number in range(from_block, to_block + 1) if block_number % 10 == 0]
+
+
+def blocks(logs: list) -> list:
+    return [log['blockNumber'] for log in logs]
+
+
+def test_store_only_fetches_blocks_outside_of_the_stored_range(tmpdir, monkeypatch):
+    # given
+    node = FakeNode()
+    monkeypatch.setattr(event_store, 'get_logs_in_chunks', node.get_logs_in_chunks)
+    store = EventStore(FakeWeb3(1012), confirmations=12, filename=str(tmpdir.join('events.db')))
+
+    # when
+    logs = store.logs(CONTRACT, ['topic'], 500, 1012)
+
+    # then
+    assert blocks(logs) == list(range(500, 1001, 10)) + [1010]
+    assert node.requests == [(500, 1000), (1001, 1012)]
+
+    # when
+    node.requests = []
+    store.web3 = FakeWeb3(1112)
+    logs = store.logs(CONTRACT, ['topic'], 300, 1112)
+
+    # then
+    assert blocks(logs) == list(range(300, 1111, 10))
+    assert node.requests == [(300, 499), (1001, 1100), (1101, 1112)]
+
+    # when
+    node.requests = []
+    logs = EventStore(FakeWeb3(1112), confirmations=12, filename=str(tmpdir.join('events.db'))).logs(CONTRACT, ['topic'], 400, 900)
+
+    # then
+    assert blocks(logs) == list(range(400, 901, 10))
+    assert node.requests == []
+
+
+def test_store_fills_the_gap_to_a_disjoint_range_instead_of_discarding_it(tmpdir, monkeypatch):
+    # given
+    node = FakeNode()
+    monkeypatch.setattr(event_store, 'get_logs_in_chunks', node.get_logs_in_chunks)
+    store = EventStore(FakeWeb3(10000), confirmations=12, filename=str(tmpdir.join('events.db')))
+    store.logs(CONTRACT, ['topic'], 100, 200)
+
+    # when
+    node.requests = []
+    logs = store.logs(CONTRACT, ['topic'], 500, 600)
+
+    # then
+    assert blocks(logs) == list(range(500, 601, 10))
+    assert node.requests == [(201, 600)]
+
+    # and
+    node.requests = []
+    assert blocks(store.logs(CONTRACT, ['topic'], 100, 600)) == list(range(100, 601, 10))
+    assert node.requests == []
+
+    # and
+    assert blocks(store.logs(CONTRACT, ['other-topic'], 100, 110)) == [100, 110]
+    assert node.requests == [(100, 110)]
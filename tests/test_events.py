@@ -0,0 +1,146 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import random
+import threading
+import time
+
+import pytest
+from web3 import Web3
+
+from market_maker_stats import events
+from market_maker_stats.events import get_logs_in_chunks, event_filter_topics, event_topic, events_between
+from pymaker import Address
+
+CONTRACT = Address('0x00000000000000000000000000000000000000c1')
+
+LOG_TAKE_ABI = {'type': 'event', 'name': 'LogTake', 'anonymous': False,
+                'inputs': [{'name': 'id', 'type': 'bytes32', 'indexed': True},
+                           {'name': 'pair', 'type': 'bytes32', 'indexed': True},
+                           {'name': 'maker', 'type': 'address', 'indexed': True},
+                           {'name': 'pay_gem', 'type': 'address', 'indexed': False},
+                           {'name': 'buy_gem', 'type': 'address', 'indexed': False},
+                           {'name': 'taker', 'type': 'address', 'indexed': True},
+                           {'name': 'take_amt', 'type': 'uint128', 'indexed': False},
+                           {'name': 'give_amt', 'type': 'uint128', 'indexed': False},
+                           {'name': 'timestamp', 'type': 'uint64', 'indexed': False}]}
+
+
+class FakeNode:
+    """Serves one log per block, but rejects requests spanning more than `max_blocks` blocks."""
+
+    def __init__(self, max_blocks: int):
+        self.max_blocks = max_blocks
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def get_logs(self, web3, contract_address, topics, from_block, to_block):
+        with self.lock:
+            self.requests.append((from_block, to_block))
+
+        if to_block - from_block + 1 > self.max_blocks:
+            raise ValueError("query returned more than 10000 results")
+
+        time.sleep(random.uniform(0, 0.002))
+        return [{'blockNumber': block_number, 'logIndex': log_index}
+                for block_number in reversed(range(from_block, to_block + 1)) for log_index in [1, 0]]
+
+
+def test_reduced_chunk_size_is_used_for_subsequent_chunks(monkeypatch):
+    # given
+    node = FakeNode(max_blocks=250)
+    monkeypatch.setattr(events, 'get_logs', node.get_logs)
+
+    # when
+    logs = get_logs_in_chunks(None, CONTRACT, [], 1, 2000, chunk_size=1000, max_workers=1)
+
+    # then
+    assert node.requests == [(1, 1000), (1, 500), (1, 250), (251, 500), (501, 1000), (501, 750), (751, 1000),
+                             (1001, 1250), (1251, 1500), (1501, 1750), (1751, 2000)]
+    assert len(logs) == 4000
+
+
+def test_logs_are_returned_in_block_order_when_fetched_concurrently(monkeypatch):
+    # given
+    node = FakeNode(max_blocks=100)
+    monkeypatch.setattr(events, 'get_logs', node.get_logs)
+
+    # when
+    logs = get_logs_in_chunks(None, CONTRACT, [], 10, 3009, chunk_size=300, max_workers=4)
+
+    # then
+    assert [(log['blockNumber'], log['logIndex']) for log in logs] == [(block_number, log_index) for block_number in range(10, 3010) for log_index in [0, 1]]
+
+
+def test_failures_of_single_blocks_are_raised(monkeypatch):
+    # given
+    monkeypatch.setattr(events, 'get_logs', FakeNode(max_blocks=0).get_logs)
+
+    # expect
+    with pytest.raises(ValueError):
+        get_logs_in_chunks(None, CONTRACT, [], 1, 4, chunk_size=4, max_workers=2)
+
+
+def test_event_filter_topics():
+    # when
+    topics, event_matches = event_filter_topics(LOG_TAKE_ABI, {'pair': b'\x01' * 32,
+                                                               'taker': ['0x00000000000000000000000000000000000000AB', '0x00000000000000000000000000000000000000cd'],
+                                                               'pay_gem': '0x00000000000000000000000000000000000000EF'})
+
+    # then
+    assert topics == [event_topic(LOG_TAKE_ABI),
+                      None,
+                      ['0x' + '01' * 32],
+                      None,
+                      ['0x' + '0' * 62 + 'ab', '0x' + '0' * 62 + 'cd']]
+
+    # and
+    assert event_matches({'args': {'pay_gem': '0x00000000000000000000000000000000000000ef'}})
+    assert not event_matches({'args': {'pay_gem': '0x00000000000000000000000000000000000000aa'}})
+
+
+def test_event_filter_topics_encode_integers_and_drop_trailing_wildcards():
+    # given
+    abi = {'type': 'event', 'name': 'LogKill', 'anonymous': False,
+           'inputs': [{'name': 'id', 'type': 'uint256', 'indexed': True},
+                      {'name': 'maker', 'type': 'address', 'indexed': True}]}
+
+    # when
+    topics, event_matches = event_filter_topics(abi, {'id': 255})
+
+    # then
+    assert topics == [event_topic(abi), ['0x' + '0' * 62 + 'ff']]
+    assert event_matches({'args': {}})
+    assert event_filter_topics(abi, None)[0] == [event_topic(abi)]
+
+
+def test_events_between_fetches_exactly_the_given_block_range(monkeypatch):
+    # given
+    class FakeWeb3(Web3):
+        def __init__(self):
+            pass
+
+    requests = []
+    monkeypatch.setattr(events, 'get_logs_in_chunks', lambda web3, contract_address, topics, from_block, to_block:
+                        requests.append((from_block, to_block)) or [{'blockNumber': from_block}, {'blockNumber': to_block}])
+    monkeypatch.setattr(events, 'decode_logs', lambda event_abi, logs: [{'args': {}, 'blockNumber': log['blockNumber']} for log in logs])
+
+    # when
+    found = events_between(FakeWeb3(), CONTRACT, [LOG_TAKE_ABI], 'LogTake', lambda event: event['blockNumber'], 100, 200)
+
+    # then
+    assert found == [100, 200]
+    assert requests == [(100, 200)]
@@ -0,0 +1,75 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import csv
+from types import SimpleNamespace
+
+import numpy as np
+
+from market_maker_stats.export import trade_columns, trade_profit_columns, daily_pnl_columns, write_columns
+from market_maker_stats.pnl import daily_pnl
+from pymaker import Wad
+
+# 1518440700 = 2018-02-12 13:05:00 UTC
+TRADES = [SimpleNamespace(exchange='oasis', pair='ETH-DAI', maker='0xa1', taker='0xb2', timestamp=1518440700, is_sell=True,
+                          price=Wad.from_number(2), amount=Wad.from_number(5), money=Wad.from_number(10)),
+          SimpleNamespace(exchange='oasis', pair='ETH-DAI', maker='0xa1', taker=None, timestamp=1518440760, is_sell=False,
+                          price=Wad.from_number(4), amount=Wad.from_number(1), money=Wad.from_number(4))]
+
+
+def test_trade_profit_columns():
+    # when
+    columns = trade_profit_columns(TRADES, [np.array([3.0])], 1518440700, [240])
+
+    # then
+    assert list(columns['timestamp']) == [1518440700, 1518440760]
+    assert list(columns['is_sell']) == [1, 0]
+    assert list(columns['taker']) == ['0xb2', '']
+    assert list(columns['money']) == [10.0, 4.0]
+    assert np.allclose(columns['profit'], [-5.0, np.nan], equal_nan=True)
+
+
+def test_write_columns_to_npz_and_csv(tmpdir):
+    # given
+    vwaps = [np.array([3.0, 3.0]), np.array([2.0, 2.0])]
+    columns = daily_pnl_columns(daily_pnl(TRADES, vwaps, 1518440700), [60, 240])
+
+    # when
+    write_columns(columns, str(tmpdir.join('pnl.npz')))
+    write_columns(columns, str(tmpdir.join('pnl.csv')))
+
+    # then
+    npz = np.load(str(tmpdir.join('pnl.npz')))
+    assert list(npz['day']) == ['2018-02-12']
+    assert list(npz['trades']) == [2]
+    assert list(npz['profit_60m']) == [-6.0]
+    assert list(npz['profit_240m']) == [-2.0]
+
+    # and
+    with open(str(tmpdir.join('pnl.csv'))) as file:
+        rows = list(csv.reader(file))
+
+    assert rows[0] == list(columns.keys())
+    assert rows[1][:3] == ['2018-02-12', '1518393600', '2']
+
+
+def test_trade_columns_of_no_trades():
+    # when
+    columns = trade_columns([])
+
+    # then
+    assert all(len(column) == 0 for column in columns.values())
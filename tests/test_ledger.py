@@ -0,0 +1,78 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from types import SimpleNamespace
+
+import numpy as np
+from web3 import Web3
+
+from market_maker_stats import ledger
+from market_maker_stats.ledger import PnlLedger
+from market_maker_stats.pnl import daily_pnl
+from pymaker import Wad
+
+# 1518393600 = 2018-02-12 00:00:00 UTC
+DAY_1 = 1518393600
+DAY_2 = DAY_1 + 86400
+DAY_3 = DAY_2 + 86400
+
+
+class FakeWeb3(Web3):
+    def __init__(self):
+        pass
+
+
+def trade(timestamp: int):
+    return SimpleNamespace(timestamp=timestamp, is_sell=False, money=Wad.from_number(2), amount=Wad.from_number(1), price=Wad.from_number(2))
+
+
+def test_ledger_finalizes_complete_days_and_resumes_from_them(tmpdir, monkeypatch):
+    # given
+    monkeypatch.setattr(ledger, 'get_block_timestamp', lambda infura, block_number: DAY_3 + 3600)
+    monkeypatch.setattr(ledger, 'get_block_number_at', lambda infura, timestamp, low, high: 1000 + (timestamp - DAY_1) // 60)
+    pnl_ledger = PnlLedger('key', filename=str(tmpdir.join('ledger.json')))
+
+    # and
+    start_timestamp = DAY_1 + 3600
+    trades = [trade(DAY_1 + 7200), trade(DAY_2 + 60), trade(DAY_2 + 120), trade(DAY_3 + 60)]
+    vwaps = [np.full((DAY_3 + 7200 - start_timestamp) // 60, 2.0)]
+
+    # when
+    days = pnl_ledger.update(FakeWeb3(), daily_pnl(trades, vwaps, start_timestamp), vwaps, start_timestamp, start_timestamp, 1000, 5000)
+
+    # then
+    assert days['days'] == ['2018-02-12', '2018-02-13', '2018-02-14']
+    assert PnlLedger('key', filename=str(tmpdir.join('ledger.json'))).resume_point(start_timestamp + 86400) == (DAY_3, 1000 + 2*1440)
+
+    # when
+    resumed_trades = [trade(DAY_3 + 60), trade(DAY_3 + 600)]
+    resumed_days = pnl_ledger.update(FakeWeb3(), daily_pnl(resumed_trades, vwaps, start_timestamp), vwaps, start_timestamp, start_timestamp + 86400, 1000 + 2*1440, 5000)
+
+    # then
+    assert resumed_days['days'] == ['2018-02-13', '2018-02-14']
+    assert list(resumed_days['counts']) == [2, 2]
+
+
+def test_ledger_is_not_used_for_reports_starting_before_it(tmpdir):
+    # given
+    pnl_ledger = PnlLedger('key', filename=str(tmpdir.join('ledger.json')))
+    pnl_ledger._write({'covered_from': DAY_2, 'finalized_until': DAY_3, 'resume_block': 1000, 'days': []})
+
+    # expect
+    assert pnl_ledger.resume_point(DAY_1 + 3600) is None
+    assert pnl_ledger.resume_point(DAY_2 + 3600) == (DAY_3, 1000)
+    assert pnl_ledger.resume_point(DAY_3 + 3600) is None
@@ -0,0 +1,248 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from types import SimpleNamespace
+
+import numpy as np
+from eth_utils import keccak
+
+from market_maker_stats import oasis
+from market_maker_stats.event_store import EventStore
+from market_maker_stats.oasis import OasisEvents, OasisOrderBook, oasis_pair, replay_closest_prices
+from pymaker import Address, Wad
+from pymaker.oasis import SimpleMarket
+
+from market_maker_stats.events import event_topic
+from tests.test_events import LOG_TAKE_ABI
+
+OTC = Address('0x00000000000000000000000000000000000000c1')
+DAI = Address('0x00000000000000000000000000000000000000d1')
+WETH = Address('0x00000000000000000000000000000000000000e1')
+MAKER_1 = Address('0x00000000000000000000000000000000000000a1')
+MAKER_2 = Address('0x00000000000000000000000000000000000000a2')
+
+
+def topic(address: Address) -> str:
+    return '0x' + address.address[2:].lower().rjust(64, '0')
+
+
+def pair_topic(pay_token: Address, buy_token: Address) -> str:
+    return '0x' + oasis_pair(pay_token, buy_token).hex()
+
+
+class FakeEventStore(EventStore):
+    def __init__(self, logs: list):
+        self.all_logs = logs
+        self.requests = []
+
+    # logs match if each of their topics is either a wildcard or one of the alternatives
+    def past_logs(self, contract_address: Address, topics: list, number_of_past_blocks: int) -> list:
+        self.requests.append((contract_address, topics, number_of_past_blocks))
+        return self.matching(topics)
+
+    def logs(self, contract_address: Address, topics: list, from_block: int, to_block: int) -> list:
+        self.requests.append((contract_address, topics, (from_block, to_block)))
+        return [log for log in self.matching(topics) if from_block <= log['blockNumber'] <= to_block]
+
+    def matching(self, topics: list) -> list:
+        return [log for log in self.all_logs
+                if all(expected is None or log['topics'][index] in (expected if isinstance(expected, list) else [expected])
+                       for index, expected in enumerate(topics))]
+
+
+def take_log(block_number: int, log_index: int, pair: str, maker: Address, taker: Address) -> dict:
+    return {'blockNumber': block_number, 'logIndex': log_index, 'topics': [event_topic(LOG_TAKE_ABI), '0x' + '00' * 32, pair, topic(maker), topic(taker)]}
+
+
+def test_oasis_pair_is_keccak_of_packed_token_addresses():
+    # expect
+    assert oasis_pair(DAI, WETH) == keccak(bytes(19) + b'\xd1' + bytes(19) + b'\xe1')
+    assert oasis_pair(DAI, WETH) != oasis_pair(WETH, DAI)
+
+
+def test_past_take_of_queries_makers_and_takers_and_dedupes_logs(monkeypatch):
+    # given
+    monkeypatch.setattr(oasis, 'find_event_abi', lambda abi, name: LOG_TAKE_ABI)
+    monkeypatch.setattr(oasis, 'decode_logs', lambda abi, logs, cls: [(log['blockNumber'], log['logIndex']) for log in logs])
+
+    other = Address('0x00000000000000000000000000000000000000ff')
+    dai_weth, weth_dai = pair_topic(DAI, WETH), pair_topic(WETH, DAI)
+    event_store = FakeEventStore([take_log(10, 3, dai_weth, MAKER_1, other),
+                                  take_log(10, 1, weth_dai, other, MAKER_2),
+                                  take_log(11, 0, dai_weth, MAKER_1, MAKER_2),
+                                  take_log(12, 0, pair_topic(DAI, other), MAKER_1, other),
+                                  take_log(13, 0, dai_weth, other, other)])
+
+    otc = SimpleMarket.__new__(SimpleMarket)
+    otc.address = OTC
+
+    # when
+    takes = OasisEvents(otc, event_store).past_take_of(100, [MAKER_2, MAKER_1], WETH, DAI)
+
+    # then
+    assert takes == [(10, 1), (10, 3), (11, 0)]
+
+    # and
+    assert [request[1] for request in event_store.requests] == \
+           [[event_topic(LOG_TAKE_ABI), None, [dai_weth, weth_dai], [topic(MAKER_1), topic(MAKER_2)]],
+            [event_topic(LOG_TAKE_ABI), None, [dai_weth, weth_dai], None, [topic(MAKER_1), topic(MAKER_2)]]]
+    assert all(request[0] == OTC and request[2] == 100 for request in event_store.requests)
+
+
+def test_take_of_between_queries_explicit_block_ranges(monkeypatch):
+    # given
+    monkeypatch.setattr(oasis, 'find_event_abi', lambda abi, name: LOG_TAKE_ABI)
+    monkeypatch.setattr(oasis, 'decode_logs', lambda abi, logs, cls: [(log['blockNumber'], log['logIndex']) for log in logs])
+
+    other = Address('0x00000000000000000000000000000000000000ff')
+    dai_weth = pair_topic(DAI, WETH)
+    event_store = FakeEventStore([take_log(9, 0, dai_weth, MAKER_1, other),
+                                  take_log(10, 0, dai_weth, MAKER_1, MAKER_1),
+                                  take_log(15, 0, dai_weth, other, MAKER_1),
+                                  take_log(21, 0, dai_weth, MAKER_1, other)])
+
+    # when
+    takes = OasisEvents(market(), event_store).take_of_between(10, 20, [MAKER_1], WETH, DAI)
+
+    # then
+    assert takes == [(10, 0), (15, 0)]
+    assert [(request[0], request[2]) for request in event_store.requests] == [(OTC, (10, 20)), (OTC, (10, 20))]
+
+
+def test_order_events_of_and_take_between_query_explicit_block_ranges(monkeypatch):
+    # given
+    abis = {name: dict(LOG_TAKE_ABI, name=name) for name in ['LogMake', 'LogTake', 'LogKill']}
+    monkeypatch.setattr(oasis, 'find_event_abi', lambda abi, name: abis[name])
+    monkeypatch.setattr(oasis, 'decode_logs', lambda abi, logs, cls: [(abi['name'], log['blockNumber']) for log in logs])
+
+    other = Address('0x00000000000000000000000000000000000000ff')
+    dai_weth = pair_topic(DAI, WETH)
+    event_store = FakeEventStore([{'blockNumber': 5, 'topics': [event_topic(abis['LogMake']), '0x' + '00' * 32, dai_weth, topic(MAKER_1)]},
+                                  {'blockNumber': 6, 'topics': [event_topic(abis['LogMake']), '0x' + '00' * 32, dai_weth, topic(other)]},
+                                  take_log(7, 0, dai_weth, MAKER_1, other),
+                                  take_log(8, 0, dai_weth, other, MAKER_1),
+                                  take_log(20, 0, dai_weth, MAKER_1, other),
+                                  {'blockNumber': 9, 'topics': [event_topic(abis['LogKill']), '0x' + '00' * 32, dai_weth, topic(MAKER_1)]}])
+    otc_events = OasisEvents(market(), event_store)
+
+    # when
+    makes, takes, kills = otc_events.order_events_of(MAKER_1, 0, 10)
+
+    # then
+    assert (makes, takes, kills) == ([('LogMake', 5)], [('LogTake', 7)], [('LogKill', 9)])
+    assert [request[1:] for request in event_store.requests] == [([event_topic(abis[name]), None, None, [topic(MAKER_1)]], (0, 10))
+                                                                 for name in ['LogMake', 'LogTake', 'LogKill']]
+
+    # expect
+    assert otc_events.take_between(8, 20) == [('LogTake', 8), ('LogTake', 20)]
+    assert event_store.requests[-1][1:] == ([event_topic(abis['LogTake'])], (8, 20))
+
+def market() -> SimpleMarket:
+    otc = SimpleMarket.__new__(SimpleMarket)
+    otc.address = OTC
+    return otc
+
+
+def make(timestamp: int, order_id: int, pay_token: Address, pay_amount: int, buy_token: Address, buy_amount: int, maker: Address = MAKER_1):
+    return SimpleNamespace(timestamp=timestamp, order_id=order_id, maker=maker, pay_token=pay_token, pay_amount=Wad.from_number(pay_amount),
+                           buy_token=buy_token, buy_amount=Wad.from_number(buy_amount))
+
+
+def take(timestamp: int, order_id: int, pay_token: Address, take_amount: float, buy_token: Address, give_amount: float):
+    return SimpleNamespace(timestamp=timestamp, order_id=order_id, pay_token=pay_token, take_amount=Wad.from_number(take_amount),
+                           buy_token=buy_token, give_amount=Wad.from_number(give_amount))
+
+
+def kill(timestamp: int, order_id: int):
+    return SimpleNamespace(timestamp=timestamp, order_id=order_id)
+
+
+def steps(order_book_series) -> list:
+    return list(zip(order_book_series.timestamps, order_book_series.closest_sell_prices, order_book_series.closest_buy_prices))
+
+
+def assert_steps(actual: list, expected: list):
+    assert [step[0] for step in actual] == [step[0] for step in expected]
+    assert np.allclose([step[1:] for step in actual], [step[1:] for step in expected], equal_nan=True)
+
+
+def test_replay_emits_closest_prices_only_when_they_change():
+    # given
+    order_book = OasisOrderBook(market(), MAKER_1, DAI, WETH, [])
+    past_make = [make(100, 1, WETH, 1, DAI, 100),
+                 make(100, 2, DAI, 99, WETH, 1),
+                 make(200, 3, WETH, 2, DAI, 210),
+                 make(250, 4, WETH, 1, DAI, 90, maker=MAKER_2)]
+    past_take = [take(300, 1, WETH, 0.5, DAI, 50),
+                 take(500, 3, WETH, 2, DAI, 210)]
+    past_kill = [kill(400, 1)]
+
+    # when
+    closest_prices, snapshots = replay_closest_prices(order_book, past_make, past_take, past_kill, 50, 600, [100, 350])
+
+    # then
+    assert_steps(steps(closest_prices), [(50, np.nan, np.nan),
+                                         (100, 100.0, 99.0),
+                                         (400, 105.0, 99.0),
+                                         (500, np.nan, 99.0),
+                                         (600, np.nan, 99.0)])
+
+    # and
+    assert [sorted(record[0] for record in snapshot) for snapshot in snapshots] == [[1, 2], [1, 2, 3]]
+    assert [record[2] for record in snapshots[1] if record[0] == 1] == [str(Wad.from_number(0.5).value)]
+    assert sorted(order.order_id for order in order_book.orders()) == [2]
+
+
+def test_replay_applies_makes_then_takes_then_kills_within_the_same_timestamp():
+    # given
+    order_book = OasisOrderBook(market(), MAKER_1, DAI, WETH, [])
+    past_make = [make(100, 1, WETH, 1, DAI, 100),
+                 make(100, 2, DAI, 99, WETH, 1)]
+    past_take = [take(100, 1, WETH, 0.25, DAI, 25),
+                 take(100, 2, DAI, 49.5, WETH, 0.5)]
+    past_kill = [kill(100, 1)]
+
+    # when
+    closest_prices, snapshots = replay_closest_prices(order_book, past_make, past_take, past_kill, 50, 200, [100])
+
+    # then
+    assert_steps(steps(closest_prices), [(50, np.nan, np.nan),
+                                         (100, np.nan, 99.0),
+                                         (200, np.nan, 99.0)])
+    assert [[record[0] for record in snapshot] for snapshot in snapshots] == [[2]]
+    assert snapshots[0][0][2] == str(Wad.from_number(49.5).value)
+
+
+def test_order_book_drops_stale_heap_entries_lazily():
+    # given
+    order_book = OasisOrderBook(market(), MAKER_1, DAI, WETH, [])
+    order_book.apply_make(make(100, 1, WETH, 1, DAI, 100))
+    order_book.apply_make(make(100, 2, WETH, 1, DAI, 101))
+
+    # when
+    order_book.apply_take(take(200, 1, WETH, 0.5, DAI, 50))
+
+    # then
+    assert len(order_book._sell_heap) == 3
+    assert order_book.closest_sell_price() == 100.0
+
+    # when
+    order_book.apply_kill(kill(300, 1))
+
+    # then
+    assert len(order_book._sell_heap) == 3
+    assert order_book.closest_sell_price() == 101.0
+    assert len(order_book._sell_heap) == 1
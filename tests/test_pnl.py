@@ -15,8 +15,14 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from market_maker_stats.pnl import granularize_prices
-from market_maker_stats.util import Price
+from types import SimpleNamespace
+
+import numpy as np
+
+from market_maker_stats.pnl import granularize_prices, rolling_sums, get_approx_vwaps, get_multi_approx_vwaps, daily_pnl, \
+    stream_pnl, stream_daily_pnl, prepare_trades_for_pnl, calculate_pnl
+from market_maker_stats.util import Price, PriceSeries
+from pymaker import Wad
 
 
 def test_granularize_prices_fills_gaps():
@@ -27,7 +33,7 @@ def test_granularize_prices_fills_gaps():
               Price(1518440880, 1.2, None, None, 18)]
 
     # when
-    granularized_prices = granularize_prices(prices)
+    granularized_prices = granularize_prices(PriceSeries.from_prices(prices)).to_prices()
 
     # then
     assert granularized_prices == [Price(1518440700, 1.5, None, None, 10),
@@ -45,7 +51,7 @@ def test_granularize_prices_fills_gaps_even_if_seconds_are_uneven():
               Price(1518440851, 1.2, None, None, 18)]
 
     # when
-    granularized_prices = granularize_prices(prices)
+    granularized_prices = granularize_prices(PriceSeries.from_prices(prices)).to_prices()
 
     # then
     assert granularized_prices == [Price(1518440759, 1.5, None, None, 10),
@@ -65,10 +71,126 @@ def test_granularize_prices_removes_duplicates():
               Price(1518440910, 1.1, None, None, 29),]
 
     # when
-    granularized_prices = granularize_prices(prices)
+    granularized_prices = granularize_prices(PriceSeries.from_prices(prices)).to_prices()
 
     # then
     assert granularized_prices == [Price(1518440700, 1.5, None, None, 10),
                                    Price(1518440760, 1.7, None, None, 14),
                                    Price(1518440820, 0, 0, 0, 0),
                                    Price(1518440885, 1.2, None, None, 18)]
+
+
+def test_rolling_sums_match_naive_sums_across_blocks():
+    # given
+    values = np.random.RandomState(0).uniform(0, 1000, 5000)
+
+    # when
+    sums = rolling_sums(values, 240, block_size=1000)
+
+    # then
+    assert len(sums) == 5000 - 240 + 1
+    assert np.allclose(sums, [np.sum(values[i:i+240]) for i in range(len(sums))], rtol=1e-12)
+
+
+def test_get_approx_vwaps():
+    # given
+    # 1518440700 = 2018-02-12 13:05:00 UTC
+    prices = [Price(1518440700, 1.0, None, None, 10),
+              Price(1518440760, 2.0, None, None, 30),
+              Price(1518440880, 4.0, None, None, 10),
+              Price(1518440940, None, None, None, 10)]
+
+    # when
+    vwaps = get_approx_vwaps(PriceSeries.from_prices(prices), 2)
+
+    # then
+    assert np.allclose(vwaps, [1.75, 2.0, 4.0, np.nan], equal_nan=True)
+
+
+def test_get_multi_approx_vwaps_match_single_window_vwaps():
+    # given
+    # 1518440700 = 2018-02-12 13:05:00 UTC
+    prices = [Price(1518440700 + 60*i, 1.0 + (i % 7), None, None, 1 + (i % 5)) for i in range(3000)]
+    prices[1500] = Price(prices[1500].timestamp, None, None, None, 10)
+
+    # when
+    vwaps = get_multi_approx_vwaps(PriceSeries.from_prices(prices), [1, 15, 240])
+
+    # then
+    assert len(vwaps) == 3
+    for window, window_vwaps in zip([1, 15, 240], vwaps):
+        assert np.allclose(window_vwaps, get_approx_vwaps(PriceSeries.from_prices(prices), window), equal_nan=True)
+        assert np.isnan(window_vwaps[1500])
+
+
+def test_daily_pnl():
+    # given
+    # 1518440700 = 2018-02-12 13:05:00 UTC
+    trades = [SimpleNamespace(timestamp=1518440700, is_sell=True, money=Wad.from_number(10), amount=Wad.from_number(5), price=Wad.from_number(2)),
+              SimpleNamespace(timestamp=1518440760, is_sell=False, money=Wad.from_number(4), amount=Wad.from_number(1), price=Wad.from_number(4)),
+              SimpleNamespace(timestamp=1518440700 + 86400, is_sell=False, money=Wad.from_number(3), amount=Wad.from_number(1), price=Wad.from_number(3))]
+    vwaps = np.array([3.0, 3.0, np.nan])
+
+    # when
+    days = daily_pnl(trades, [vwaps], 1518440700)
+
+    # then
+    assert days['days'] == ['2018-02-12', '2018-02-13']
+    assert list(days['counts']) == [2, 1]
+    assert list(days['volumes']) == [14.0, 3.0]
+    assert list(days['bought']) == [10.0, 0.0]
+    assert list(days['sold']) == [4.0, 3.0]
+    assert list(days['nets']) == [6.0, -3.0]
+    assert list(days['profits'][0]) == [-5.0 - 1.0, 0.0]
+    assert list(days['missing_profits']) == [False, False]
+
+
+def random_history():
+    # 1518440700 = 2018-02-12 13:05:00 UTC
+    random = np.random.RandomState(1)
+    timestamps = 1518440700 + np.cumsum(random.choice([0, 10, 60, 60, 60, 300], size=5000))
+    prices = [Price(int(timestamp), float(random.uniform(1, 2)) if random.rand() > 0.01 else None, None, None, float(random.uniform(0, 10)))
+              for timestamp in timestamps]
+    trades = [SimpleNamespace(timestamp=int(timestamp), is_sell=bool(random.rand() > 0.5), amount=Wad.from_number(random.uniform(0, 5)), money=Wad.from_number(1), price=Wad.from_number(random.uniform(1, 2)))
+              for timestamp in np.sort(random.randint(int(timestamps[0]), int(timestamps[-1]), size=1000))]
+
+    price_series = PriceSeries.from_prices(prices)
+    price_batches = [price_series[index:index + 300] for index in range(0, len(price_series), 300)]
+
+    return trades, price_series, price_batches
+
+
+def test_stream_pnl_matches_calculate_pnl():
+    # given
+    trades, price_series, price_batches = random_history()
+
+    # when
+    streamed = list(stream_pnl(trades, price_batches, [60, 240]))
+
+    # then
+    pnl_trades, pnl_prices, pnl_timestamps = prepare_trades_for_pnl(trades)
+    assert np.array_equal(np.concatenate([batch_timestamps for batch_timestamps, _ in streamed]), pnl_timestamps)
+
+    for index, vwaps in enumerate(get_multi_approx_vwaps(price_series, [60, 240])):
+        expected_profits = calculate_pnl(pnl_trades, pnl_prices, pnl_timestamps, vwaps, int(price_series.timestamps[0]))
+        assert np.allclose(np.concatenate([profits[index] for _, profits in streamed]), expected_profits, equal_nan=True)
+
+
+def test_stream_daily_pnl_matches_daily_pnl():
+    # given
+    trades, price_series, price_batches = random_history()
+
+    # when
+    days, vwaps_start = stream_daily_pnl(trades, iter(price_batches), [60, 240])
+
+    # then
+    expected_days = daily_pnl(trades, get_multi_approx_vwaps(price_series, [60, 240]), int(price_series.timestamps[0]))
+    assert vwaps_start == int(price_series.timestamps[0])
+    assert days['days'] == expected_days['days']
+    assert list(days['counts']) == list(expected_days['counts'])
+    assert list(days['missing_profits']) == list(expected_days['missing_profits'])
+    for profits, expected_profits in zip(days['profits'], expected_days['profits']):
+        assert np.allclose(profits, expected_profits)
+
+    # and
+    assert stream_daily_pnl(trades, iter([]), [60])[1] == -1
@@ -0,0 +1,105 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+from market_maker_stats import rpc
+from market_maker_stats.rpc import batch_request
+
+
+class FakeSession:
+    def __init__(self, responses: list):
+        self.responses = responses
+        self.payloads = []
+
+    def post(self, endpoint_uri: str, json: list, timeout: float):
+        self.payloads.append(json)
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+
+        status_code, data = response
+        return SimpleNamespace(ok=status_code < 400, status_code=status_code, reason='Reason', json=lambda: data(json) if callable(data) else data)
+
+
+@pytest.fixture
+def session(monkeypatch):
+    def install(responses: list) -> FakeSession:
+        fake_session = FakeSession(responses)
+        monkeypatch.setattr(rpc, '_session', lambda pool_size: fake_session)
+        monkeypatch.setattr(rpc.time, 'sleep', lambda seconds: None)
+        return fake_session
+
+    return install
+
+
+def test_responses_get_matched_by_id(session):
+    # given
+    def reversed_responses(payload: list) -> list:
+        return [{'jsonrpc': '2.0', 'id': call['id'], 'result': call['params'][0]} for call in reversed(payload)]
+
+    fake_session = session([(200, reversed_responses), (200, reversed_responses)])
+
+    # when
+    results = batch_request('http://node', 'eth_getBlockByNumber', [[number] for number in range(5)], batch_size=3, max_workers=1)
+
+    # then
+    assert results == [0, 1, 2, 3, 4]
+    assert [len(payload) for payload in fake_session.payloads] == [3, 2]
+
+
+def test_transient_errors_get_retried(session):
+    # given
+    fake_session = session([requests.exceptions.ConnectionError('reset'), (503, None), (200, [{'jsonrpc': '2.0', 'id': 0, 'result': 'ok'}])])
+
+    # expect
+    assert batch_request('http://node', 'eth_blockNumber', [[]]) == ['ok']
+    assert len(fake_session.payloads) == 3
+
+
+def test_errors_reported_by_the_node_are_not_retried(session):
+    # given
+    fake_session = session([(200, {'jsonrpc': '2.0', 'id': None, 'error': {'code': -32600, 'message': 'batch too large'}})])
+
+    # expect
+    with pytest.raises(Exception, match='batch too large'):
+        batch_request('http://node', 'eth_getBlockByNumber', [['0x1']])
+
+    assert len(fake_session.payloads) == 1
+
+    # and
+    session([(200, [{'jsonrpc': '2.0', 'id': 0, 'error': {'message': 'header not found'}}])])
+    with pytest.raises(Exception, match='header not found'):
+        batch_request('http://node', 'eth_getBlockByNumber', [['0x1']])
+
+    # and
+    session([(200, [{'jsonrpc': '2.0', 'id': 1, 'result': None}])])
+    with pytest.raises(Exception, match='no responses'):
+        batch_request('http://node', 'eth_getBlockByNumber', [['0x1']])
+
+
+def test_gives_up_after_max_retries(session):
+    # given
+    fake_session = session([(502, None)] * 6)
+
+    # expect
+    with pytest.raises(Exception, match='gave up after 6 attempts'):
+        batch_request('http://node', 'eth_blockNumber', [[]])
+
+    assert len(fake_session.payloads) == 6
@@ -0,0 +1,70 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from market_maker_stats.snapshots import OrderBookSnapshots
+
+
+def test_snapshots_return_the_latest_one_before_block(tmpdir):
+    # given
+    snapshots = OrderBookSnapshots('key', filename=str(tmpdir.join('snapshots.json')))
+    snapshots.add(1000, 1518393600, [[1, '0x01', '10', '0x02', '20', 1518390000]])
+    snapshots.add(2000, 1518408000, [])
+
+    # expect
+    assert OrderBookSnapshots('key', filename=str(tmpdir.join('snapshots.json'))).latest(999) is None
+    assert snapshots.latest(1000) == {'block_number': 1000, 'timestamp': 1518393600, 'orders': [[1, '0x01', '10', '0x02', '20', 1518390000]]}
+    assert snapshots.latest(1999)['block_number'] == 1000
+    assert snapshots.latest(5000)['block_number'] == 2000
+
+
+def test_snapshots_get_thinned_out_by_age(tmpdir):
+    # given
+    snapshots = OrderBookSnapshots('key', max_snapshots=3, filename=str(tmpdir.join('snapshots.json')))
+
+    # when
+    for block_number in [3000, 1000, 2000, 2000, 2900]:
+        snapshots.add(block_number, block_number, [])
+
+    # then
+    assert [snapshot['block_number'] for snapshot in snapshots._read()] == [1000, 2900, 3000]
+    assert snapshots.latest(2500)['block_number'] == 1000
+    assert snapshots.latest(999) is None
+
+
+# Simulates the chart tool run every 40 blocks: each run replays from the latest snapshot at or before
+# the chart start and stores new snapshots at the chart start and at the most recent confirmed block.
+def test_sequential_chart_runs_always_find_a_recent_snapshot(tmpdir):
+    # given
+    snapshots = OrderBookSnapshots('key', max_snapshots=16, filename=str(tmpdir.join('snapshots.json')))
+    past_blocks, confirmations = 6000, 12
+
+    # expect
+    for run in range(400):
+        block_number = 100000 + run * 40
+        start_block = block_number - past_blocks
+        snapshot = snapshots.latest(start_block)
+
+        if run > 0:
+            assert snapshot is not None
+            assert start_block - snapshot['block_number'] <= past_blocks
+
+        from_block = snapshot['block_number'] + 1 if snapshot is not None else start_block
+        for snapshot_block in [start_block, block_number - confirmations]:
+            if from_block <= snapshot_block:
+                snapshots.add(snapshot_block, snapshot_block, [])
+
+    # and
+    assert len(snapshots._read()) == 16
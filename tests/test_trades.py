@@ -0,0 +1,74 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+from types import SimpleNamespace
+
+from market_maker_stats.trades import json_market_maker_trades, text_trades
+from market_maker_stats.util import market_maker_reports
+from pymaker import Address
+from pymaker.numeric import Wad
+
+MAKER_1 = Address('0x00000000000000000000000000000000000000a1')
+MAKER_2 = Address('0x00000000000000000000000000000000000000b2')
+TAKER = Address('0x00000000000000000000000000000000000000c3')
+
+
+def trade(maker: Address, timestamp: int, taker: Address = TAKER) -> SimpleNamespace:
+    return SimpleNamespace(exchange='OasisDEX', maker=maker.address, pair='WETH-DAI', timestamp=timestamp,
+                           price=Wad.from_number(500), amount=Wad.from_number(1), money=Wad.from_number(500),
+                           is_sell=True, taker=taker)
+
+
+def test_trades_of_many_market_makers_are_listed_as_a_single_json_document(capsys):
+    # given
+    reports = market_maker_reports({MAKER_1: [trade(MAKER_1, 10), trade(MAKER_1, 20, MAKER_2)],
+                                    MAKER_2: [trade(MAKER_2, 30)]})
+
+    # when
+    json_market_maker_trades(reports, None, include_taker=True)
+
+    # then
+    document = json.loads(capsys.readouterr().out)
+    assert sorted(document.keys()) == sorted([MAKER_1.address, MAKER_2.address, 'all'])
+    assert [item['timestamp'] for item in document[MAKER_1.address]] == [10, 20]
+    assert [item['timestamp'] for item in document['all']] == [10, 30]
+
+
+def test_trades_of_a_single_market_maker_are_listed_as_a_json_array(tmpdir):
+    # given
+    output = str(tmpdir.join('trades.json'))
+
+    # when
+    json_market_maker_trades(market_maker_reports({MAKER_1: [trade(MAKER_1, 10)]}), output)
+
+    # then
+    with open(output) as file:
+        assert [item['timestamp'] for item in json.load(file)] == [10]
+
+
+def test_text_trades_are_titled_with_the_market_maker(capsys):
+    # when
+    text_trades('DAI', 'WETH', [trade(MAKER_1, 10)], None, market_maker='all 2 market makers')
+    titled = capsys.readouterr().out
+
+    text_trades('DAI', 'WETH', [trade(MAKER_1, 10)], None)
+    untitled = capsys.readouterr().out
+
+    # then
+    assert titled.startswith("Trades of all 2 market makers:\n\n")
+    assert not untitled.startswith("Trades of")
@@ -0,0 +1,275 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import pytz
+from web3 import Web3
+
+from market_maker_stats import util
+from market_maker_stats.util import Price, PriceSeries, market_maker_addresses, market_maker_reports, market_maker_output, \
+    OrderHistoryItem, TokenBucket, gdax_fetch, OrderBookSeries, timestamp_to_x, timestamps_to_x, rollup_prices, price_resolution, \
+    get_deployment_block
+from pymaker import Address
+
+
+def test_price_series_round_trips_missing_values():
+    # given
+    prices = [Price(1518440700, 1.5, None, None, 10),
+              Price(1518440760, None, 1.6, 1.8, None)]
+
+    # expect
+    assert PriceSeries.from_prices(prices).to_prices() == prices
+
+
+def test_price_series_inverse():
+    # given
+    prices = PriceSeries.from_prices([Price(1518440700, 2.0, None, 4.0, 10),
+                                      Price(1518440760, 0.5, 0.25, None, 12)])
+
+    # expect
+    assert prices.inverse().to_prices() == [Price(1518440700, 0.5, None, 0.25, 10),
+                                            Price(1518440760, 2.0, 4.0, None, 12)]
+
+
+def test_price_series_between_and_gaps():
+    # given
+    # 1518440700 = 2018-02-12 13:05:00 UTC
+    prices = PriceSeries.from_prices([Price(1518440700, 1.5, None, None, 10),
+                                      Price(1518440760, 1.7, None, None, 14),
+                                      Price(1518441060, 1.2, None, None, 18),
+                                      Price(1518441120, 1.1, None, None, 29)])
+
+    # expect
+    assert prices.between(1518440760, 1518441060).to_prices() == [Price(1518440760, 1.7, None, None, 14),
+                                                                  Price(1518441060, 1.2, None, None, 18)]
+    assert np.array_equal(prices.gaps(180), [2])
+
+
+def test_market_maker_addresses_from_arguments_and_file(tmpdir):
+    # given
+    address_file = tmpdir.join('addresses.txt')
+    address_file.write("# our keepers\n0x00000000000000000000000000000000000000B2\n\n0x00000000000000000000000000000000000000a1\n")
+
+    # when
+    addresses = market_maker_addresses(['0x00000000000000000000000000000000000000A1'], str(address_file))
+
+    # then
+    assert addresses == [Address('0x00000000000000000000000000000000000000a1'),
+                         Address('0x00000000000000000000000000000000000000b2')]
+
+
+def test_market_maker_reports():
+    # given
+    maker_1 = Address('0x00000000000000000000000000000000000000a1')
+    maker_2 = Address('0x00000000000000000000000000000000000000b2')
+    taker = Address('0x00000000000000000000000000000000000000c3')
+    trades_by_maker = {maker_1: [SimpleNamespace(timestamp=10, taker=taker), SimpleNamespace(timestamp=30, taker=taker)],
+                       maker_2: [SimpleNamespace(timestamp=20, taker=taker)]}
+
+    # when
+    reports = market_maker_reports(trades_by_maker)
+
+    # then
+    assert [(market_maker, market_maker_output('pnl.txt', suffix)) for market_maker, _, suffix in reports] == \
+           [(maker_1.address, f'pnl-{maker_1.address}.txt'), (maker_2.address, f'pnl-{maker_2.address}.txt'), ('all 2 market makers', 'pnl.txt')]
+    assert [trade.timestamp for trade in reports[2][1]] == [10, 20, 30]
+
+    # and
+    assert market_maker_reports({maker_1: trades_by_maker[maker_1]}) == [(None, trades_by_maker[maker_1], None)]
+    assert market_maker_output(None, maker_1.address) is None
+
+
+def test_market_maker_reports_leave_trades_between_market_makers_out_of_the_aggregate():
+    # given
+    maker_1 = Address('0x00000000000000000000000000000000000000a1')
+    maker_2 = Address('0x00000000000000000000000000000000000000b2')
+    taker = Address('0x00000000000000000000000000000000000000c3')
+
+    # and
+    # the trade at 20 is an internal one, which both market makers have got in their trades
+    trades_by_maker = {maker_1: [SimpleNamespace(timestamp=10, taker=taker), SimpleNamespace(timestamp=20, taker=maker_2, is_sell=True)],
+                       maker_2: [SimpleNamespace(timestamp=20, taker=maker_1, is_sell=False), SimpleNamespace(timestamp=30, taker=taker)]}
+
+    # when
+    reports = market_maker_reports(trades_by_maker)
+
+    # then
+    assert [trade.timestamp for trade in reports[0][1]] == [10, 20]
+    assert [trade.timestamp for trade in reports[1][1]] == [20, 30]
+    assert [trade.timestamp for trade in reports[2][1]] == [10, 30]
+
+
+def test_order_book_series_from_order_history():
+    # given
+    items = [OrderHistoryItem(timestamp=10, orders=[{'type': 'sell', 'price': 101.0}, {'type': 'sell', 'price': 100.5}, {'type': 'buy', 'price': 99.0}]),
+             OrderHistoryItem(timestamp=20, orders=[{'type': 'buy', 'price': 98.0}, {'type': 'buy', 'price': 99.5}]),
+             OrderHistoryItem(timestamp=30, orders=[])]
+
+    # when
+    order_book = OrderBookSeries.from_order_history(items)
+
+    # then
+    assert list(order_book.timestamps) == [10, 20, 30]
+    assert np.allclose(order_book.closest_sell_prices, [100.5, np.nan, np.nan], equal_nan=True)
+    assert np.allclose(order_book.closest_buy_prices, [99.0, 99.5, np.nan], equal_nan=True)
+    assert list(order_book[1:].timestamps) == [20, 30]
+
+
+def test_timestamps_to_x_matches_date2num():
+    # given
+    from matplotlib.dates import date2num
+    timestamps = np.array([0, 1518440700, 1518440761, 1530000000], dtype=np.int64)
+
+    # expect
+    expected = [date2num(datetime.datetime.fromtimestamp(int(timestamp), tz=pytz.UTC)) for timestamp in timestamps]
+    assert np.allclose(timestamps_to_x(timestamps), expected, rtol=0, atol=1e-9)
+    assert timestamp_to_x(1518440700) == timestamps_to_x([1518440700])[0]
+
+
+def test_rollup_prices_weights_by_volume_when_known():
+    # given
+    prices = PriceSeries(timestamps=[1518440700, 1518440760, 1518441000, 1518441060],
+                         prices=[10.0, 20.0, 30.0, 50.0],
+                         buy_prices=[9.0, np.nan, np.nan, np.nan],
+                         sell_prices=[np.nan, np.nan, np.nan, np.nan],
+                         volumes=[3.0, 1.0, np.nan, np.nan])
+
+    # when
+    rolled_up = rollup_prices(prices, price_resolution(400))
+
+    # then
+    assert list(rolled_up.timestamps) == [1518440700, 1518441000]
+    assert list(rolled_up.prices) == [12.5, 40.0]
+    assert list(rolled_up.volumes) == [4.0, 0.0]
+    assert np.allclose(rolled_up.buy_prices, [9.0, np.nan], equal_nan=True)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_token_bucket_allows_bursts_and_then_limits_the_rate(monkeypatch):
+    # given
+    clock = FakeClock()
+    monkeypatch.setattr(util, 'time', clock)
+    bucket = TokenBucket(rate=2, capacity=3)
+
+    # when
+    for _ in range(5):
+        bucket.acquire()
+
+    # then
+    assert clock.sleeps == [0.5, 0.5]
+
+    # when
+    clock.now += 10
+    for _ in range(3):
+        bucket.acquire()
+
+    # then
+    assert clock.sleeps == [0.5, 0.5]
+
+
+class FakeGdax:
+    def __init__(self, responses: list):
+        self.responses = responses
+        self.requests = 0
+        self.acquired = 0
+
+    def acquire(self):
+        self.acquired += 1
+
+    def get(self, url, timeout):
+        self.requests += 1
+        response = self.responses.pop(0) if len(self.responses) > 0 else {'message': 'Rate limit exceeded'}
+        if isinstance(response, Exception):
+            raise response
+
+        return SimpleNamespace(json=lambda: response)
+
+
+@pytest.fixture
+def gdax(monkeypatch):
+    def setup(responses: list):
+        clock = FakeClock()
+        fake_gdax = FakeGdax(responses)
+        monkeypatch.setattr(util, 'time', clock)
+        monkeypatch.setattr(util, 'requests', SimpleNamespace(get=fake_gdax.get))
+        monkeypatch.setattr(util, 'gdax_rate_limiter', fake_gdax)
+        monkeypatch.setattr(util.random, 'uniform', lambda low, high: high)
+        return clock, fake_gdax
+
+    return setup
+
+
+def test_gdax_fetch_retries_api_and_network_errors(gdax):
+    # given
+    clock, fake_gdax = gdax([{'message': 'Rate limit exceeded'}, ConnectionError('connection reset'), [[1518393600, 1, 2, 1, 2, 5]]])
+
+    # when
+    data = gdax_fetch('https://api.gdax.com/products/ETH-USD/candles')
+
+    # then
+    assert data == [[1518393600, 1, 2, 1, 2, 5]]
+    assert fake_gdax.requests == 3
+    assert fake_gdax.acquired == 3
+    assert clock.sleeps == [0.5, 1.0]
+
+
+def test_gdax_fetch_backs_off_exponentially_and_gives_up(gdax):
+    # given
+    clock, fake_gdax = gdax([])
+
+    # when
+    with pytest.raises(Exception, match="after 9 attempts"):
+        gdax_fetch('https://api.gdax.com/products/ETH-USD/candles')
+
+    # then
+    assert fake_gdax.requests == 9
+    assert clock.sleeps == [0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 60.0]
+
+
+def test_deployment_block_is_the_first_block_with_contract_code():
+    # given
+    contract = Address('0x00000000000000000000000000000000000000c1')
+    requests = []
+
+    class FakeWeb3(Web3):
+        def __init__(self):
+            self.manager = SimpleNamespace(request_blocking=self.request_blocking)
+
+        def request_blocking(self, method, params):
+            requests.append((method, params))
+            return '0x6060' if int(params[1], 16) >= 4000000 else '0x'
+
+    # expect
+    assert get_deployment_block(FakeWeb3(), contract, 5000000) == 4000000
+    assert all(method == 'eth_getCode' and params[0] == contract.address for method, params in requests)
+    assert len(requests) <= 23